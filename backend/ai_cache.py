@@ -0,0 +1,236 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# TTL + LRU cache for AI coach messages.
+# - Keys are bucketed prompt signatures, so many users share one entry.
+# - Identical concurrent misses are coalesced into a single upstream call (single-flight),
+#   for whole messages (get_or_compute) and for token streams (stream).
+# - Optionally backed by a local SQLite table (AI_CACHE_DB) so entries survive restarts.
+#   Table reads/writes run in a worker thread (fetch/store), never on the event loop;
+#   expired rows are purged every PURGE_INTERVAL seconds rather than on each write.
+PURGE_INTERVAL = 300
+
+class _SharedStream:
+    """Chunks of one upstream stream so far, replayed to every caller following it."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.followers = 0
+        self.task = None
+        self.changed = asyncio.Event()  # Replaced after each set(), so waiters see every update
+
+    def _notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def push(self, chunk):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error=None):
+        self.done, self.error = True, error
+        self._notify()
+
+class FeedbackCache:
+    def __init__(self, ttl: float = 600, max_entries: int = 1024, persist_path: str = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, message), oldest first
+        self._inflight = {}  # key -> asyncio.Task filling that key
+        self._streams = {}  # key -> _SharedStream being produced for that key
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()  # One sqlite3 connection shared by worker threads
+        self._last_purge = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.persisted_hits = 0
+
+        self._db = None
+        if persist_path:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ai_feedback_cache "
+                "(key TEXT PRIMARY KEY, message TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.commit()
+            self._purge_expired()
+
+    def get(self, key: str):
+        """In-memory cached message for `key`, or None. Never touches the persistent table."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                del self._entries[key]
+            return None
+
+    def set(self, key: str, message: str, expires_at: float = None):
+        with self._lock:
+            self._store(key, message, expires_at or time.time() + self.ttl)
+
+    async def fetch(self, key: str):
+        """get(), falling through to the persistent table (in a worker thread) on a memory miss."""
+        message = self.get(key)
+        if message is not None or self._db is None:
+            return message
+        row = await asyncio.to_thread(self._load, key)
+        if not row:
+            return None
+        self.persisted_hits += 1
+        self.set(key, row[0], row[1])
+        return row[0]
+
+    async def store(self, key: str, message: str):
+        """set(), then write the entry through to the persistent table in a worker thread."""
+        expires_at = time.time() + self.ttl
+        self.set(key, message, expires_at)
+        if self._db is not None:
+            await asyncio.to_thread(self._persist, key, message, expires_at)
+
+    def _load(self, key):
+        with self._db_lock:
+            return self._db.execute(
+                "SELECT message, expires_at FROM ai_feedback_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+
+    def _persist(self, key, message, expires_at):
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO ai_feedback_cache (key, message, expires_at) VALUES (?, ?, ?)",
+                (key, message, expires_at)
+            )
+            self._db.commit()
+        if time.time() - self._last_purge >= PURGE_INTERVAL:
+            self._purge_expired()
+
+    def _purge_expired(self):
+        with self._db_lock:
+            self._last_purge = time.time()
+            self._db.execute("DELETE FROM ai_feedback_cache WHERE expires_at <= ?", (self._last_purge,))
+            self._db.commit()
+
+    def _store(self, key, message, expires_at):
+        self._entries[key] = (expires_at, message)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def lookup(self, key: str):
+        """fetch(), counted as a hit when found."""
+        message = await self.fetch(key)
+        if message is not None:
+            self.hits += 1
+        return message
+
+    async def get_or_compute(self, key: str, compute):
+        """Return the cached message, or run `compute()` once for all concurrent callers of `key`.
+
+        Failures are not cached; every waiter sees the exception. The fill runs as
+        its own task, so a caller that disconnects does not cancel it for the others.
+        """
+        message = await self.lookup(key)
+        if message is not None:
+            return message
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fill(key, compute))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _fill(self, key, compute):
+        message = await compute()
+        await self.store(key, message)
+        return message
+
+    async def stream(self, key: str, produce):
+        """Yield the chunks of one shared `produce()` stream to every concurrent caller of `key`.
+
+        Callers that join late first get the chunks produced so far. The joined,
+        stripped message is cached once the stream completes; failures reach every
+        caller and are not cached. When every caller has gone away the upstream
+        stream is cancelled (and nothing is cached). Check lookup() first.
+        """
+        flight = self._streams.get(key)
+        if flight is None:
+            self.misses += 1
+            flight = self._streams[key] = _SharedStream()
+            flight.task = asyncio.ensure_future(self._produce(key, flight, produce))
+        else:
+            self.coalesced += 1
+
+        flight.followers += 1
+        sent = 0
+        try:
+            while True:
+                changed = flight.changed
+                while sent < len(flight.chunks):
+                    sent += 1
+                    yield flight.chunks[sent - 1]
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await changed.wait()
+        finally:
+            flight.followers -= 1
+            if not flight.followers and not flight.done:
+                self._drop_stream(key, flight)
+                flight.task.cancel()
+
+    async def _produce(self, key, flight, produce):
+        chunks = produce()
+        try:
+            async for chunk in chunks:
+                flight.push(chunk)
+            await self.store(key, "".join(flight.chunks).strip())
+            flight.finish()
+        except Exception as e:
+            flight.finish(e)
+        finally:
+            self._drop_stream(key, flight)
+            await chunks.aclose()
+
+    def _drop_stream(self, key, flight):
+        if self._streams.get(key) is flight:
+            del self._streams[key]
+
+    def _finish(self, key, task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # Mark retrieved even if every waiter went away
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "persisted_hits": self.persisted_hits,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight) + len(self._streams),
+            "ttl_seconds": self.ttl,
+            "max_entries": self.max_entries,
+            "persistent": self._db is not None
+        }
+
+feedback_cache = FeedbackCache(
+    ttl=float(os.getenv("AI_CACHE_TTL", "600")),
+    max_entries=int(os.getenv("AI_CACHE_MAX_ENTRIES", "1024")),
+    persist_path=os.getenv("AI_CACHE_DB") or None
+)
@@ -1,22 +1,37 @@
 import os
+import json
+import asyncio
+import hashlib
+import hmac
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import List, Optional
 
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Request
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.middleware.gzip import GZipMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from groq import Groq
 
 # SQLAlchemy Imports
-from sqlalchemy.orm import Session
-from sqlalchemy import desc, func
-from database import SessionLocal, engine, get_db
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import desc, event, func, cast, case, insert, literal, select, true, update, DateTime, String, or_, and_
+from database import SessionLocal, engine, async_engine, get_db, run_db, pool_stats
 import models
+from ai_cache import feedback_cache
+from llm_client import llm_client, LLMUnavailableError
+from leaderboard_events import create_broker
+import metrics
 
 # --- CONFIGURATION ---
 load_dotenv()
-app = FastAPI(title="SmartSip API")
+# orjson for every JSON response (several times faster than the stdlib encoder on
+# large payloads such as /stats?days=365 and leaderboards)
+app = FastAPI(title="SmartSip API", default_response_class=ORJSONResponse)
 
 # CORS Configuration
 # In production, set CORS_ORIGINS to your frontend domain(s)
@@ -35,46 +50,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize Database (Create tables if not exist)
-models.Base.metadata.create_all(bind=engine)
+# Response compression above GZIP_MIN_SIZE bytes. Event streams pass through
+# untouched: gzip would buffer them and hold back SSE events.
+class StreamAwareGZipMiddleware(GZipMiddleware):
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and (
+            scope["path"].endswith("/stream")
+            or b"text/event-stream" in dict(scope["headers"]).get(b"accept", b"")
+        ):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
 
-# --- DATABASE MIGRATION: Add new columns to existing tables ---
-# This runs on startup to handle schema changes without Alembic
-def run_migrations():
-    from sqlalchemy import text
-    try:
-        with engine.connect() as conn:
-            # Add default_goal to users table
-            try:
-                conn.execute(text("ALTER TABLE users ADD COLUMN default_goal INTEGER DEFAULT 2500"))
-                conn.commit()
-                print("[Migration] Added default_goal column to users table")
-            except Exception as e:
-                conn.rollback()
-                if "already exists" not in str(e).lower() and "duplicate" not in str(e).lower():
-                    print(f"[Migration] default_goal: {e}")
-            
-            # Add local_date to water_intake table
-            try:
-                conn.execute(text("ALTER TABLE water_intake ADD COLUMN local_date VARCHAR(10)"))
-                conn.commit()
-                print("[Migration] Added local_date column to water_intake table")
-            except Exception as e:
-                conn.rollback()
-                if "already exists" not in str(e).lower() and "duplicate" not in str(e).lower():
-                    print(f"[Migration] local_date: {e}")
-            
-            # Add default_drink_amount to users table
-            try:
-                conn.execute(text("ALTER TABLE users ADD COLUMN default_drink_amount INTEGER DEFAULT 200"))
-                conn.commit()
-                print("[Migration] Added default_drink_amount column to users table")
-            except Exception as e:
-                conn.rollback()
-                if "already exists" not in str(e).lower() and "duplicate" not in str(e).lower():
-                    print(f"[Migration] default_drink_amount: {e}")
-    except Exception as e:
-        print(f"[Migration] WARNING - Migration failed (non-fatal): {e}")
+app.add_middleware(StreamAwareGZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1000")))
+
+# Per-route latency, DB time and statement counts (served at /metrics)
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.install_sql_hooks(engine, async_engine.sync_engine if async_engine is not None else None)
+
+# Initialize Database: apply pending schema migrations (see migrations.py)
+from migrations import run_migrations
 
 try:
     run_migrations()
@@ -85,19 +80,140 @@ except Exception as e:
 # (simulating the single-user local mode until full Auth is added)
 DEFAULT_USER_ID = "test-user"
 
+# --- USERS ---
+# Every write path needs its user row to exist. ensure_user() is one
+# INSERT ... ON CONFLICT DO NOTHING in the caller's transaction (two devices racing
+# on a first write can't fail), and ids already resolved are remembered:
+# - per session in db.info, so repeated calls within a request are free
+# - per process in a bounded LRU, filled only after the inserting transaction
+#   commits, so the hot path does no user-table statements at all
+KNOWN_USERS_MAX = int(os.getenv("KNOWN_USERS_MAX", "10000"))
+
+class KnownUsers:
+    """Thread-safe LRU set of user ids known to exist in the database."""
+
+    def __init__(self, max_entries: int = KNOWN_USERS_MAX):
+        self.max_entries = max_entries
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, user_id):
+        with self._lock:
+            if user_id in self._ids:
+                self._ids.move_to_end(user_id)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def add(self, user_id):
+        with self._lock:
+            self._ids[user_id] = True
+            self._ids.move_to_end(user_id)
+            while len(self._ids) > self.max_entries:
+                self._ids.popitem(last=False)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._ids.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._ids), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+known_users = KnownUsers()
+
+def ensure_user(db: Session, user_id: str):
+    """Make sure the user row exists, without committing. Returns True if it was just created."""
+    resolved = db.info.setdefault("resolved_users", set())
+    if user_id in resolved:
+        return False
+    if user_id in known_users:
+        resolved.add(user_id)
+        return False
+    
+    created = db.execute(
+        _dialect_insert(db, models.User).values(id=user_id, is_guest=True).on_conflict_do_nothing(index_elements=["id"])
+    ).rowcount == 1
+    resolved.add(user_id)
+    if created:
+        db.info.setdefault("pending_users", set()).add(user_id)
+    else:
+        # A conflict means the row is already committed (a concurrent insert is waited for)
+        known_users.add(user_id)
+    return created
+
+@event.listens_for(Session, "after_commit")
+def _remember_committed_users(session):
+    for user_id in session.info.pop("pending_users", ()):
+        known_users.add(user_id)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back_users(session):
+    # An insert that was rolled back may not have happened
+    pending = session.info.pop("pending_users", set())
+    session.info.get("resolved_users", set()).difference_update(pending)
+
 def get_or_create_user(db: Session, user_id: str):
-    """Ensure the user exists in the Users table (Migration Helper)."""
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user:
-        user = models.User(id=user_id, is_guest=True)
-        db.add(user)
+    """Return the user row, creating (and committing) it first if needed."""
+    user = db.get(models.User, user_id)
+    if user is not None:
+        known_users.add(user_id)
+        return user
+    if ensure_user(db, user_id):
         db.commit()
-    return user
+    return db.get(models.User, user_id)
 
-def db_log_intake(db: Session, user_id: str, amount: int, date_str: str = None, client_timestamp: str = None):
-    # Ensure User exists
-    get_or_create_user(db, user_id)
-    
+# --- DATA VERSION / ETAGS ---
+# Every write to a user's logs, snapshots or goal bumps users.data_version in the
+# same transaction. Read endpoints hash (version, query, server date) into a strong
+# ETag, so a revalidation costs one primary-key lookup instead of the aggregation.
+ETAG_IGNORED_PARAMS = {"_t"}
+
+def db_bump_data_version(db: Session, user_id: str, tz_offset_minutes: int = None):
+    """Mark the user's data as changed. Does not commit.
+
+    Writes that carry the client's UTC offset record it in the same statement.
+    """
+    values = {models.User.data_version: func.coalesce(models.User.data_version, 0) + 1}
+    if tz_offset_minutes is not None:
+        values[models.User.tz_offset_minutes] = tz_offset_minutes
+    db.query(models.User).filter(models.User.id == user_id).update(values, synchronize_session=False)
+
+def db_get_data_version(db: Session, user_id: str):
+    version = db.query(models.User.data_version).filter(models.User.id == user_id).scalar()
+    return version or 0
+
+def data_etag(user_id: str, version: int, params):
+    """Strong ETag over the user's data version, the query and the server date (day rollover)."""
+    key = json.dumps([
+        user_id, version, datetime.now().strftime("%Y-%m-%d"),
+        sorted((k, v) for k, v in params if k not in ETAG_IGNORED_PARAMS)
+    ])
+    return '"' + hashlib.sha256(key.encode()).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match: str, etag: str):
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+def conditional_json(db: Session, user_id: str, if_none_match: str, params, build, *args):
+    """304 when the client's ETag is current, otherwise `build(db, *args)` as JSON with the ETag."""
+    etag = data_etag(user_id, db_get_data_version(db, user_id), params)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(build(db, *args), headers=headers)
+
+def resolve_log_time(date_str: str = None, client_timestamp: str = None):
+    """(local_date, timestamp) for a new log entry."""
     # Determine the local date for grouping (timezone-safe)
     local_date = date_str if date_str else datetime.now().strftime("%Y-%m-%d")
     
@@ -110,16 +226,56 @@ def db_log_intake(db: Session, user_id: str, amount: int, date_str: str = None,
     else:
         # Fallback to server time
         timestamp = datetime.now()
-        
+    return local_date, timestamp
+
+def db_log_intake(db: Session, user_id: str, amount: int, date_str: str = None, client_timestamp: str = None,
+                  tz_offset_minutes: int = None):
+    # Ensure User exists
+    ensure_user(db, user_id)
+    
+    local_date, timestamp = resolve_log_time(date_str, client_timestamp)
+    
     db_log = models.WaterIntake(user_id=user_id, intake_ml=amount, timestamp=timestamp, local_date=local_date)
     db.add(db_log)
+    db_apply_daily_total_delta(db, user_id, local_date, amount, 1)
+    db_bump_data_version(db, user_id, tz_offset_minutes)
     db.commit()
     db.refresh(db_log)
     return db_log.id, db_log.timestamp.isoformat()
 
-def db_get_history(db: Session, user_id: str):
-    logs = db.query(models.WaterIntake).filter(models.WaterIntake.user_id == user_id).order_by(models.WaterIntake.id.desc()).all()
-    return [{"id": l.id, "amount": l.intake_ml, "time": l.timestamp.isoformat()} for l in logs]
+HISTORY_PAGE_DEFAULT = 100
+HISTORY_PAGE_MAX = 500
+
+def db_get_history(db: Session, user_id: str, cursor: int = None, limit: int = HISTORY_PAGE_DEFAULT,
+                   start_date: str = None, end_date: str = None):
+    """One page of a user's logs, newest first, keyset-paginated on id.
+
+    `cursor` is the `next_cursor` of the previous page. Returns (items, next_cursor);
+    next_cursor is None on the last page. Rows are streamed with yield_per.
+    """
+    limit = max(1, min(limit, HISTORY_PAGE_MAX))
+    query = db.query(
+        models.WaterIntake.id, models.WaterIntake.intake_ml,
+        models.WaterIntake.timestamp, models.WaterIntake.local_date
+    ).filter(models.WaterIntake.user_id == user_id)
+    if start_date or end_date:
+        query = query.filter(_date_range_match(start_date, end_date))
+    if cursor is not None:
+        query = query.filter(models.WaterIntake.id < cursor)
+    
+    # One extra row tells whether another page exists
+    rows = query.order_by(models.WaterIntake.id.desc()).limit(limit + 1).yield_per(min(limit + 1, 100))
+    items = [{
+        "id": log_id,
+        "amount": amount,
+        "time": timestamp.isoformat(),
+        "date": local_date or timestamp.strftime("%Y-%m-%d")
+    } for log_id, amount, timestamp, local_date in rows]
+    
+    if len(items) > limit:
+        items = items[:limit]
+        return items, items[-1]["id"]
+    return items, None
 
 def db_get_today_total(db: Session, user_id: str):
     today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
@@ -129,48 +285,198 @@ def db_get_today_total(db: Session, user_id: str):
     ).scalar()
     return total or 0
 
-def db_get_date_total(db: Session, user_id: str, date_str: str):
-    """Get total intake for a specific date (handling both local_date and legacy timestamps)."""
+def _date_match(date_str: str):
+    """Filter matching logs that belong to a date (handling both local_date and legacy timestamps).
+
+    Matches records where:
+    1. local_date matches the target date (New records)
+    OR
+    2. local_date is NULL AND timestamp falls within the UTC day (Legacy records)
+    """
     date_start = datetime.strptime(date_str, "%Y-%m-%d")
     date_end = date_start + timedelta(days=1)
-    
-    # Unified Query:
-    # Sum records where:
-    # 1. local_date matches the target date (New records)
-    # OR
-    # 2. local_date is NULL AND timestamp falls within the UTC day (Legacy records)
-    
-    from sqlalchemy import or_, and_
-    
+    return or_(
+        models.WaterIntake.local_date == date_str,
+        and_(
+            models.WaterIntake.local_date.is_(None),
+            models.WaterIntake.timestamp >= date_start,
+            models.WaterIntake.timestamp < date_end
+        )
+    )
+
+def _date_range_match(start_date: str = None, end_date: str = None):
+    """Filter matching logs whose date falls within [start_date, end_date] (either bound optional).
+
+    Split into the local_date and legacy timestamp branches so each side can use its index.
+    """
+    local_conditions = [models.WaterIntake.local_date.isnot(None)]
+    legacy_conditions = [models.WaterIntake.local_date.is_(None)]
+    if start_date:
+        local_conditions.append(models.WaterIntake.local_date >= start_date)
+        legacy_conditions.append(models.WaterIntake.timestamp >= datetime.strptime(start_date, "%Y-%m-%d"))
+    if end_date:
+        local_conditions.append(models.WaterIntake.local_date <= end_date)
+        legacy_conditions.append(models.WaterIntake.timestamp < datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1))
+    return or_(and_(*local_conditions), and_(*legacy_conditions))
+
+def _log_date_expr():
+    """SQL expression for a log's grouping date: local_date, or the timestamp's date for legacy rows."""
+    return func.coalesce(
+        models.WaterIntake.local_date,
+        func.substr(cast(models.WaterIntake.timestamp, String), 1, 10)
+    )
+
+def _dialect_insert(db: Session, model):
+    """INSERT construct for the bound dialect, so callers can use ON CONFLICT on SQLite and Postgres."""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+def db_get_date_total(db: Session, user_id: str, date_str: str):
+    """Get total intake for a specific date by re-summing the raw logs."""
     total = db.query(func.sum(models.WaterIntake.intake_ml)).filter(
         models.WaterIntake.user_id == user_id,
-        or_(
-            models.WaterIntake.local_date == date_str,
-            and_(
-                models.WaterIntake.local_date.is_(None),
-                models.WaterIntake.timestamp >= date_start,
-                models.WaterIntake.timestamp < date_end
-            )
-        )
+        _date_match(date_str)
     ).scalar()
     
     return total or 0
 
+# --- DAILY TOTAL AGGREGATES ---
+
+def db_get_daily_total(db: Session, user_id: str, date_str: str):
+    """Get total intake for a date from the running aggregate (one row, no re-summing).
+
+    Days that have never been written through the aggregate (legacy data) fall
+    back to the raw re-aggregation.
+    """
+    row = db.query(models.DailyTotal.total_intake).filter(
+        models.DailyTotal.user_id == user_id,
+        models.DailyTotal.date == date_str
+    ).first()
+    if row is not None:
+        return row[0] or 0
+    return db_get_date_total(db, user_id, date_str)
+
+def db_refresh_daily_total(db: Session, user_id: str, date_str: str):
+    """Recompute the aggregate row for (user, date) from the raw logs. Does not commit."""
+    total, count = db.query(
+        func.coalesce(func.sum(models.WaterIntake.intake_ml), 0),
+        func.count(models.WaterIntake.id)
+    ).filter(
+        models.WaterIntake.user_id == user_id,
+        _date_match(date_str)
+    ).one()
+    
+    stmt = _dialect_insert(db, models.DailyTotal).values(
+        user_id=user_id, date=date_str, total_intake=total, log_count=count, updated_at=datetime.now()
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "date"],
+        set_={"total_intake": total, "log_count": count, "updated_at": datetime.now()}
+    )
+    db.execute(stmt)
+    return total
+
+def db_apply_daily_total_delta(db: Session, user_id: str, date_str: str, amount_delta: int, count_delta: int):
+    """Apply an intake change to the running aggregate for (user, date). Does not commit.
+
+    Call this before the commit that writes the WaterIntake change, so both land
+    in the same transaction. The first write for a day seeds the row from the
+    raw logs (which include the pending change once flushed).
+    """
+    def apply_delta():
+        return db.query(models.DailyTotal).filter(
+            models.DailyTotal.user_id == user_id,
+            models.DailyTotal.date == date_str
+        ).update({
+            models.DailyTotal.total_intake: models.DailyTotal.total_intake + amount_delta,
+            models.DailyTotal.log_count: models.DailyTotal.log_count + count_delta,
+            models.DailyTotal.updated_at: datetime.now()
+        }, synchronize_session=False)
+    
+    if apply_delta():
+        return
+    
+    db.flush()
+    total, count = db.query(
+        func.coalesce(func.sum(models.WaterIntake.intake_ml), 0),
+        func.count(models.WaterIntake.id)
+    ).filter(
+        models.WaterIntake.user_id == user_id,
+        _date_match(date_str)
+    ).one()
+    seed = _dialect_insert(db, models.DailyTotal).values(
+        user_id=user_id, date=date_str, total_intake=total, log_count=count, updated_at=datetime.now()
+    ).on_conflict_do_nothing(index_elements=["user_id", "date"])
+    
+    if db.execute(seed).rowcount == 0:
+        # Another writer seeded the row first (without our pending change) - add our delta on top
+        apply_delta()
+
+def db_reconcile_daily_totals(db: Session, user_id: str = None, fix: bool = False):
+    """Check the daily_totals aggregates against the raw water_intake rows.
+
+    Returns a list of mismatching (user, date) entries. With fix=True the
+    aggregate rows are overwritten with the re-aggregated values.
+    """
+    date_key = _log_date_expr()
+    raw_query = db.query(
+        models.WaterIntake.user_id,
+        date_key.label("date"),
+        func.sum(models.WaterIntake.intake_ml),
+        func.count(models.WaterIntake.id)
+    )
+    agg_query = db.query(models.DailyTotal)
+    if user_id:
+        raw_query = raw_query.filter(models.WaterIntake.user_id == user_id)
+        agg_query = agg_query.filter(models.DailyTotal.user_id == user_id)
+    
+    actual = {(uid, date): (total or 0, count) for uid, date, total, count in raw_query.group_by(models.WaterIntake.user_id, date_key)}
+    
+    # Days without an aggregate row are not drift: they are seeded lazily on the next write.
+    mismatches = []
+    for row in agg_query.all():
+        total, count = actual.get((row.user_id, row.date), (0, 0))
+        if row.total_intake != total or row.log_count != count:
+            mismatches.append({
+                "user_id": row.user_id,
+                "date": row.date,
+                "aggregate_total": row.total_intake,
+                "actual_total": total,
+                "aggregate_count": row.log_count,
+                "actual_count": count
+            })
+            if fix:
+                row.total_intake = total
+                row.log_count = count
+                row.updated_at = datetime.now()
+    
+    if fix and mismatches:
+        for uid in {m["user_id"] for m in mismatches}:
+            db_bump_data_version(db, uid)
+        db.commit()
+    return mismatches
+
 def db_delete_log(db: Session, log_id: int, user_id: str):
     """Delete a specific log entry by ID."""
     log = db.query(models.WaterIntake).filter(models.WaterIntake.id == log_id).first()
     
     if not log:
-        return None, None, "Log not found"
+        return None, None, None, "Log not found"
     if log.user_id != user_id:
-        return None, None, "Unauthorized"
+        return None, None, None, "Unauthorized"
     
     amount = log.intake_ml
     timestamp = log.timestamp.isoformat()
+    log_date = log.local_date or log.timestamp.strftime("%Y-%m-%d")
     
     db.delete(log)
+    db_apply_daily_total_delta(db, user_id, log_date, -amount, -1)
+    db_bump_data_version(db, user_id)
     db.commit()
-    return amount, timestamp, "success"
+    return amount, timestamp, log_date, "success"
 
 def db_get_today_logs(db: Session, user_id: str, date_str: str = None):
     """Get individual log entries for today (or specified date), combining legacy and new records."""
@@ -179,38 +485,27 @@ def db_get_today_logs(db: Session, user_id: str, date_str: str = None):
     else:
         target_date = datetime.now().strftime("%Y-%m-%d")
     
-    date_start = datetime.strptime(target_date, "%Y-%m-%d")
-    date_end = date_start + timedelta(days=1)
-    
-    from sqlalchemy import or_, and_
-
-    # Unified Query: Fetch all logs that match EITHER criteria
+    # Unified Query: Fetch all logs that match EITHER local_date or the legacy timestamp range
     logs = db.query(models.WaterIntake).filter(
         models.WaterIntake.user_id == user_id,
-        or_(
-            # 1. New records with explicit local_date
-            models.WaterIntake.local_date == target_date,
-            # 2. Legacy records (NULL local_date) matching timestamp range
-            and_(
-                models.WaterIntake.local_date.is_(None),
-                models.WaterIntake.timestamp >= date_start,
-                models.WaterIntake.timestamp < date_end
-            )
-        )
+        _date_match(target_date)
     ).order_by(models.WaterIntake.id.desc()).all()
     
     return [{"id": l.id, "amount": l.intake_ml, "time": l.timestamp.isoformat()} for l in logs]
-    
-    return [{"id": l.id, "amount": l.intake_ml, "time": l.timestamp.isoformat()} for l in logs]
 
 # --- DAILY SNAPSHOT MANAGEMENT ---
 
-def db_create_or_update_snapshot(db: Session, user_id: str, date_str: str, goal: int):
-    """Create or update a daily snapshot. Called whenever water is logged."""
+def db_create_or_update_snapshot(db: Session, user_id: str, date_str: str, goal: int, total: int = None):
+    """Create or update a daily snapshot. Called whenever water is logged.
+
+    Pass `total` when the caller already has the day's total (e.g. from the
+    running aggregate) to skip the lookup.
+    """
     # Ensure User exists
-    get_or_create_user(db, user_id)
+    ensure_user(db, user_id)
 
-    total = db_get_date_total(db, user_id, date_str)
+    if total is None:
+        total = db_get_daily_total(db, user_id, date_str)
     goal_met = total >= goal
     
     # Check if snapshot exists
@@ -219,6 +514,10 @@ def db_create_or_update_snapshot(db: Session, user_id: str, date_str: str, goal:
         models.DailySnapshot.date == date_str
     ).first()
     
+    was_met = bool(snapshot.goal_met) if snapshot else False
+    # The carried-forward goal timeline only changes if this day's goal does
+    goal_changed = goal != (snapshot.goal_for_day if snapshot else db_get_snapshot_goal(db, user_id, date_str))
+    
     if snapshot:
         # Update existing
         snapshot.goal_for_day = goal
@@ -237,42 +536,208 @@ def db_create_or_update_snapshot(db: Session, user_id: str, date_str: str, goal:
         )
         db.add(snapshot)
     
+    if goal_met != was_met:
+        db_update_streak_state(db, user_id, date_str, goal_met)
+    if goal_changed:
+        db_sync_goal_timeline(db, user_id)
+    
+    db_bump_data_version(db, user_id)
     db.commit()
     db.refresh(snapshot)
     return {"date": date_str, "goal": goal, "total": total, "goal_met": goal_met}
 
-def db_lock_previous_day_snapshot(db: Session, user_id: str, goal: int):
-    """Lock yesterday's snapshot if it doesn't exist."""
-    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
-    
-    # Check if snapshot exists
-    exists = db.query(models.DailySnapshot).filter(
-        models.DailySnapshot.user_id == user_id,
-        models.DailySnapshot.date == yesterday
-    ).first()
+def _chunks(items, size: int = 500):
+    """Split a list for IN (...) clauses (keeps SQLite under its bound-parameter limit)."""
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def db_recompute_snapshots(db: Session, user_id: str, dates, default_goal: int = 2500, goals: dict = None,
+                           rebuild_streak: bool = True):
+    """Set-based snapshot + daily total recompute for many dates of one user. Does not commit.
+
+    One grouped query reads every day's total; snapshots and aggregate rows are
+    then written in batches. Existing snapshots keep their historical goal unless
+    `goals` overrides it for a date; new ones use `goals` or `default_goal`.
+    The streak state is rebuilt if any goal_met flipped; pass rebuild_streak=False
+    when the caller rebuilds it anyway.
+    Returns {date: {"goal", "total", "goal_met"}}.
+    """
+    dates = sorted(set(dates))
+    if not dates:
+        return {}
+    goals = goals or {}
+    db.flush()
+    
+    date_key = _log_date_expr()
+    wanted = set(dates)
+    day_rows = {}
+    for date_str, total, count in db.query(
+        date_key, func.sum(models.WaterIntake.intake_ml), func.count(models.WaterIntake.id)
+    ).filter(
+        models.WaterIntake.user_id == user_id,
+        _date_range_match(dates[0], dates[-1])
+    ).group_by(date_key):
+        if date_str in wanted:
+            day_rows[date_str] = (total or 0, count)
+    
+    snapshots = {}
+    for chunk in _chunks(dates):
+        for snap in db.query(models.DailySnapshot).filter(
+            models.DailySnapshot.user_id == user_id,
+            models.DailySnapshot.date.in_(chunk)
+        ):
+            snapshots.setdefault(snap.date, snap)
+    
+    now = datetime.now()
+    carried = db_resolve_goals(db, user_id, dates)
+    result = {}
+    goal_met_changed = False
+    timeline_changed = False
+    for date_str in dates:
+        total, _ = day_rows.get(date_str, (0, 0))
+        snap = snapshots.get(date_str)
+        goal = goals.get(date_str, snap.goal_for_day if snap else default_goal)
+        timeline_changed = timeline_changed or goal != (snap.goal_for_day if snap else carried[date_str])
+        goal_met = total >= goal
+        if snap:
+            goal_met_changed = goal_met_changed or bool(snap.goal_met) != goal_met
+            snap.goal_for_day, snap.total_intake, snap.goal_met, snap.updated_at = goal, total, goal_met, now
+        else:
+            goal_met_changed = goal_met_changed or goal_met
+            db.add(models.DailySnapshot(
+                user_id=user_id, date=date_str, goal_for_day=goal,
+                total_intake=total, goal_met=goal_met, updated_at=now
+            ))
+        result[date_str] = {"goal": goal, "total": total, "goal_met": goal_met}
+    
+    upsert = _dialect_insert(db, models.DailyTotal)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=["user_id", "date"],
+        set_={
+            "total_intake": upsert.excluded.total_intake,
+            "log_count": upsert.excluded.log_count,
+            "updated_at": upsert.excluded.updated_at
+        }
+    )
+    db.execute(upsert, [{
+        "user_id": user_id, "date": date_str,
+        "total_intake": day_rows.get(date_str, (0, 0))[0],
+        "log_count": day_rows.get(date_str, (0, 0))[1],
+        "updated_at": now
+    } for date_str in dates])
+    
+    if goal_met_changed and rebuild_streak:
+        # Many days may have flipped at once - one rebuild instead of per-day updates
+        db.flush()
+        db_rebuild_streak_state(db, user_id)
+    if timeline_changed:
+        db_sync_goal_timeline(db, user_id)
+    db_bump_data_version(db, user_id)
+    return result
+
+# --- DAY ROLLOVER ---
+# The previous day's snapshot is finalized by a scheduled job instead of on every
+# /log. Users are bucketed by the UTC offset their client reports (users without one
+# follow the server clock, as before). Once a bucket's local day has rolled over,
+# every recently active user in it without a snapshot for the previous local day gets
+# one - carried-forward goal, that day's total - in a single INSERT ... SELECT.
+# Re-running is a no-op, so cron runs and several workers can overlap safely.
+# Run it with rollover.py, or set ROLLOVER_INTERVAL to run it inside the API process.
+ROLLOVER_ACTIVE_DAYS = int(os.getenv("ROLLOVER_ACTIVE_DAYS", "30"))  # Users with intake this recently get locked
+ROLLOVER_CATCH_UP_DAYS = int(os.getenv("ROLLOVER_CATCH_UP_DAYS", "1"))  # Previous local days covered per run
+ROLLOVER_INTERVAL = int(os.getenv("ROLLOVER_INTERVAL", "0"))  # Seconds between in-process runs; 0 = off
+
+def db_rollover_day(db: Session, tz_offset_minutes: Optional[int], date_str: str,
+                    active_days: int = ROLLOVER_ACTIVE_DAYS, user_ids: Optional[List[str]] = None):
+    """Lock `date_str` for every active user of one timezone bucket. Does not commit.
+
+    `user_ids` restricts the run to those users (tests). Returns the created
+    (user_id, goal_met) rows.
+    """
+    existing, recent = aliased(models.DailySnapshot), aliased(models.DailySnapshot)
+    active_since = (datetime.strptime(date_str, "%Y-%m-%d") - timedelta(days=active_days)).strftime("%Y-%m-%d")
+    
+    # Same rule as db_get_snapshot_goal: the latest goal change on or before the day
+    goal = func.coalesce(select(models.GoalChange.goal).where(
+        models.GoalChange.user_id == models.User.id,
+        models.GoalChange.effective_date <= date_str
+    ).order_by(models.GoalChange.effective_date.desc()).limit(1).scalar_subquery(), 2500)
+    # Same rule as db_get_daily_total: the aggregate row, else the raw logs (legacy days)
+    raw = select(
+        models.WaterIntake.user_id.label("user_id"), func.sum(models.WaterIntake.intake_ml).label("total")
+    ).where(_date_match(date_str)).group_by(models.WaterIntake.user_id).subquery()
+    total = func.coalesce(models.DailyTotal.total_intake, raw.c.total, 0)
+    
+    conditions = [
+        models.User.tz_offset_minutes.is_(None) if tz_offset_minutes is None
+        else models.User.tz_offset_minutes == tz_offset_minutes
+    ]
+    if user_ids is not None:
+        conditions.append(models.User.id.in_(user_ids))
+    days = select(
+        models.User.id.label("user_id"), goal.label("goal"), total.label("total")
+    ).outerjoin(models.DailyTotal, and_(
+        models.DailyTotal.user_id == models.User.id,
+        models.DailyTotal.date == date_str
+    )).outerjoin(raw, raw.c.user_id == models.User.id).where(
+        *conditions,
+        select(recent.id).where(
+            recent.user_id == models.User.id,
+            recent.date >= active_since,
+            recent.date < date_str,
+            recent.total_intake > 0
+        ).exists(),
+        ~select(existing.id).where(existing.user_id == models.User.id, existing.date == date_str).exists()
+    ).subquery()
+    # (SQLite needs the WHERE to parse INSERT ... SELECT ... ON CONFLICT)
+    source = select(
+        days.c.user_id, literal(date_str, String), days.c.goal, days.c.total,
+        days.c.total >= days.c.goal, literal(datetime.now(), DateTime)
+    ).where(true())
+    stmt = _dialect_insert(db, models.DailySnapshot).from_select(
+        ["user_id", "date", "goal_for_day", "total_intake", "goal_met", "updated_at"], source
+    ).on_conflict_do_nothing(index_elements=["user_id", "date"]).returning(
+        models.DailySnapshot.user_id, models.DailySnapshot.goal_met
+    )
+    created = db.execute(stmt).all()
     
-    if not exists:
-        # Create user if needed
-        get_or_create_user(db, user_id)
-        
-        # v1.9.0 FIX: Use the 'Carried Forward' goal for yesterday
-        # Do NOT use the 'goal' argument provided by 'log_intake' (which is TODAY's goal).
-        # We want yesterday to reflect the goal that was active YESTERDAY (or carried from before).
-        effective_goal = db_get_snapshot_goal(db, user_id, yesterday)
-        
-        total = db_get_date_total(db, user_id, yesterday)
-        goal_met = total >= effective_goal
-        
-        snapshot = models.DailySnapshot(
-            user_id=user_id,
-            date=yesterday,
-            goal_for_day=effective_goal,
-            total_intake=total,
-            goal_met=goal_met,
-            updated_at=datetime.now()
+    for chunk in _chunks([user_id for user_id, _ in created]):
+        db.query(models.User).filter(models.User.id.in_(chunk)).update(
+            {models.User.data_version: func.coalesce(models.User.data_version, 0) + 1},
+            synchronize_session=False
         )
-        db.add(snapshot)
+    for user_id, goal_met in created:
+        # Only days that already had enough intake (but no snapshot) extend a streak
+        if goal_met:
+            db_update_streak_state(db, user_id, date_str, True)
+    return created
+
+def db_rollover(db: Session, now_utc: datetime = None, catch_up_days: int = ROLLOVER_CATCH_UP_DAYS,
+                active_days: int = ROLLOVER_ACTIVE_DAYS, user_ids: Optional[List[str]] = None):
+    """Finalize the previous `catch_up_days` local days in every timezone bucket. Commits per bucket.
+
+    `user_ids` restricts the run to those users (tests).
+
+    Returns {tz_offset_minutes (None = server clock): {"through": date, "locked": count}}.
+    """
+    now_utc = now_utc or datetime.utcnow()
+    server_offset = round((datetime.now() - datetime.utcnow()).total_seconds() / 60)
+    results = {}
+    buckets = db.query(models.User.tz_offset_minutes).distinct()
+    if user_ids is not None:
+        buckets = buckets.filter(models.User.id.in_(user_ids))
+    for (tz_offset,) in buckets.all():
+        local_today = (now_utc + timedelta(minutes=server_offset if tz_offset is None else tz_offset)).date()
+        created = []
+        for days_back in range(max(catch_up_days, 1), 0, -1):
+            date_str = (local_today - timedelta(days=days_back)).strftime("%Y-%m-%d")
+            created += db_rollover_day(db, tz_offset, date_str, active_days, user_ids)
         db.commit()
+        for user_id in {user_id for user_id, goal_met in created if goal_met}:
+            invalidate_user_standings(user_id)
+        results[tz_offset] = {"through": date_str, "locked": len(created)}
+    return results
 
 def db_get_snapshots(db: Session, user_id: str, days: int = 365):
     """Get daily snapshots for streak calculation."""
@@ -347,75 +812,363 @@ def db_get_streak_from_snapshots(db: Session, user_id: str, client_date: str = N
     
     return streak
 
-def db_backfill_snapshots(db: Session, user_id: str, goal: int):
-    """Backfill snapshots for existing data that doesn't have snapshots yet."""
-    stats = db_get_stats(db, user_id, 365) # Need to implement db_get_stats with ORM next
+# --- STREAK STATE (incremental) ---
+
+def _shift_date(date_str: str, days: int):
+    return (datetime.strptime(date_str, "%Y-%m-%d") + timedelta(days=days)).strftime("%Y-%m-%d")
+
+def _run_length(start_date: str, end_date: str):
+    return (datetime.strptime(end_date, "%Y-%m-%d") - datetime.strptime(start_date, "%Y-%m-%d")).days + 1
+
+def _met_run_bound(db: Session, user_id: str, date_str: str, step: int):
+    """Walk consecutive goal_met days away from date_str (step -1 = backwards, +1 = forwards).
+
+    Returns the furthest day of the unbroken run (date_str itself if the
+    neighbour is not met). Rows are streamed, so cost is the run length, not the history.
+    """
+    query = db.query(models.DailySnapshot.date).filter(
+        models.DailySnapshot.user_id == user_id,
+        models.DailySnapshot.goal_met == True
+    )
+    if step < 0:
+        query = query.filter(models.DailySnapshot.date < date_str).order_by(models.DailySnapshot.date.desc())
+    else:
+        query = query.filter(models.DailySnapshot.date > date_str).order_by(models.DailySnapshot.date.asc())
     
-    today_str = datetime.now().strftime("%Y-%m-%d")
+    bound = date_str
+    for (day,) in query.yield_per(64):
+        if day == bound:
+            continue  # Duplicate snapshot rows for the same day
+        if day != _shift_date(bound, step):
+            break
+        bound = day
+    return bound
+
+def _compute_streak_state(db: Session, user_id: str, state):
+    """Fill `state` with the user's streak computed from all snapshots (one ordered scan)."""
+    met_dates = [d for (d,) in db.query(models.DailySnapshot.date).filter(
+        models.DailySnapshot.user_id == user_id,
+        models.DailySnapshot.goal_met == True
+    ).distinct().order_by(models.DailySnapshot.date.asc())]
+    last_evaluated = db.query(func.max(models.DailySnapshot.date)).filter(
+        models.DailySnapshot.user_id == user_id
+    ).scalar()
     
-    for day in stats:
-        if day["date"] == today_str:
-            continue
-        if day["total"] == 0:
-            continue
-            
-        exists = db.query(models.DailySnapshot).filter(
+    run_start = run_end = None
+    best_streak, best_start = 0, None
+    for day in met_dates:
+        if run_end and day == _shift_date(run_end, 1):
+            run_end = day
+        else:
+            run_start = run_end = day
+        length = _run_length(run_start, run_end)
+        if length > best_streak:
+            best_streak, best_start = length, run_start
+    
+    state.start_date = run_start
+    state.end_date = run_end
+    state.current_length = _run_length(run_start, run_end) if run_end else 0
+    state.best_streak = best_streak
+    state.best_start_date = best_start
+    state.last_evaluated_date = last_evaluated
+    state.updated_at = datetime.now()
+    return state
+
+def db_rebuild_streak_state(db: Session, user_id: str):
+    """Recompute and persist a user's streak state from all snapshots. Does not commit."""
+    state = db.query(models.StreakState).filter(models.StreakState.user_id == user_id).first()
+    if not state:
+        state = models.StreakState(user_id=user_id)
+        db.add(state)
+    return _compute_streak_state(db, user_id, state)
+
+def db_update_streak_state(db: Session, user_id: str, date_str: str, goal_met: bool):
+    """Fold a snapshot's goal_met flip on `date_str` into the streak state. Does not commit.
+
+    Only the run touching the edited day is re-walked, so backdated edits cost
+    the length of that run rather than a full rescan.
+    """
+    db.flush()
+    state = db.query(models.StreakState).filter(models.StreakState.user_id == user_id).first()
+    if not state:
+        return db_rebuild_streak_state(db, user_id)
+    
+    in_latest_run = bool(state.end_date) and state.start_date <= date_str <= state.end_date
+    
+    if goal_met:
+        if not in_latest_run:
+            run_start = _met_run_bound(db, user_id, date_str, -1)
+            run_end = _met_run_bound(db, user_id, date_str, 1)
+            length = _run_length(run_start, run_end)
+            # The edited run becomes (or merges into) the latest run if it reaches its end
+            if not state.end_date or run_end >= state.end_date:
+                state.start_date, state.end_date, state.current_length = run_start, run_end, length
+            if length > (state.best_streak or 0):
+                state.best_streak, state.best_start_date = length, run_start
+    else:
+        still_met = db.query(models.DailySnapshot.id).filter(
             models.DailySnapshot.user_id == user_id,
-            models.DailySnapshot.date == day["date"]
+            models.DailySnapshot.date == date_str,
+            models.DailySnapshot.goal_met == True
         ).first()
+        if still_met:
+            return state  # Another snapshot row for the day is still met
         
-        if not exists:
-            get_or_create_user(db, user_id)
-            
-            # v1.9.0 IMPR: Resolve goal for this specific date using timeline logic
-            day_goal = db_get_snapshot_goal(db, user_id, day["date"])
-            
-            goal_met = day["total"] >= day_goal
-            s = models.DailySnapshot(
-                user_id=user_id,
-                date=day["date"],
-                goal_for_day=day_goal,
-                total_intake=day["total"],
-                goal_met=goal_met,
-                updated_at=datetime.now()
-            )
-            db.add(s)
+        best_end = _shift_date(state.best_start_date, state.best_streak - 1) if state.best_start_date else None
+        if best_end and state.best_start_date <= date_str <= best_end:
+            # The best run was broken - find the new best with a full pass
+            return db_rebuild_streak_state(db, user_id)
+        
+        if in_latest_run:
+            if date_str < state.end_date:
+                # The days after the break are still the latest run
+                state.start_date = _shift_date(date_str, 1)
+            elif date_str > state.start_date:
+                state.end_date = _shift_date(date_str, -1)
+            else:
+                # The latest run was only this day - fall back to the previous run
+                previous_end = db.query(func.max(models.DailySnapshot.date)).filter(
+                    models.DailySnapshot.user_id == user_id,
+                    models.DailySnapshot.goal_met == True,
+                    models.DailySnapshot.date < date_str
+                ).scalar()
+                state.end_date = previous_end
+                state.start_date = _met_run_bound(db, user_id, previous_end, -1) if previous_end else None
+            state.current_length = _run_length(state.start_date, state.end_date) if state.end_date else 0
+    
+    if not state.last_evaluated_date or date_str > state.last_evaluated_date:
+        state.last_evaluated_date = date_str
+    state.updated_at = datetime.now()
+    return state
+
+def db_get_current_streak(db: Session, user_id: str, client_date: str = None):
+    """O(1) streak read from the persisted streak state.
+
+    Applies the same today/yesterday grace rule as db_get_streak_from_snapshots:
+    the latest run counts if it ends today, or yesterday (today still in progress).
+    """
+    state = db.query(models.StreakState).filter(models.StreakState.user_id == user_id).first()
+    if not state:
+        # Not persisted yet (no write since the table was added): compute it for this read only,
+        # the next snapshot write stores it. Keeps GET /stats and /dashboard free of writes.
+        state = _compute_streak_state(db, user_id, models.StreakState(user_id=user_id))
+    
+    if not state.end_date:
+        return 0
+    
+    if client_date:
+        try:
+            today = datetime.strptime(client_date, "%Y-%m-%d").date()
+        except ValueError:
+            today = datetime.now().date()
+    else:
+        today = datetime.now().date()
+    today_str = today.strftime("%Y-%m-%d")
+    yesterday_str = (today - timedelta(days=1)).strftime("%Y-%m-%d")
+    
+    if state.end_date > today_str:
+        # The latest run is in this client's future (timezone skew) - evaluate the history directly
+        return db_get_streak_from_snapshots(db, user_id, client_date)
+    if state.end_date in (today_str, yesterday_str):
+        return state.current_length
+    return 0
+
+def db_backfill_snapshots(db: Session, user_id: str, through_date: str = None):
+    """Backfill snapshots for days that have logs but no snapshot yet.
+
+    Driven by a per-user watermark: only days after `backfilled_through` are
+    scanned, and the watermark then advances to `through_date` (default:
+    yesterday - today is still being written by /log). Run by the
+    backfill_snapshots.py job, never on a request path.
+
+    Returns the number of snapshots created.
+    """
+    if through_date is None:
+        through_date = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    
+    watermark = db.query(models.BackfillWatermark).filter(
+        models.BackfillWatermark.user_id == user_id
+    ).first()
+    since = watermark.backfilled_through if watermark else None
+    if since and since >= through_date:
+        return 0
+    
+    start_date = (datetime.strptime(since, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d") if since else None
+    
+    # 1. Per-day totals for the new days (grouped in SQL)
+    date_key = _log_date_expr()
+    day_totals = dict(db.query(date_key, func.sum(models.WaterIntake.intake_ml)).filter(
+        models.WaterIntake.user_id == user_id,
+        _date_range_match(start_date, through_date)
+    ).group_by(date_key).all())
+    
+    # 2. Snapshots that already exist in the same window (also the goal timeline for carry-forward)
+    snapshot_query = db.query(models.DailySnapshot.date, models.DailySnapshot.goal_for_day).filter(
+        models.DailySnapshot.user_id == user_id,
+        models.DailySnapshot.date <= through_date
+    )
+    if since:
+        snapshot_query = snapshot_query.filter(models.DailySnapshot.date > since)
+    existing_goals = dict(snapshot_query.all())
+    
+    # 3. Walk the window in date order, carrying the goal forward like db_get_snapshot_goal
+    carried_goal = db_get_snapshot_goal(db, user_id, since) if since else 2500
+    created = 0
+    created_met = False
+    for date_str in sorted(set(day_totals) | set(existing_goals)):
+        if date_str in existing_goals:
+            carried_goal = existing_goals[date_str]
+            continue
+        total = day_totals.get(date_str) or 0
+        if total == 0:
+            continue
+        
+        db.add(models.DailySnapshot(
+            user_id=user_id,
+            date=date_str,
+            goal_for_day=carried_goal,
+            total_intake=total,
+            goal_met=total >= carried_goal,
+            updated_at=datetime.now()
+        ))
+        created += 1
+        created_met = created_met or total >= carried_goal
+    
+    if created_met:
+        # Backfilled days can join runs anywhere in history - rebuild once rather than per day
+        db.flush()
+        db_rebuild_streak_state(db, user_id)
+    if created:
+        db_bump_data_version(db, user_id)
+    
+    # 4. Advance the watermark
+    if watermark:
+        watermark.backfilled_through = through_date
+        watermark.updated_at = datetime.now()
+    else:
+        ensure_user(db, user_id)
+        db.add(models.BackfillWatermark(user_id=user_id, backfilled_through=through_date, updated_at=datetime.now()))
     
     db.commit()
+    return created
 
 
 # --- AI AGENT LAYER ---
-def get_ai_feedback(current_intake: int, goal: int):
-    """Uses Groq API directly to generate feedback."""
+# Prompts are built from a bucketed (progress %, goal) signature so users at the same
+# progress share one cached message (see ai_cache.py).
+AI_PERCENT_BUCKET = 5
+AI_GOAL_BUCKET = 100
+
+def ai_prompt_signature(current_intake: int, goal: int):
+    """Bucket (percentage, goal): 5% progress steps (capped at 200%) and goals rounded to 100ml."""
+    percentage = (current_intake / goal) * 100 if goal > 0 else 0
+    pct_bucket = int(min(percentage, 200) // AI_PERCENT_BUCKET * AI_PERCENT_BUCKET)
+    goal_bucket = int(round(goal / AI_GOAL_BUCKET) * AI_GOAL_BUCKET)
+    return pct_bucket, goal_bucket
+
+def build_ai_prompt(signature):
+    pct_bucket, goal_bucket = signature
+    return (
+        f"You are a friendly hydration coach. The user has reached about {pct_bucket}% of their {goal_bucket}ml water goal today. "
+        f"Give a brief, encouraging message about their hydration status. "
+        f"Use emojis and keep it under 2 sentences."
+    )
+
+def fallback_ai_message(signature):
+    """Templated coach message, served instantly while the LLM upstream is failing."""
+    pct_bucket, goal_bucket = signature
+    if pct_bucket >= 100:
+        return "🎉 Goal reached! Great job staying hydrated today. 💧"
+    if pct_bucket >= 75:
+        return f"💪 Almost there! Just a few more glasses to hit your {goal_bucket}ml goal. 🚰"
+    if pct_bucket >= 40:
+        return "👍 Good progress! Keep sipping steadily through the day. 💧"
+    return "🌱 Time for a glass of water! A few sips now will get you on track. 💧"
+
+def sse_event(event: str, data: dict):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def ai_feedback_events(current_intake: int, goal: int, is_disconnected=None):
+    """SSE events for the AI coach: `token` chunks, then `done` with the full message.
+
+    Cache hits and breaker fallbacks are sent as a single token. Concurrent
+    requests with the same prompt signature share one upstream stream
+    (feedback_cache.stream); completed streams fill the cache, streams
+    abandoned by every client do not.
+    """
     api_key = os.getenv("GROQ_API_KEY")
-    if not api_key:
+    if not api_key and os.getenv("LLM_FAKE") != "1":
+        message = "⚠️ AI Key missing. Please check backend .env file."
+        yield sse_event("token", {"token": message})
+        yield sse_event("done", {"message": message})
+        return
+    
+    signature = ai_prompt_signature(current_intake, goal)
+    key = "{}:{}".format(*signature)
+    cached = await feedback_cache.lookup(key)
+    if cached is not None:
+        yield sse_event("token", {"token": cached})
+        yield sse_event("done", {"message": cached, "cached": True})
+        return
+    
+    tokens = []
+    tokens_stream = feedback_cache.stream(key, lambda: llm_client.stream(build_ai_prompt(signature), api_key))
+    try:
+        async for token in tokens_stream:
+            if is_disconnected and await is_disconnected():
+                return
+            tokens.append(token)
+            yield sse_event("token", {"token": token})
+    except LLMUnavailableError:
+        message = fallback_ai_message(signature)
+        yield sse_event("token", {"token": message})
+        yield sse_event("done", {"message": message, "fallback": True})
+        return
+    except Exception as e:
+        yield sse_event("error", {"message": f"AI Error: {str(e)}"})
+        return
+    finally:
+        await tokens_stream.aclose()
+    
+    message = "".join(tokens).strip()
+    yield sse_event("done", {"message": message})
+
+async def get_ai_feedback(current_intake: int, goal: int):
+    """Cached, coalesced AI coach message from the pooled async Groq client.
+
+    While the upstream is failing (breaker open or saturated) a templated
+    message is returned instantly instead of waiting on Groq.
+    """
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key and os.getenv("LLM_FAKE") != "1":
         return "⚠️ AI Key missing. Please check backend .env file."
 
+    signature = ai_prompt_signature(current_intake, goal)
+    key = "{}:{}".format(*signature)
     try:
-        client = Groq(api_key=api_key)
-        
-        percentage = (current_intake / goal) * 100 if goal > 0 else 0
-        prompt = (
-            f"You are a friendly hydration coach. The user has consumed {current_intake}ml of water today ({percentage:.0f}% of their {goal}ml goal). "
-            f"Give a brief, encouraging message about their hydration status. "
-            f"Use emojis and keep it under 2 sentences."
-        )
-        
-        response = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=150
-        )
-        
-        return response.choices[0].message.content
+        return await feedback_cache.get_or_compute(key, lambda: llm_client.complete(build_ai_prompt(signature), api_key))
+    except LLMUnavailableError:
+        return fallback_ai_message(signature)
     except Exception as e:
         return f"AI Error: {str(e)}"
 
 
 # --- STATS AGGREGATION ---
-def db_get_stats(db: Session, user_id: str, days: int = 365, client_date: str = None):
-    """Get daily totals for the past N days."""
+def db_get_daily_totals(db: Session, user_id: str, start_date: str, end_date: str):
+    """Per-day intake totals for [start_date, end_date], grouped in SQL. Days without logs are omitted."""
+    date_key = _log_date_expr()
+    rows = db.query(date_key, func.sum(models.WaterIntake.intake_ml)).filter(
+        models.WaterIntake.user_id == user_id,
+        _date_range_match(start_date, end_date)
+    ).group_by(date_key).all()
+    return {date_str: total or 0 for date_str, total in rows}
+
+def db_get_stats(db: Session, user_id: str, days: int = 365, client_date: str = None, columnar: bool = False):
+    """Get daily totals for the past N days (newest first).
+
+    Returns a list of {"date", "total"} rows, or with columnar=True parallel
+    "dates"/"totals" arrays, which keeps year views (days=365) compact.
+    """
     if client_date:
         try:
             today = datetime.strptime(client_date, "%Y-%m-%d")
@@ -423,33 +1176,16 @@ def db_get_stats(db: Session, user_id: str, days: int = 365, client_date: str =
             today = datetime.now()
     else:
         today = datetime.now()
-        
-    cutoff_date = today - timedelta(days=days)
     
-    # Efficiently group by date in SQL if using Postgres, but for broad compatibility (SQLite)
-    # we'll fetch range and aggregate in python or use simple group by if possible.
-    # To correspond to previous logic:
+    dates = [(today - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
+    if not dates:
+        return {"dates": [], "totals": []} if columnar else []
     
-    logs = db.query(models.WaterIntake).filter(
-        models.WaterIntake.user_id == user_id,
-        models.WaterIntake.timestamp >= cutoff_date
-    ).all()
+    daily_totals = db_get_daily_totals(db, user_id, dates[-1], dates[0])
     
-    daily_totals = {}
-    for log in logs:
-        # Use local_date if available (new records), fall back to timestamp (legacy)
-        date_str = log.local_date if log.local_date else log.timestamp.strftime("%Y-%m-%d")
-        daily_totals[date_str] = daily_totals.get(date_str, 0) + log.intake_ml
-        
-    result = []
-    for i in range(days):
-        date = (today - timedelta(days=i)).strftime("%Y-%m-%d")
-        result.append({
-            "date": date,
-            "total": daily_totals.get(date, 0)
-        })
-    
-    return result
+    if columnar:
+        return {"dates": dates, "totals": [daily_totals.get(date, 0) for date in dates]}
+    return [{"date": date, "total": daily_totals.get(date, 0)} for date in dates]
 
 def db_get_streak(db: Session, user_id: str, goal: int = 2500):
     """Calculate current streak of days meeting the goal (Legacy Fallback)."""
@@ -474,6 +1210,7 @@ class LogRequest(BaseModel):
     goal: int
     date: Optional[str] = None
     client_timestamp: Optional[str] = None  # ISO timestamp from client for correct timezone
+    tz_offset_minutes: Optional[int] = None  # Client's UTC offset (minutes east); picks the rollover bucket
 
 class BulkLogEntry(BaseModel):
     amount: int
@@ -494,62 +1231,72 @@ def bulk_import(req: BulkImportRequest, db: Session = Depends(get_db)):
     """
     Bulk import water logs from localStorage guest data.
     Used when a user authenticates to migrate their offline data.
+
+    Set-based: one range query for duplicates, one batched INSERT, and one
+    grouped recompute of every affected day's snapshot.
     """
     if not req.logs:
         return {"status": "success", "imported": 0, "message": "No logs to import"}
     
-    # Ensure user exists
-    get_or_create_user(db, req.user_id)
+    started = time.perf_counter()
     
-    imported_count = 0
-    dates_to_update = set()
+    # Ensure user exists
+    ensure_user(db, req.user_id)
     
+    # 1. Parse (timestamps are stored naive, like the rest of water_intake)
+    incoming = {}
+    failed = 0
     for log_entry in req.logs:
         try:
-            # Parse the timestamp
-            timestamp = datetime.fromisoformat(log_entry.timestamp.replace('Z', '+00:00'))
-            date_str = timestamp.strftime("%Y-%m-%d")
-            
-            # Check if this exact log already exists (prevent duplicates)
-            existing = db.query(models.WaterIntake).filter(
-                models.WaterIntake.user_id == req.user_id,
-                models.WaterIntake.intake_ml == log_entry.amount,
-                models.WaterIntake.timestamp == timestamp
-            ).first()
-            
-            if not existing:
-                db_log = models.WaterIntake(
-                    user_id=req.user_id,
-                    intake_ml=log_entry.amount,
-                    timestamp=timestamp
-                )
-                db.add(db_log)
-                imported_count += 1
-                dates_to_update.add(date_str)
+            timestamp = datetime.fromisoformat(log_entry.timestamp.replace('Z', '+00:00')).replace(tzinfo=None)
+            incoming.setdefault((timestamp, log_entry.amount), log_entry)
         except Exception as e:
             print(f"Failed to import log: {log_entry}, error: {e}")
+            failed += 1
+    
+    if not incoming:
+        return {"status": "success", "imported": 0, "failed": failed, "dates_updated": []}
+    
+    # 2. Dedup against existing rows with a single range query
+    timestamps = [ts for ts, _ in incoming]
+    existing = set(db.query(models.WaterIntake.timestamp, models.WaterIntake.intake_ml).filter(
+        models.WaterIntake.user_id == req.user_id,
+        models.WaterIntake.timestamp >= min(timestamps),
+        models.WaterIntake.timestamp <= max(timestamps)
+    ).all())
+    
+    rows = []
+    dates_to_update = set()
+    for timestamp, amount in sorted(incoming):
+        if (timestamp, amount) in existing:
             continue
+        date_str = timestamp.strftime("%Y-%m-%d")
+        rows.append({
+            "user_id": req.user_id,
+            "intake_ml": amount,
+            "timestamp": timestamp,
+            "local_date": date_str
+        })
+        dates_to_update.add(date_str)
     
+    # 3. One batched INSERT, then every affected day's snapshot in one grouped pass
+    if rows:
+        db.execute(insert(models.WaterIntake), rows)
+        # FIX v1.5.9: Preserve historical goal if snapshot already exists (current goal for new dates)
+        db_recompute_snapshots(db, req.user_id, dates_to_update, default_goal=req.goal)
     db.commit()
     
-    # Update daily snapshots for all affected dates
-    # Update daily snapshots for all affected dates
-    for date_str in dates_to_update:
-        # FIX v1.5.9: Preserve historical goal if snapshot already exists
-        # Otherwise use current goal for new dates
-        existing_snap = db.query(models.DailySnapshot).filter(
-            models.DailySnapshot.user_id == req.user_id,
-            models.DailySnapshot.date == date_str
-        ).first()
-        
-        target_goal = existing_snap.goal_for_day if existing_snap else req.goal
-        
-        db_create_or_update_snapshot(db, req.user_id, date_str, target_goal)
+    invalidate_user_standings(req.user_id)
     
+    elapsed = time.perf_counter() - started
     return {
         "status": "success",
-        "imported": imported_count,
-        "dates_updated": list(dates_to_update)
+        "imported": len(rows),
+        "skipped_duplicates": len(req.logs) - failed - len(rows),
+        "failed": failed,
+        "dates_updated": sorted(dates_to_update),
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "logs_per_second": round(len(req.logs) / elapsed) if elapsed > 0 else None
     }
 
 class ClaimGuestDataRequest(BaseModel):
@@ -568,78 +1315,79 @@ def claim_guest_data(req: ClaimGuestDataRequest, db: Session = Depends(get_db)):
         return {"status": "error", "message": "Cannot claim guest data to guest account"}
     
     # Ensure user exists
-    get_or_create_user(db, req.user_id)
+    ensure_user(db, req.user_id)
     
-    # 1. Transfer water_intake records
-    guest_logs = db.query(models.WaterIntake).filter(
-        models.WaterIntake.user_id == GUEST_USER_ID
-    ).all()
+    # Everything below is set-based and runs in one transaction, so the cost
+    # scales with the number of distinct dates rather than the number of rows.
     
-    transferred_logs = 0
-    dates_affected = set()
-    
-    for log in guest_logs:
-        # Change ownership to authenticated user
-        log.user_id = req.user_id
-        transferred_logs += 1
-        dates_affected.add(log.timestamp.strftime("%Y-%m-%d"))
-    
-    # 2. Transfer daily_snapshots (or recreate them)
-    guest_snapshots = db.query(models.DailySnapshot).filter(
+    # 1. Dates touched by guest logs and guest snapshots
+    date_key = _log_date_expr()
+    dates_affected = {d for (d,) in db.query(date_key).filter(
+        models.WaterIntake.user_id == GUEST_USER_ID
+    ).distinct()}
+    dates_affected.update(d for (d,) in db.query(models.DailySnapshot.date).filter(
         models.DailySnapshot.user_id == GUEST_USER_ID
-    ).all()
+    ))
     
-    transferred_snapshots = 0
-    for snap in guest_snapshots:
-        # Check if user already has a snapshot for this date
-        existing = db.query(models.DailySnapshot).filter(
-            models.DailySnapshot.user_id == req.user_id,
-            models.DailySnapshot.date == snap.date
-        ).first()
-        
-        if existing:
-            # Merge: add totals, update goal_met
-            existing.total_intake += snap.total_intake
-            existing.goal_met = existing.total_intake >= existing.goal_for_day
-            existing.updated_at = datetime.now()
-            # Delete the guest snapshot
-            db.delete(snap)
-        else:
-            # Transfer ownership
-            snap.user_id = req.user_id
-            transferred_snapshots += 1
+    # 2. Merge snapshots keyed on (user, date): the user's own snapshot wins (it keeps
+    #    its historical goal), the guest's copy is dropped; the rest change owner.
+    user_snapshot = aliased(models.DailySnapshot)
+    db.query(models.DailySnapshot).filter(
+        models.DailySnapshot.user_id == GUEST_USER_ID,
+        models.DailySnapshot.date.in_(
+            select(user_snapshot.date).where(user_snapshot.user_id == req.user_id)
+        )
+    ).delete(synchronize_session=False)
+    transferred_snapshots = db.query(models.DailySnapshot).filter(
+        models.DailySnapshot.user_id == GUEST_USER_ID
+    ).update({models.DailySnapshot.user_id: req.user_id}, synchronize_session=False)
     
+    # 3. Transfer water_intake records
+    transferred_logs = db.query(models.WaterIntake).filter(
+        models.WaterIntake.user_id == GUEST_USER_ID
+    ).update({models.WaterIntake.user_id: req.user_id}, synchronize_session=False)
+    
+    # Guest aggregates and streak no longer match any rows
+    db.query(models.DailyTotal).filter(models.DailyTotal.user_id == GUEST_USER_ID).delete(synchronize_session=False)
+    db.query(models.StreakState).filter(models.StreakState.user_id == GUEST_USER_ID).delete(synchronize_session=False)
+    
+    # 4. Recompute merged totals for the affected dates in one grouped pass
+    # FIX v1.5.9: Preserve historical goal if snapshot already exists
+    # This prevents retroactive broken streaks if current goal > historical goal
+    db_recompute_snapshots(db, req.user_id, dates_affected, default_goal=req.goal, rebuild_streak=False)
+    
+    # Snapshots were merged/moved directly above, so rebuild the streak state (once,
+    # whether or not the recompute flipped a day) and both users' goal timelines
+    db.flush()
+    db_rebuild_streak_state(db, req.user_id)
+    if dates_affected:
+        db_sync_goal_timeline(db, req.user_id)
+        db_sync_goal_timeline(db, GUEST_USER_ID)
+    db_bump_data_version(db, GUEST_USER_ID)
     db.commit()
     
-    # Recreate snapshots for affected dates (to ensure accuracy)
-    for date_str in dates_affected:
-        # FIX v1.5.9: Preserve historical goal if snapshot already exists
-        # This prevents retroactive broken streaks if current goal > historical goal
-        existing_snap = db.query(models.DailySnapshot).filter(
-            models.DailySnapshot.user_id == req.user_id,
-            models.DailySnapshot.date == date_str
-        ).first()
-        
-        target_goal = existing_snap.goal_for_day if existing_snap else req.goal
-        
-        db_create_or_update_snapshot(db, req.user_id, date_str, target_goal)
+    invalidate_user_standings(req.user_id)
+    invalidate_user_standings(GUEST_USER_ID)
     
     return {
         "status": "success",
         "logs_transferred": transferred_logs,
         "snapshots_transferred": transferred_snapshots,
-        "dates_affected": list(dates_affected)
+        "dates_affected": sorted(dates_affected)
     }
 
 @app.post("/log")
-def log_intake(req: LogRequest, db: Session = Depends(get_db)):
+async def log_intake(req: LogRequest):
+    return await run_db(_log_intake, req)
+
+def _log_intake(db: Session, req: LogRequest):
     try:
         # 1. Log to DB (pass client_timestamp for timezone-accurate logging)
-        log_id, timestamp = db_log_intake(db, req.user_id, req.amount, req.date, req.client_timestamp)
+        log_id, timestamp = db_log_intake(db, req.user_id, req.amount, req.date, req.client_timestamp, req.tz_offset_minutes)
         
         # 2. Calculate total for the logged date
         logged_date = req.date or datetime.now().strftime("%Y-%m-%d")
-        total = db_get_date_total(db, req.user_id, logged_date)
+        total = db_get_daily_total(db, req.user_id, logged_date)
         
         # 3. Get today's individual logs
         today_logs = db_get_today_logs(db, req.user_id, logged_date)
@@ -654,10 +1402,10 @@ def log_intake(req: LogRequest, db: Session = Depends(get_db)):
             if resolved != 2500:
                 target_goal = resolved
                 
-        db_create_or_update_snapshot(db, req.user_id, logged_date, target_goal)
+        db_create_or_update_snapshot(db, req.user_id, logged_date, target_goal, total=total)
+        # (Yesterday's snapshot is locked by the rollover job, see DAY ROLLOVER)
         
-        # 5. Ensure previous day's snapshot is locked
-        db_lock_previous_day_snapshot(db, req.user_id, req.goal)
+        invalidate_user_standings(req.user_id)
         
         return {
             "status": "success",
@@ -676,6 +1424,219 @@ def log_intake(req: LogRequest, db: Session = Depends(get_db)):
             "today_logs": []
         }
 
+class BatchLogEntry(BaseModel):
+    amount: int
+    date: Optional[str] = None
+    client_timestamp: Optional[str] = None
+    idempotency_key: Optional[str] = None  # Client-generated; a replayed key is skipped
+
+class BatchLogRequest(BaseModel):
+    user_id: str
+    goal: int
+    entries: List[BatchLogEntry]
+    tz_offset_minutes: Optional[int] = None
+
+@app.post("/log/batch")
+async def log_intake_batch(req: BatchLogRequest):
+    """Replay queued offline logs in one transaction.
+
+    Entries already stored under the same idempotency key are reported as
+    duplicates instead of being inserted again. Each affected day's snapshot
+    is recomputed once.
+    """
+    return await run_db(_log_intake_batch, req)
+
+def _log_intake_batch(db: Session, req: BatchLogRequest):
+    if not req.entries:
+        return {"status": "success", "created": 0, "duplicates": 0, "results": [], "days": {}}
+    
+    ensure_user(db, req.user_id)
+    
+    keyed, unkeyed = {}, []
+    for index, entry in enumerate(req.entries):
+        local_date, timestamp = resolve_log_time(entry.date, entry.client_timestamp)
+        row = {
+            "user_id": req.user_id,
+            "intake_ml": entry.amount,
+            "timestamp": timestamp,
+            "local_date": local_date,
+            "idempotency_key": entry.idempotency_key
+        }
+        if entry.idempotency_key is None:
+            unkeyed.append((index, row))
+        else:
+            keyed.setdefault(entry.idempotency_key, (index, row))
+    
+    # 1. Insert; rows whose key is already stored are skipped by the unique index
+    log_ids = {}
+    if keyed:
+        stmt = _dialect_insert(db, models.WaterIntake).on_conflict_do_nothing(
+            index_elements=["user_id", "idempotency_key"]
+        ).returning(models.WaterIntake.id, models.WaterIntake.idempotency_key)
+        for log_id, key in db.execute(stmt, [row for _, row in keyed.values()]):
+            log_ids[keyed[key][0]] = log_id
+    if unkeyed:
+        stmt = insert(models.WaterIntake).returning(models.WaterIntake.id, sort_by_parameter_order=True)
+        for (index, _), (log_id,) in zip(unkeyed, db.execute(stmt, [row for _, row in unkeyed])):
+            log_ids[index] = log_id
+    
+    created_rows = [row for index, row in keyed.values() if index in log_ids] + [row for _, row in unkeyed]
+    results = [{
+        "idempotency_key": entry.idempotency_key,
+        "status": "created" if index in log_ids else "duplicate",
+        "log_id": log_ids.get(index)
+    } for index, entry in enumerate(req.entries)]
+    
+    # 2. One recompute per affected day (same goal rule as /log)
+    dates = sorted({row["local_date"] for row in created_rows})
+    goals = {date_str: req.goal for date_str in dates}
+    if req.goal == 0 or req.goal == 2500:
+        for date_str, resolved in db_resolve_goals(db, req.user_id, dates).items():
+            if resolved != 2500:
+                goals[date_str] = resolved
+    days = db_recompute_snapshots(db, req.user_id, dates, default_goal=req.goal, goals=goals)
+    if created_rows and req.tz_offset_minutes is not None:
+        db_bump_data_version(db, req.user_id, req.tz_offset_minutes)
+    db.commit()
+    
+    if created_rows:
+        invalidate_user_standings(req.user_id)
+    
+    return {
+        "status": "success",
+        "created": len(created_rows),
+        "duplicates": len(req.entries) - len(created_rows),
+        "results": results,
+        "days": days
+    }
+
+# --- GOAL TIMELINE ---
+# A day's goal is carried forward from the latest snapshot on or before it.
+# goal_changes stores only the dates where that goal changes, and each worker caches
+# a user's change points as two sorted arrays: resolving a date is a bisect, and a
+# whole range resolves in one pass. Snapshot writes that change a resolved goal
+# resync the user's rows (db_sync_goal_timeline); other workers see the change when
+# their cached entry expires (GOAL_TIMELINE_TTL seconds).
+GOAL_TIMELINE_TTL = float(os.getenv("GOAL_TIMELINE_TTL", "60"))
+GOAL_TIMELINE_MAX_USERS = int(os.getenv("GOAL_TIMELINE_MAX_USERS", "10000"))
+
+class GoalTimelineCache:
+    """Per-process LRU of user_id -> (change dates, goals), with a TTL.
+
+    Readers take generation() before querying and pass it to put(): if the user
+    was invalidated in between (a writer committed), the rows read may be stale
+    and are not cached.
+    """
+
+    def __init__(self, ttl: float = GOAL_TIMELINE_TTL, max_users: int = GOAL_TIMELINE_MAX_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._entries = OrderedDict()  # user_id -> (expires_at, dates, goals)
+        self._generation = 0  # Bumped by every invalidation
+        self._invalidated = OrderedDict()  # user_id -> generation of its last invalidation (bounded)
+        self._floor = 0  # Highest generation dropped from _invalidated; assumed for users not in it
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1], entry[2]
+            self.misses += 1
+            return None
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def put(self, user_id, dates, goals, generation):
+        with self._lock:
+            if self._invalidated.get(user_id, self._floor) > generation:
+                return  # Invalidated after the caller read its rows
+            self._entries[user_id] = (time.monotonic() + self.ttl, dates, goals)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._generation += 1
+            self._invalidated[user_id] = self._generation
+            self._invalidated.move_to_end(user_id)
+            while len(self._invalidated) > self.max_users:
+                self._floor = self._invalidated.popitem(last=False)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._invalidated.clear()
+            self._floor = self._generation
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+goal_timelines = GoalTimelineCache()
+
+def db_get_goal_timeline(db: Session, user_id: str):
+    """The user's goal change points as parallel (dates, goals) lists in date order."""
+    # Rows rewritten by this (uncommitted) transaction must not reach the shared cache
+    dirty = user_id in db.info.get("dirty_goal_timelines", ())
+    cached = None if dirty else goal_timelines.get(user_id)
+    if cached is not None:
+        return cached
+    
+    generation = goal_timelines.generation()  # Before the query, so a commit racing it is detected
+    rows = db.query(models.GoalChange.effective_date, models.GoalChange.goal).filter(
+        models.GoalChange.user_id == user_id
+    ).order_by(models.GoalChange.effective_date).all()
+    dates, goals = [row[0] for row in rows], [row[1] for row in rows]
+    if not dirty:
+        goal_timelines.put(user_id, dates, goals, generation)
+    return dates, goals
+
+def db_sync_goal_timeline(db: Session, user_id: str):
+    """Rederive the user's goal change points from their snapshots. Does not commit.
+
+    Call after any snapshot write or delete that can change a carried-forward goal.
+    """
+    db.flush()
+    ordered = select(
+        models.DailySnapshot.date,
+        models.DailySnapshot.goal_for_day,
+        func.lag(models.DailySnapshot.goal_for_day).over(order_by=models.DailySnapshot.date).label("previous_goal")
+    ).where(
+        models.DailySnapshot.user_id == user_id,
+        models.DailySnapshot.goal_for_day.isnot(None)
+    ).subquery()
+    changes = db.execute(select(ordered.c.date, ordered.c.goal_for_day).where(or_(
+        ordered.c.previous_goal.is_(None),
+        ordered.c.previous_goal != ordered.c.goal_for_day
+    )).order_by(ordered.c.date)).all()
+    
+    db.query(models.GoalChange).filter(models.GoalChange.user_id == user_id).delete(synchronize_session=False)
+    if changes:
+        db.execute(insert(models.GoalChange), [
+            {"user_id": user_id, "effective_date": date_str, "goal": goal} for date_str, goal in changes
+        ])
+    db.info.setdefault("dirty_goal_timelines", set()).add(user_id)
+    goal_timelines.invalidate(user_id)
+
+@event.listens_for(Session, "after_commit")
+def _publish_goal_timelines(session):
+    # Readers may have cached the old rows between the resync and the commit
+    for user_id in session.info.pop("dirty_goal_timelines", ()):
+        goal_timelines.invalidate(user_id)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_goal_timelines(session):
+    session.info.pop("dirty_goal_timelines", None)
+
 def db_get_snapshot_goal(db: Session, user_id: str, date_str: str):
     """Retrieve the effective goal for a specific date using the Snapshot Timeline.
     
@@ -685,20 +1646,23 @@ def db_get_snapshot_goal(db: Session, user_id: str, date_str: str):
     3. If still none (user is new), return default (2500).
     
     This ensures that if a user sets a goal on Monday, it applies to Tuesday
-    even if they haven't logged anything yet.
+    even if they haven't logged anything yet. Resolved from the goal timeline
+    (a bisect over the cached change points).
     """
-    # 1. Try to find the nearest snapshot on or before the target date
-    # We order by date DESC to get the latest one first.
-    snapshot = db.query(models.DailySnapshot).filter(
-        models.DailySnapshot.user_id == user_id,
-        models.DailySnapshot.date <= date_str
-    ).order_by(models.DailySnapshot.date.desc()).first()
-    
-    if snapshot:
-        return snapshot.goal_for_day
-    
-    # 2. No history found at all? Return default.
-    return 2500
+    dates, goals = db_get_goal_timeline(db, user_id)
+    index = bisect_right(dates, date_str) - 1
+    return goals[index] if index >= 0 else 2500
+
+def db_resolve_goals(db: Session, user_id: str, dates):
+    """Carried-forward goal for every date in `dates`, in one pass. Returns {date: goal}."""
+    change_dates, goals = db_get_goal_timeline(db, user_id)
+    resolved = {}
+    index = -1
+    for date_str in sorted(set(dates)):
+        while index + 1 < len(change_dates) and change_dates[index + 1] <= date_str:
+            index += 1
+        resolved[date_str] = goals[index] if index >= 0 else 2500
+    return resolved
 
 class UpdateGoalRequest(BaseModel):
     user_id: str
@@ -730,6 +1694,7 @@ def set_user_goal(user_id: str, req: SetGoalRequest, db: Session = Depends(get_d
     try:
         user = get_or_create_user(db, user_id)
         user.default_goal = req.goal
+        db_bump_data_version(db, user_id)
         db.commit()
         return {"status": "success", "goal": req.goal}
     except Exception as e:
@@ -757,6 +1722,7 @@ def set_user_drink_amount(user_id: str, req: SetDrinkAmountRequest, db: Session
     try:
         user = get_or_create_user(db, user_id)
         user.default_drink_amount = req.drink_amount
+        db_bump_data_version(db, user_id)
         db.commit()
         return {"status": "success", "drink_amount": req.drink_amount}
     except Exception as e:
@@ -765,17 +1731,20 @@ def set_user_drink_amount(user_id: str, req: SetDrinkAmountRequest, db: Session
         return {"status": "error", "message": str(e), "drink_amount": req.drink_amount}
 
 @app.delete("/log/{log_id}")
-def delete_log(log_id: int, user_id: str, date: str = None, db: Session = Depends(get_db)):
-    amount, timestamp, result = db_delete_log(db, log_id, user_id)
+async def delete_log(log_id: int, user_id: str, date: str = None):
+    return await run_db(_delete_log, log_id, user_id, date)
+
+def _delete_log(db: Session, log_id: int, user_id: str, date: str = None):
+    amount, timestamp, log_date, result = db_delete_log(db, log_id, user_id)
     if result != "success":
         raise HTTPException(status_code=404 if result == "Log not found" else 403, detail=result)
     
-    log_date = timestamp[:10]
     existing_goal = db_get_snapshot_goal(db, user_id, log_date)
     db_create_or_update_snapshot(db, user_id, log_date, existing_goal)
+    invalidate_user_standings(user_id)
     
     if date:
-        total = db_get_date_total(db, user_id, date)
+        total = db_get_daily_total(db, user_id, date)
         today_logs = db_get_today_logs(db, user_id, date)
     else:
         total = db_get_today_total(db, user_id)
@@ -789,11 +1758,18 @@ def delete_log(log_id: int, user_id: str, date: str = None, db: Session = Depend
     }
 
 @app.get("/history/{user_id}")
-def get_history(user_id: str, date: str = None, db: Session = Depends(get_db)):
+async def get_history(request: Request, user_id: str, date: str = None):
+    """Logs and total for a day. Supports If-None-Match (304 while the user's data is unchanged)."""
+    return await run_db(
+        conditional_json, user_id, request.headers.get("if-none-match"), request.query_params.multi_items(),
+        _get_history, user_id, date
+    )
+
+def _get_history(db: Session, user_id: str, date: str = None):
     today_logs = db_get_today_logs(db, user_id, date)
     snapshot_goal = None
     if date:
-        total = db_get_date_total(db, user_id, date)
+        total = db_get_daily_total(db, user_id, date)
         snapshot_goal = db_get_snapshot_goal(db, user_id, date)
     else:
         total = db_get_today_total(db, user_id)
@@ -802,39 +1778,173 @@ def get_history(user_id: str, date: str = None, db: Session = Depends(get_db)):
         
     return {"logs": today_logs, "total_today": total, "historical_goal": snapshot_goal}
 
+@app.get("/users/{user_id}/logs")
+async def get_log_history(user_id: str, cursor: Optional[int] = None, limit: int = HISTORY_PAGE_DEFAULT,
+                          start_date: Optional[str] = None, end_date: Optional[str] = None):
+    """Full log history, newest first. Pass `next_cursor` back as `cursor` for the next page.
+
+    `limit` is capped at 500; `start_date`/`end_date` (YYYY-MM-DD, inclusive) filter by log date.
+    """
+    for value in (start_date, end_date):
+        if value:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    items, next_cursor = await run_db(db_get_history, user_id, cursor, limit, start_date, end_date)
+    return ORJSONResponse({"logs": items, "next_cursor": next_cursor, "limit": max(1, min(limit, HISTORY_PAGE_MAX))})
+
 @app.get("/ai-feedback")
-def ai_feedback(user_id: str, goal: int, db: Session = Depends(get_db)):
-    total = db_get_today_total(db, user_id)
-    message = get_ai_feedback(total, goal)
+async def ai_feedback(user_id: str, goal: int):
+    total = await run_db(db_get_today_total, user_id)
+    message = await get_ai_feedback(total, goal)
     return {"message": message}
 
+@app.get("/ai-feedback/stream")
+async def ai_feedback_stream(request: Request, user_id: str, goal: int):
+    """Stream the AI coach message as Server-Sent Events (/ai-feedback stays as the JSON fallback)."""
+    total = await run_db(db_get_today_total, user_id)
+    return StreamingResponse(
+        ai_feedback_events(total, goal, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/ai-feedback/cache")
+def ai_feedback_cache_stats():
+    """Hit/miss/coalescing counters for the AI coach cache."""
+    return feedback_cache.stats()
+
+@app.get("/ai-feedback/health")
+def ai_feedback_health():
+    """Circuit breaker state, concurrency and the LLM latency histogram."""
+    return llm_client.stats()
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    await llm_client.aclose()
+
+def run_rollover_once():
+    db = SessionLocal()
+    try:
+        results = db_rollover(db)
+    finally:
+        db.close()
+    locked = sum(result["locked"] for result in results.values())
+    if locked:
+        print(f"[Rollover] Locked {locked} previous-day snapshots across {len(results)} timezone buckets")
+    return results
+
+async def rollover_loop(interval: int):
+    """Run the day rollover every `interval` seconds (each bucket is locked soon after its midnight)."""
+    from starlette.concurrency import run_in_threadpool
+    while True:
+        try:
+            await run_in_threadpool(run_rollover_once)
+        except Exception as e:
+            print(f"[Rollover] ERROR: {e}")
+        await asyncio.sleep(interval)
+
+@app.on_event("startup")
+async def start_rollover_task():
+    if ROLLOVER_INTERVAL > 0:
+        app.state.rollover_task = asyncio.create_task(rollover_loop(ROLLOVER_INTERVAL))
+
+@app.on_event("shutdown")
+async def stop_rollover_task():
+    task = getattr(app.state, "rollover_task", None)
+    if task is not None:
+        task.cancel()
+
 @app.get("/stats/{user_id}")
-def get_stats(user_id: str, days: int = 30, goal: int = 2500, client_date: str = None, db: Session = Depends(get_db)):
-    daily_data = db_get_stats(db, user_id, days, client_date)
-    
-    # Migration/Cleanup step - backfill any missing snapshots
-    db_backfill_snapshots(db, user_id, goal)
+async def get_stats(request: Request, user_id: str, days: int = 30, goal: int = 2500, client_date: str = None, format: str = "rows"):
+    """Daily totals plus streak and week/month summaries.
+
+    format=columnar returns parallel "dates"/"totals" arrays instead of the
+    "daily" list of dicts (intended for days=365 year views).
+    Supports If-None-Match (304 while the user's data is unchanged).
+    """
+    return await run_db(
+        conditional_json, user_id, request.headers.get("if-none-match"), request.query_params.multi_items(),
+        _get_stats, user_id, days, client_date, format
+    )
+
+def _get_stats(db: Session, user_id: str, days: int = 30, client_date: str = None, format: str = "rows"):
+    columnar = format == "columnar"
+    daily_data = db_get_stats(db, user_id, days, client_date, columnar=columnar)
+    totals = daily_data["totals"] if columnar else [d["total"] for d in daily_data]
     
-    # Use ONLY the new streak logic with client timezone
-    streak = db_get_streak_from_snapshots(db, user_id, client_date)
+    # Snapshot backfill runs in the background job (backfill_snapshots.py), keeping /stats a pure read
+    # Streak comes from the persisted streak state (client timezone grace rule applied on read)
+    streak = db_get_current_streak(db, user_id, client_date)
     
-    week_data = daily_data[:7]
-    week_total = sum(d["total"] for d in week_data)
+    week_data = totals[:7]
+    week_total = sum(week_data)
     week_avg = week_total / 7 if week_data else 0
     
-    month_data = daily_data[:30]
-    month_total = sum(d["total"] for d in month_data)
+    month_data = totals[:30]
+    month_total = sum(month_data)
     
-    return {
-        "daily": daily_data,
+    summary = {
         "streak": streak,
         "week_avg": round(week_avg),
         "week_total": week_total,
         "month_total": month_total
     }
+    if columnar:
+        return {"dates": daily_data["dates"], "totals": totals, **summary}
+    return {"daily": daily_data, **summary}
+
+@app.get("/dashboard/{user_id}")
+async def get_dashboard(request: Request, user_id: str, date: str = None, client_date: str = None, days: int = 30):
+    """Everything the home screen needs in one round trip.
+
+    Combines /user/{id}/goal, /user/{id}/drink-amount, /history and /stats from
+    a single session: the user row is loaded once and the selected day's total
+    is taken from the stats series when it falls inside it.
+    Supports If-None-Match like /history and /stats.
+    """
+    return await run_db(
+        conditional_json, user_id, request.headers.get("if-none-match"), request.query_params.multi_items(),
+        _get_dashboard, user_id, date, client_date, days
+    )
+
+def _get_dashboard(db: Session, user_id: str, date: str = None, client_date: str = None, days: int = 30):
+    user = get_or_create_user(db, user_id)
+    selected_date = date or client_date or datetime.now().strftime("%Y-%m-%d")
+    
+    stats = _get_stats(db, user_id, days, client_date)
+    series_totals = {row["date"]: row["total"] for row in stats["daily"]}
+    if selected_date in series_totals:
+        total = series_totals[selected_date]
+    else:
+        total = db_get_daily_total(db, user_id, selected_date)
+    
+    return {
+        "user_id": user_id,
+        "date": selected_date,
+        "settings": {
+            "goal": user.default_goal or 2500,
+            "drink_amount": user.default_drink_amount or 200
+        },
+        "logs": db_get_today_logs(db, user_id, selected_date),
+        "total_today": total,
+        "historical_goal": db_get_snapshot_goal(db, user_id, selected_date),
+        "stats": stats
+    }
+
+# --- OPERATIONS ENDPOINTS ---
+# /debug/* and /metrics expose internals (per-user data, SQL, route timings). With
+# OPS_TOKEN set they require "Authorization: Bearer <OPS_TOKEN>"; unset (local
+# development) they stay open.
+OPS_TOKEN = os.getenv("OPS_TOKEN")
+
+def require_ops_token(authorization: Optional[str] = Header(None)):
+    if OPS_TOKEN and not hmac.compare_digest(authorization or "", f"Bearer {OPS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
 
 # DEBUG endpoint - remove in production
-@app.get("/debug/snapshots/{user_id}")
+@app.get("/debug/snapshots/{user_id}", dependencies=[Depends(require_ops_token)])
 def debug_snapshots(user_id: str, db: Session = Depends(get_db)):
     """View daily snapshots for debugging streak issues."""
     snapshots = db_get_snapshots(db, user_id, 30)
@@ -847,47 +1957,148 @@ def debug_snapshots(user_id: str, db: Session = Depends(get_db)):
         "snapshot_count": len(snapshots)
     }
 
+@app.get("/debug/pool", dependencies=[Depends(require_ops_token)])
+def debug_pool():
+    """Connection pool usage and checkout wait times."""
+    return pool_stats()
+
+@app.get("/debug/slow-requests", dependencies=[Depends(require_ops_token)])
+def debug_slow_requests():
+    """Most recent requests over SLOW_REQUEST_MS, with their SQL statements and timings."""
+    return {"threshold_ms": metrics.SLOW_REQUEST_MS, "requests": list(metrics.slow_requests)}
+
+@app.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(require_ops_token)])
+def prometheus_metrics():
+    """Prometheus text exposition: per-route requests, latency, SQL statements/time, plus pool, LLM and cache metrics."""
+    gauges, counters = {}, {}
+    for name, pool in pool_stats().items():
+        for key in ("checked_out", "size", "overflow", "saturation"):
+            if pool.get(key) is not None:
+                gauges.setdefault(f"smartsip_db_pool_{key}", {})[(("pool", name),)] = pool[key]
+        for key in ("checkouts", "timeouts"):
+            if pool.get(key) is not None:
+                counters.setdefault(f"smartsip_db_pool_{key}_total", {})[(("pool", name),)] = pool[key]
+        if "wait_seconds" in pool:
+            gauges.setdefault("smartsip_db_pool_wait_seconds_max", {})[(("pool", name),)] = pool["wait_seconds"]["max"]
+    
+    llm = llm_client.stats()
+    gauges["smartsip_llm_in_flight"] = llm["in_flight"]
+    gauges["smartsip_llm_breaker_open"] = int(llm["breaker"]["state"] != "closed")
+    counters["smartsip_llm_rejected_total"] = llm["rejected"]
+    counters["smartsip_llm_breaker_trips_total"] = llm["breaker"]["trips"]
+    counters["smartsip_llm_calls_total"] = llm["latency_seconds"]["count"]
+    counters["smartsip_llm_latency_seconds_total"] = llm["latency_seconds"]["sum"]
+    
+    cache = feedback_cache.stats()
+    gauges["smartsip_ai_cache_entries"] = cache["entries"]
+    for key in ("hits", "misses", "coalesced"):
+        counters[f"smartsip_ai_cache_{key}_total"] = cache[key]
+    
+    timelines = goal_timelines.stats()
+    gauges["smartsip_goal_timeline_cache_entries"] = timelines["entries"]
+    for key in ("hits", "misses"):
+        counters[f"smartsip_goal_timeline_cache_{key}_total"] = timelines[key]
+    
+    users = known_users.stats()
+    gauges["smartsip_known_users_entries"] = users["entries"]
+    for key in ("hits", "misses"):
+        counters[f"smartsip_known_users_{key}_total"] = users[key]
+    
+    hub = leaderboard_hub.stats()
+    gauges["smartsip_leaderboard_stream_clients"] = hub["clients"]
+    counters["smartsip_leaderboard_recomputes_total"] = hub["recomputes"]
+    return metrics.render_prometheus(gauges, counters)
+
 # Data fix endpoint - move incorrectly dated records
+def db_move_logs(db: Session, user_id: str, from_date: str, to_date: str):
+    """Move every log of `from_date` to `to_date`, keeping the time of day. Does not commit.
+
+    One UPDATE over the indexed date match: local_date is set and the timestamp
+    shifted by whole days in SQL, so the cost is one round trip however many
+    logs the day has. Returns the number of logs moved.
+    """
+    days = (datetime.strptime(to_date, "%Y-%m-%d") - datetime.strptime(from_date, "%Y-%m-%d")).days
+    timestamp = models.WaterIntake.timestamp
+    if db.get_bind().dialect.name == "postgresql":
+        shifted = timestamp + timedelta(days=days)
+    else:
+        # SQLite stores "YYYY-MM-DD HH:MM:SS[.ffffff]": datetime() drops the fraction, so re-append it
+        shifted = func.datetime(timestamp, f"{days:+d} days").op("||")(func.substr(timestamp, 20))
+    result = db.execute(
+        update(models.WaterIntake)
+        .where(models.WaterIntake.user_id == user_id, _date_match(from_date))
+        .values(local_date=to_date, timestamp=shifted)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+class DateFix(BaseModel):
+    user_id: str
+    from_date: str
+    to_date: str
+    goal: int = 2500
+
+class FixDatesBatchRequest(BaseModel):
+    fixes: List[DateFix]
+
+def apply_date_fixes(db: Session, fixes: List[DateFix]):
+    """Apply date moves in order, then recompute only the affected days per user. Commits."""
+    results = []
+    by_user = {}
+    for fix in fixes:
+        moved = db_move_logs(db, fix.user_id, fix.from_date, fix.to_date)
+        results.append({"user_id": fix.user_id, "from_date": fix.from_date, "to_date": fix.to_date, "logs_moved": moved})
+        touched = by_user.setdefault(fix.user_id, {"from": set(), "goals": {}})
+        if fix.from_date != fix.to_date:
+            touched["from"].add(fix.from_date)
+            touched["from"].discard(fix.to_date)
+            touched["goals"].pop(fix.from_date, None)
+        touched["goals"][fix.to_date] = fix.goal
+    
+    for user_id, touched in by_user.items():
+        # Emptied days lose their snapshot and aggregate; target days are recomputed with the given goal
+        if touched["from"]:
+            for model in (models.DailySnapshot, models.DailyTotal):
+                db.query(model).filter(
+                    model.user_id == user_id,
+                    model.date.in_(touched["from"])
+                ).delete(synchronize_session=False)
+        db_recompute_snapshots(db, user_id, touched["goals"], goals=touched["goals"], rebuild_streak=False)
+        
+        # The from_date snapshots were deleted directly, so rebuild the streak state
+        # (once, covering the recomputed days too) and the goal timeline
+        db.flush()
+        db_rebuild_streak_state(db, user_id)
+        if touched["from"]:
+            db_sync_goal_timeline(db, user_id)
+    
+    db.commit()
+    for user_id in by_user:
+        invalidate_user_standings(user_id)
+    return results
+
 @app.post("/fix-dates")
 def fix_dates(user_id: str, from_date: str, to_date: str, goal: int = 2500, db: Session = Depends(get_db)):
     """Move water logs and snapshots from one date to another (for timezone fixes)."""
-    
-    # 1. Update water_intake timestamps
-    logs = db.query(models.WaterIntake).filter(
-        models.WaterIntake.user_id == user_id
-    ).all()
-    
-    moved_logs = 0
-    for log in logs:
-        log_date = log.timestamp.strftime("%Y-%m-%d")
-        if log_date == from_date:
-            # Update the timestamp to the correct date, keeping the time
-            new_timestamp = log.timestamp.replace(
-                year=int(to_date[:4]),
-                month=int(to_date[5:7]),
-                day=int(to_date[8:10])
-            )
-            log.timestamp = new_timestamp
-            moved_logs += 1
-    
-    # 2. Delete the incorrect date's snapshot
-    db.query(models.DailySnapshot).filter(
-        models.DailySnapshot.user_id == user_id,
-        models.DailySnapshot.date == from_date
-    ).delete()
-    
-    db.commit()
-    
-    # 3. Recreate snapshot for the correct date
-    db_create_or_update_snapshot(db, user_id, to_date, goal)
+    result = apply_date_fixes(db, [DateFix(user_id=user_id, from_date=from_date, to_date=to_date, goal=goal)])[0]
     
     return {
         "status": "success",
-        "logs_moved": moved_logs,
+        "logs_moved": result["logs_moved"],
         "from_date": from_date,
         "to_date": to_date
     }
 
+@app.post("/fix-dates/batch")
+def fix_dates_batch(req: FixDatesBatchRequest, db: Session = Depends(get_db)):
+    """Apply many (user, from_date, to_date) corrections in one transaction."""
+    results = apply_date_fixes(db, req.fixes)
+    return {
+        "status": "success",
+        "logs_moved": sum(r["logs_moved"] for r in results),
+        "fixes": results
+    }
+
 # --- SOCIAL CHALLENGES API ---
 import secrets
 
@@ -907,7 +2118,7 @@ def generate_invite_code():
 @app.post("/challenges")
 def create_challenge(req: CreateChallengeRequest, db: Session = Depends(get_db)):
     """Create a new hydration challenge."""
-    get_or_create_user(db, req.user_id)
+    ensure_user(db, req.user_id)
     
     start_date = datetime.now().strftime("%Y-%m-%d")
     end_date = (datetime.now() + timedelta(days=req.duration_days)).strftime("%Y-%m-%d")
@@ -977,7 +2188,7 @@ def get_challenge(invite_code: str, db: Session = Depends(get_db)):
 @app.post("/challenges/{invite_code}/join")
 def join_challenge(invite_code: str, req: JoinChallengeRequest, db: Session = Depends(get_db)):
     """Join an existing challenge."""
-    get_or_create_user(db, req.user_id)
+    ensure_user(db, req.user_id)
     
     challenge = db.query(models.Challenge).filter(
         models.Challenge.invite_code == invite_code
@@ -1004,6 +2215,7 @@ def join_challenge(invite_code: str, req: JoinChallengeRequest, db: Session = De
     )
     db.add(participant)
     db.commit()
+    invalidate_challenge_standings(challenge.id)
     
     return {
         "status": "success",
@@ -1011,9 +2223,260 @@ def join_challenge(invite_code: str, req: JoinChallengeRequest, db: Session = De
         "challenge_name": challenge.name
     }
 
+# --- LEADERBOARD STANDINGS ---
+# Standings are computed with one grouped query and cached per challenge until a
+# participant's intake changes (or the TTL expires, which covers other workers).
+LEADERBOARD_CACHE_TTL = int(os.getenv("LEADERBOARD_CACHE_TTL", "60"))
+LEADERBOARD_CACHE_MAX = 512
+
+_standings_lock = threading.Lock()
+_standings_cache = {}  # challenge_id -> (computed_at, generation, standings, rank_by_user)
+_standings_generation = {}  # challenge_id -> bumped on invalidation, guards against stale writes
+_user_challenges = {}  # user_id -> challenge_ids whose cached standings include the user
+
+def db_compute_standings(db: Session, challenge: models.Challenge):
+    """Rank every participant of a challenge in a single grouped query.
+
+    Ordering: days the daily goal was met (first duration_days days), then total ml
+    over the challenge window, then join order.
+    """
+    last_goal_day = _shift_date(challenge.start_date, challenge.duration_days - 1)
+    participant_ids = db.query(models.ChallengeParticipant.user_id).filter(
+        models.ChallengeParticipant.challenge_id == challenge.id
+    )
+    
+    # Per participant, per day totals inside the challenge window
+    date_key = _log_date_expr()
+    per_day = db.query(
+        models.WaterIntake.user_id.label("user_id"),
+        date_key.label("day"),
+        func.sum(models.WaterIntake.intake_ml).label("day_total")
+    ).filter(
+        models.WaterIntake.user_id.in_(participant_ids),
+        _date_range_match(challenge.start_date, challenge.end_date)
+    ).group_by(models.WaterIntake.user_id, date_key).subquery()
+    
+    per_user = db.query(
+        per_day.c.user_id,
+        func.sum(per_day.c.day_total).label("total_ml"),
+        func.sum(case(
+            (and_(per_day.c.day <= last_goal_day, per_day.c.day_total >= challenge.goal_ml), 1),
+            else_=0
+        )).label("days_met")
+    ).group_by(per_day.c.user_id).subquery()
+    
+    total_ml = func.coalesce(per_user.c.total_ml, 0)
+    days_met = func.coalesce(per_user.c.days_met, 0)
+    rows = db.query(
+        models.ChallengeParticipant.user_id,
+        models.ChallengeParticipant.joined_at,
+        total_ml,
+        days_met
+    ).outerjoin(
+        per_user, per_user.c.user_id == models.ChallengeParticipant.user_id
+    ).filter(
+        models.ChallengeParticipant.challenge_id == challenge.id
+    ).order_by(days_met.desc(), total_ml.desc(), models.ChallengeParticipant.id.asc()).all()
+    
+    return [{
+        "user_id": user_id,
+        "total_ml": int(total or 0),
+        "days_goal_met": int(met or 0),
+        "joined_at": joined_at.isoformat(),
+        "rank": rank
+    } for rank, (user_id, joined_at, total, met) in enumerate(rows, start=1)]
+
+def get_challenge_standings(db: Session, challenge: models.Challenge):
+    """Cached standings for a challenge: (standings, rank_by_user)."""
+    now = time.monotonic()
+    with _standings_lock:
+        cached = _standings_cache.get(challenge.id)
+        generation = _standings_generation.get(challenge.id, 0)
+        if cached and cached[1] == generation and now - cached[0] < LEADERBOARD_CACHE_TTL:
+            return cached[2], cached[3]
+    
+    standings = db_compute_standings(db, challenge)
+    rank_by_user = {entry["user_id"]: entry for entry in standings}
+    
+    with _standings_lock:
+        # Skip the write if a participant logged while we were computing
+        if _standings_generation.get(challenge.id, 0) == generation:
+            if len(_standings_cache) >= LEADERBOARD_CACHE_MAX:
+                for cid in [cid for cid, entry in _standings_cache.items() if now - entry[0] >= LEADERBOARD_CACHE_TTL]:
+                    del _standings_cache[cid]
+                if len(_standings_cache) >= LEADERBOARD_CACHE_MAX:
+                    _standings_cache.clear()
+            _standings_cache[challenge.id] = (now, generation, standings, rank_by_user)
+            for user_id in rank_by_user:
+                _user_challenges.setdefault(user_id, set()).add(challenge.id)
+    return standings, rank_by_user
+
+def _drop_challenge_standings(challenge_id: int):
+    with _standings_lock:
+        _standings_generation[challenge_id] = _standings_generation.get(challenge_id, 0) + 1
+        _standings_cache.pop(challenge_id, None)
+
+def _drop_user_standings(user_id: str):
+    with _standings_lock:
+        for challenge_id in _user_challenges.pop(user_id, ()):
+            _standings_generation[challenge_id] = _standings_generation.get(challenge_id, 0) + 1
+            _standings_cache.pop(challenge_id, None)
+
+def invalidate_challenge_standings(challenge_id: int):
+    """Drop the challenge's cached standings and notify live viewers (e.g. after a join)."""
+    _drop_challenge_standings(challenge_id)
+    leaderboard_broker.publish({"challenge_id": challenge_id})
+
+def invalidate_user_standings(user_id: str):
+    """Drop cached standings of every challenge the user is ranked in. Call after intake writes."""
+    _drop_user_standings(user_id)
+    leaderboard_broker.publish({"user_id": user_id})
+
+# --- LIVE LEADERBOARD (SSE) ---
+# Writers publish "user X changed" through the broker (in-process, or Redis across
+# workers). Each worker with open streams recomputes a changed challenge once per
+# debounce window and pushes only the rank deltas; viewers never poll.
+LEADERBOARD_PUSH_DEBOUNCE = float(os.getenv("LEADERBOARD_PUSH_DEBOUNCE", "0.5"))
+LEADERBOARD_STREAM_HEARTBEAT = float(os.getenv("LEADERBOARD_STREAM_HEARTBEAT", "15"))
+LEADERBOARD_STREAM_QUEUE = 32
+
+leaderboard_broker = create_broker()
+
+def _standings_for_challenge(db: Session, challenge_id: int):
+    challenge = db.query(models.Challenge).filter(models.Challenge.id == challenge_id).first()
+    if not challenge:
+        return None
+    return get_challenge_standings(db, challenge)[0]
+
+class LeaderboardHub:
+    """Per-worker fan-out of leaderboard changes to SSE clients."""
+
+    def __init__(self, broker, debounce: float):
+        self.broker = broker
+        self.debounce = debounce
+        self._loop = None
+        self._unsubscribe = None
+        self._watchers = {}  # challenge_id -> set of client queues
+        self._last = {}  # challenge_id -> {user_id: entry} as last sent
+        self._pending = set()  # challenge_ids with a recompute scheduled
+        self.recomputes = 0
+        self.deltas_sent = 0
+
+    def _ensure_subscribed(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self._unsubscribe:
+                self._unsubscribe()
+            self._unsubscribe = self.broker.subscribe(self._on_message, loop)
+            self._loop = loop
+
+    async def stream(self, challenge_id: int, is_disconnected=None):
+        """SSE events: a `snapshot` of the full ranking, then `delta` events as ranks change."""
+        self._ensure_subscribed()
+        queue = asyncio.Queue(maxsize=LEADERBOARD_STREAM_QUEUE)
+        self._watchers.setdefault(challenge_id, set()).add(queue)
+        try:
+            if challenge_id not in self._last:
+                await self._refresh(challenge_id)
+            yield self._snapshot_event(challenge_id)
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), LEADERBOARD_STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    if is_disconnected and await is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+        finally:
+            watchers = self._watchers.get(challenge_id)
+            if watchers is not None:
+                watchers.discard(queue)
+                if not watchers:
+                    del self._watchers[challenge_id]
+                    self._last.pop(challenge_id, None)
+
+    def _on_message(self, message: dict):
+        """Broker callback (on the loop). Other workers' writes also land here."""
+        affected = []
+        if "user_id" in message:
+            _drop_user_standings(message["user_id"])
+            affected = [cid for cid, last in self._last.items() if message["user_id"] in last]
+        if "challenge_id" in message:
+            _drop_challenge_standings(message["challenge_id"])
+            if message["challenge_id"] in self._watchers:
+                affected.append(message["challenge_id"])
+        for challenge_id in affected:
+            if challenge_id not in self._pending:
+                self._pending.add(challenge_id)
+                self._loop.call_later(self.debounce, lambda cid=challenge_id: asyncio.ensure_future(self._push(cid)))
+
+    async def _refresh(self, challenge_id: int):
+        standings = await run_db(_standings_for_challenge, challenge_id) or []
+        self.recomputes += 1
+        previous = self._last.get(challenge_id, {})
+        self._last[challenge_id] = {entry["user_id"]: entry for entry in standings}
+        return previous, standings
+
+    async def _push(self, challenge_id: int):
+        self._pending.discard(challenge_id)
+        if challenge_id not in self._watchers:
+            return
+        try:
+            previous, standings = await self._refresh(challenge_id)
+        except Exception as e:
+            print(f"[Leaderboard] Recompute failed for challenge {challenge_id}: {e}")
+            return
+        changes = []
+        for entry in standings:
+            before = previous.get(entry["user_id"])
+            if before is None or any(before[k] != entry[k] for k in ("rank", "total_ml", "days_goal_met")):
+                changes.append({**entry, "previous_rank": before["rank"] if before else None})
+        if not changes:
+            return
+        event = sse_event("delta", {"challenge_id": challenge_id, "changes": changes, "total_participants": len(standings)})
+        for queue in list(self._watchers.get(challenge_id, ())):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow client: replace its backlog with one full snapshot
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self._snapshot_event(challenge_id))
+            self.deltas_sent += 1
+
+    def _snapshot_event(self, challenge_id: int):
+        standings = sorted(self._last.get(challenge_id, {}).values(), key=lambda entry: entry["rank"])
+        return sse_event("snapshot", {"challenge_id": challenge_id, "leaderboard": standings, "total_participants": len(standings)})
+
+    def stats(self):
+        return {
+            "challenges_watched": len(self._watchers),
+            "clients": sum(len(queues) for queues in self._watchers.values()),
+            "recomputes": self.recomputes,
+            "deltas_sent": self.deltas_sent,
+            "broker": type(self.broker).__name__
+        }
+
+leaderboard_hub = LeaderboardHub(leaderboard_broker, LEADERBOARD_PUSH_DEBOUNCE)
+
+@app.get("/challenges/{challenge_id}/leaderboard/stream")
+async def leaderboard_stream(request: Request, challenge_id: int):
+    """Live leaderboard as Server-Sent Events: `snapshot`, then `delta` events with changed entries."""
+    exists = await run_db(lambda db: db.query(models.Challenge.id).filter(models.Challenge.id == challenge_id).first())
+    if not exists:
+        raise HTTPException(status_code=404, detail="Challenge not found")
+    return StreamingResponse(
+        leaderboard_hub.stream(challenge_id, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/challenges/{challenge_id}/leaderboard")
-def get_leaderboard(challenge_id: int, db: Session = Depends(get_db)):
-    """Get leaderboard for a challenge."""
+def get_leaderboard(challenge_id: int, limit: Optional[int] = None, offset: int = 0, user_id: Optional[str] = None, db: Session = Depends(get_db)):
+    """Get leaderboard for a challenge.
+
+    Optional `limit`/`offset` paginate the ranking (limit capped at 500);
+    `user_id` adds that participant's own entry as `my_rank`.
+    """
     challenge = db.query(models.Challenge).filter(
         models.Challenge.id == challenge_id
     ).first()
@@ -1021,50 +2484,31 @@ def get_leaderboard(challenge_id: int, db: Session = Depends(get_db)):
     if not challenge:
         raise HTTPException(status_code=404, detail="Challenge not found")
     
-    participants = db.query(models.ChallengeParticipant).filter(
-        models.ChallengeParticipant.challenge_id == challenge_id
-    ).all()
-    
-    leaderboard = []
-    for p in participants:
-        # Calculate total intake during challenge period
-        total = db.query(func.sum(models.WaterIntake.intake_ml)).filter(
-            models.WaterIntake.user_id == p.user_id,
-            models.WaterIntake.timestamp >= datetime.strptime(challenge.start_date, "%Y-%m-%d"),
-            models.WaterIntake.timestamp < datetime.strptime(challenge.end_date, "%Y-%m-%d") + timedelta(days=1)
-        ).scalar() or 0
-        
-        # Count days where goal was met
-        days_met = 0
-        for i in range(challenge.duration_days):
-            date_str = (datetime.strptime(challenge.start_date, "%Y-%m-%d") + timedelta(days=i)).strftime("%Y-%m-%d")
-            daily_total = db_get_date_total(db, p.user_id, date_str)
-            if daily_total >= challenge.goal_ml:
-                days_met += 1
-        
-        leaderboard.append({
-            "user_id": p.user_id,
-            "total_ml": total,
-            "days_goal_met": days_met,
-            "joined_at": p.joined_at.isoformat()
-        })
+    standings, rank_by_user = get_challenge_standings(db, challenge)
     
-    # Sort by days met (primary), then total ml (secondary)
-    leaderboard.sort(key=lambda x: (x["days_goal_met"], x["total_ml"]), reverse=True)
-    
-    # Add rank
-    for i, entry in enumerate(leaderboard):
-        entry["rank"] = i + 1
+    offset = max(offset, 0)
+    if limit is not None:
+        limit = max(min(limit, 500), 0)
+        page = standings[offset:offset + limit]
+    else:
+        page = standings[offset:]
     
-    return {
+    response = {
         "challenge_id": challenge_id,
         "challenge_name": challenge.name,
         "status": challenge.status,
         "start_date": challenge.start_date,
         "end_date": challenge.end_date,
         "goal_ml": challenge.goal_ml,
-        "leaderboard": leaderboard
+        "leaderboard": page,
+        "total_participants": len(standings),
+        "offset": offset,
+        "limit": limit
     }
+    if user_id:
+        response["my_rank"] = rank_by_user.get(user_id)
+    # Plain JSON types only - skip FastAPI's jsonable_encoder pass over every entry
+    return ORJSONResponse(response)
 
 @app.get("/users/{user_id}/challenges")
 def get_user_challenges(user_id: str, db: Session = Depends(get_db)):
@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from database import SessionLocal
+from backend import db_backfill_snapshots
+import models
+import sys
+import time
+
+def run_backfill(user_id: str = None, through_date: str = None):
+    """Backfill missing snapshots for every user whose watermark is behind `through_date`."""
+    if through_date is None:
+        through_date = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    
+    db = SessionLocal()
+    try:
+        # Users already backfilled through the target day are skipped without touching their logs
+        query = db.query(models.User.id).outerjoin(
+            models.BackfillWatermark, models.BackfillWatermark.user_id == models.User.id
+        ).filter(or_(
+            models.BackfillWatermark.backfilled_through.is_(None),
+            models.BackfillWatermark.backfilled_through < through_date
+        ))
+        if user_id:
+            query = query.filter(models.User.id == user_id)
+        user_ids = [row[0] for row in query.all()]
+        
+        created = 0
+        for uid in user_ids:
+            try:
+                created += db_backfill_snapshots(db, uid, through_date)
+            except Exception as e:
+                db.rollback()
+                print(f"  [ERROR] User {uid}: {e}")
+        
+        print(f"[Backfill] {len(user_ids)} users checked through {through_date}, {created} snapshots created")
+        return created
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    # Usage: python backfill_snapshots.py [--user USER_ID] [--loop SECONDS]
+    # One-shot by default (cron); --loop keeps it running as a background worker.
+    args = sys.argv[1:]
+    user = args[args.index("--user") + 1] if "--user" in args else None
+    interval = int(args[args.index("--loop") + 1]) if "--loop" in args else None
+    
+    run_backfill(user_id=user)
+    while interval:
+        time.sleep(interval)
+        run_backfill(user_id=user)
@@ -0,0 +1,458 @@
+"""Reproducible load test for the SmartSip API.
+
+Seeds a database with N users x M days of synthetic history (logs, snapshots,
+challenges), then drives every route in-process through the ASGI app at a fixed
+concurrency and writes p50/p95/p99 latency, throughput and SQL statements per
+request to a JSON report. Two reports can be compared to catch regressions
+between commits.
+
+Usage:
+    python benchmark.py [--users 200] [--days 90] [--requests 200] [--concurrency 8]
+                        [--database-url sqlite:///./benchmark.db] [--routes stats,log]
+                        [--output report.json] [--compare baseline.json] [--reuse]
+
+The database defaults to a separate local SQLite file, never DATABASE_URL from the
+environment; pass --database-url postgresql://... to benchmark Postgres. Seeding
+only ever deletes and recreates rows of users whose id starts with "bench-".
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Database, backend and metrics modules are imported lazily: DATABASE_URL has to be
+# set before database.py creates its engines.
+
+USER_PREFIX = "bench-"
+GOALS = (2000, 2500, 3000, 3500)
+GOAL_WEIGHTS = (25, 45, 20, 10)
+DRINK_AMOUNTS = (150, 200, 250, 330, 500)
+DRINK_WEIGHTS = (10, 35, 30, 15, 10)
+
+# Routes that never complete on their own (long-lived event streams)
+EXCLUDED_ROUTES = {"GET /challenges/{challenge_id}/leaderboard/stream"}
+
+# --- SYNTHETIC DATA ---
+def clear_benchmark_data(db):
+    """Delete every row belonging to benchmark users. Commits."""
+    import models
+    from backend import known_users, goal_timelines
+
+    bench_user = f"{USER_PREFIX}%"
+    challenge_ids = [row[0] for row in db.query(models.Challenge.id).filter(models.Challenge.creator_id.like(bench_user))]
+    db.query(models.ChallengeParticipant).filter(
+        models.ChallengeParticipant.user_id.like(bench_user) | models.ChallengeParticipant.challenge_id.in_(challenge_ids)
+    ).delete(synchronize_session=False)
+    db.query(models.Challenge).filter(models.Challenge.id.in_(challenge_ids)).delete(synchronize_session=False)
+    for model in (models.WaterIntake, models.DailySnapshot, models.DailyTotal,
+                  models.StreakState, models.BackfillWatermark, models.GoalChange):
+        db.query(model).filter(model.user_id.like(bench_user)).delete(synchronize_session=False)
+    db.query(models.User).filter(models.User.id.like(bench_user)).delete(synchronize_session=False)
+    db.commit()
+    known_users.clear()  # Deleted ids must be inserted again
+    goal_timelines.clear()
+
+def _day_logs(rng, user_id, date_str, goal, drink_amount, diligence):
+    """One day of logs: about `diligence` x goal, in glass-sized sips between 6:00 and 23:00."""
+    target = goal * max(0.1, rng.gauss(diligence, 0.2))
+    count = max(1, round(target / drink_amount))
+    day_start = datetime.strptime(date_str, "%Y-%m-%d")
+    seconds = sorted(int(min(23, max(6, rng.gauss(14, 4))) * 3600) for _ in range(count))
+    return [{
+        "user_id": user_id,
+        "intake_ml": drink_amount if rng.random() < 0.8 else rng.choice(DRINK_AMOUNTS),
+        "drink_type": "Water",
+        "timestamp": day_start + timedelta(seconds=second),
+        "local_date": date_str
+    } for second in seconds]
+
+def seed(db, users: int = 200, days: int = 90, challenges: int = None, seed: int = 42, today=None):
+    """Replace the benchmark users' data with a deterministic synthetic history. Commits.
+
+    Each user has a goal, a usual glass size, a chance of logging on any given day
+    and a typical share of the goal reached; one in five changed their goal once.
+    Snapshots, daily totals and streaks are derived through db_recompute_snapshots
+    so they are consistent with the logs. Returns the number of logs inserted.
+    """
+    import models
+    from sqlalchemy import insert
+    from backend import db_recompute_snapshots, _chunks
+
+    rng = random.Random(seed)
+    today = today or datetime.now().date()
+    dates = [(today - timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(days - 1, -1, -1)]
+    clear_benchmark_data(db)
+
+    user_rows, logs, goals_by_user = [], [], {}
+    for i in range(users):
+        user_id = f"{USER_PREFIX}user-{i:05d}"
+        goal = rng.choices(GOALS, GOAL_WEIGHTS)[0]
+        drink_amount = rng.choices(DRINK_AMOUNTS, DRINK_WEIGHTS)[0]
+        activity = rng.betavariate(6, 1.5)  # Chance of logging at all on a given day
+        diligence = rng.betavariate(5, 2) * 1.3  # Typical share of the goal reached
+        changed_at = rng.randrange(days) if rng.random() < 0.2 else None
+        previous_goal = rng.choice(GOALS)
+
+        user_rows.append({
+            "id": user_id, "is_guest": rng.random() < 0.3, "default_goal": goal,
+            "default_drink_amount": drink_amount, "data_version": 0,
+            "created_at": datetime.combine(today, datetime.min.time()) - timedelta(days=days)
+        })
+        day_goals = {}
+        for index, date_str in enumerate(dates):
+            if rng.random() > activity:
+                continue
+            day_goal = previous_goal if changed_at is not None and index < changed_at else goal
+            day_goals[date_str] = day_goal
+            logs.extend(_day_logs(rng, user_id, date_str, day_goal, drink_amount, diligence))
+        goals_by_user[user_id] = day_goals
+
+    db.execute(insert(models.User), user_rows)
+    for chunk in _chunks(logs, 5000):
+        db.execute(insert(models.WaterIntake), chunk)
+    db.flush()
+    for index, (user_id, day_goals) in enumerate(goals_by_user.items()):
+        db_recompute_snapshots(db, user_id, day_goals, goals=day_goals)
+        if index % 50 == 49:
+            db.commit()
+
+    user_ids = [row["id"] for row in user_rows]
+    for i in range(challenges if challenges is not None else max(1, users // 20)):
+        duration = rng.choice((7, 14, 30))
+        start = today - timedelta(days=rng.randrange(duration))
+        members = rng.sample(user_ids, min(len(user_ids), rng.randint(5, 50)))
+        challenge = models.Challenge(
+            creator_id=members[0], name=f"Benchmark challenge {i}", goal_ml=rng.choice(GOALS),
+            duration_days=duration, start_date=start.strftime("%Y-%m-%d"),
+            end_date=(start + timedelta(days=duration)).strftime("%Y-%m-%d"),
+            invite_code=f"BN{i:06d}"
+        )
+        db.add(challenge)
+        db.flush()
+        db.add_all(models.ChallengeParticipant(challenge_id=challenge.id, user_id=member) for member in members)
+    db.commit()
+    return len(logs)
+
+def load_context(db, days: int, seed: int = 42, today=None):
+    """What the request builders pick from: users, dates, challenges and deletable log ids."""
+    import models
+
+    today = today or datetime.now().date()
+    bench_user = f"{USER_PREFIX}user-%"
+    users = [
+        {"id": user_id, "goal": goal or 2500, "drink_amount": drink_amount or 200}
+        for user_id, goal, drink_amount in db.query(
+            models.User.id, models.User.default_goal, models.User.default_drink_amount
+        ).filter(models.User.id.like(bench_user)).order_by(models.User.id)
+    ]
+    challenges = db.query(models.Challenge.id, models.Challenge.invite_code).filter(
+        models.Challenge.creator_id.like(f"{USER_PREFIX}%")
+    ).order_by(models.Challenge.id).all()
+    log_ids = db.query(models.WaterIntake.id, models.WaterIntake.user_id).filter(
+        models.WaterIntake.user_id.like(bench_user)
+    ).order_by(models.WaterIntake.id).all()
+    if not users:
+        raise SystemExit("No benchmark data found - run without --reuse to seed it")
+
+    rng = random.Random(seed)
+    rng.shuffle(log_ids)
+    return {
+        "users": users,
+        "dates": [(today - timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(days - 1, -1, -1)],
+        "challenges": [tuple(row) for row in challenges],
+        "log_ids": [tuple(row) for row in log_ids],
+        "created": 0
+    }
+
+# --- REQUEST BUILDERS ---
+# Each returns (method, url, httpx request kwargs) for one request.
+def _user(ctx, rng):
+    return rng.choice(ctx["users"])
+
+def _past_date(ctx, rng):
+    return rng.choice(ctx["dates"][:-1] or ctx["dates"])
+
+def _today(ctx):
+    return ctx["dates"][-1]
+
+def _new_user_id(ctx, kind):
+    ctx["created"] += 1
+    return f"{USER_PREFIX}{kind}-{ctx['created']:06d}"
+
+def _challenge(ctx, rng):
+    return rng.choice(ctx["challenges"]) if ctx["challenges"] else (0, "MISSING0")
+
+def _log_entry(ctx, rng, user):
+    now = datetime.now().replace(microsecond=0)
+    return {"amount": user["drink_amount"], "date": _today(ctx), "client_timestamp": now.isoformat()}
+
+def _date_fix(ctx, rng):
+    user = _user(ctx, rng)
+    from_date = rng.choice(ctx["dates"][1:-1] or ctx["dates"])
+    to_date = (datetime.strptime(from_date, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+    return {"user_id": user["id"], "from_date": from_date, "to_date": to_date, "goal": user["goal"]}
+
+def _delete_log(ctx, rng):
+    log_id, user_id = ctx["log_ids"].pop() if ctx["log_ids"] else (0, _user(ctx, rng)["id"])
+    return "DELETE", f"/log/{log_id}", {"params": {"user_id": user_id}}
+
+def _bulk_import(ctx, rng):
+    user = _user(ctx, rng)
+    day = datetime.strptime(_past_date(ctx, rng), "%Y-%m-%d")
+    logs = [{"amount": user["drink_amount"], "timestamp": (day + timedelta(seconds=rng.randrange(86400))).isoformat()}
+            for _ in range(50)]
+    return "POST", "/bulk-import", {"json": {"user_id": user["id"], "goal": user["goal"], "logs": logs}}
+
+def _log(ctx, rng):
+    user = _user(ctx, rng)
+    return "POST", "/log", {"json": {"user_id": user["id"], "goal": user["goal"], **_log_entry(ctx, rng, user)}}
+
+def _log_batch(ctx, rng):
+    user = _user(ctx, rng)
+    entries = [{**_log_entry(ctx, rng, user), "idempotency_key": f"{USER_PREFIX}{rng.getrandbits(64):016x}"}
+               for _ in range(10)]
+    return "POST", "/log/batch", {"json": {"user_id": user["id"], "goal": user["goal"], "entries": entries}}
+
+def _update_goal(ctx, rng):
+    user = _user(ctx, rng)
+    return "POST", "/update-goal", {"json": {"user_id": user["id"], "date": _past_date(ctx, rng), "goal": user["goal"]}}
+
+def _set_goal(ctx, rng):
+    user = _user(ctx, rng)
+    return "PUT", f"/user/{user['id']}/goal", {"json": {"goal": user["goal"]}}
+
+def _set_drink_amount(ctx, rng):
+    user = _user(ctx, rng)
+    return "PUT", f"/user/{user['id']}/drink-amount", {"json": {"drink_amount": user["drink_amount"]}}
+
+# (name, builder). Reads run before writes so every read scenario sees the seeded data.
+SCENARIOS = [
+    ("root", lambda ctx, rng: ("GET", "/", {})),
+    ("get_goal", lambda ctx, rng: ("GET", f"/user/{_user(ctx, rng)['id']}/goal", {})),
+    ("get_drink_amount", lambda ctx, rng: ("GET", f"/user/{_user(ctx, rng)['id']}/drink-amount", {})),
+    ("history", lambda ctx, rng: ("GET", f"/history/{_user(ctx, rng)['id']}", {"params": {"date": _today(ctx)}})),
+    ("log_history", lambda ctx, rng: ("GET", f"/users/{_user(ctx, rng)['id']}/logs", {"params": {"limit": 100}})),
+    ("stats_30d", lambda ctx, rng: ("GET", f"/stats/{_user(ctx, rng)['id']}", {"params": {"days": 30, "client_date": _today(ctx)}})),
+    ("stats_365d_columnar", lambda ctx, rng: (
+        "GET", f"/stats/{_user(ctx, rng)['id']}",
+        {"params": {"days": 365, "client_date": _today(ctx), "format": "columnar"}})),
+    ("dashboard", lambda ctx, rng: ("GET", f"/dashboard/{_user(ctx, rng)['id']}", {"params": {"date": _today(ctx), "client_date": _today(ctx)}})),
+    ("debug_snapshots", lambda ctx, rng: ("GET", f"/debug/snapshots/{_user(ctx, rng)['id']}", {})),
+    ("get_challenge", lambda ctx, rng: ("GET", f"/challenges/{_challenge(ctx, rng)[1]}", {})),
+    ("leaderboard", lambda ctx, rng: ("GET", f"/challenges/{_challenge(ctx, rng)[0]}/leaderboard", {"params": {"limit": 20}})),
+    ("leaderboard_with_user", lambda ctx, rng: (
+        "GET", f"/challenges/{_challenge(ctx, rng)[0]}/leaderboard", {"params": {"limit": 20, "user_id": _user(ctx, rng)["id"]}})),
+    ("user_challenges", lambda ctx, rng: ("GET", f"/users/{_user(ctx, rng)['id']}/challenges", {})),
+    ("ai_feedback", lambda ctx, rng: ("GET", "/ai-feedback", {"params": {"user_id": _user(ctx, rng)["id"], "goal": 2500}})),
+    ("ai_feedback_stream", lambda ctx, rng: ("GET", "/ai-feedback/stream", {"params": {"user_id": _user(ctx, rng)["id"], "goal": 2500}})),
+    ("ai_feedback_cache", lambda ctx, rng: ("GET", "/ai-feedback/cache", {})),
+    ("ai_feedback_health", lambda ctx, rng: ("GET", "/ai-feedback/health", {})),
+    ("debug_pool", lambda ctx, rng: ("GET", "/debug/pool", {})),
+    ("debug_slow_requests", lambda ctx, rng: ("GET", "/debug/slow-requests", {})),
+    ("metrics", lambda ctx, rng: ("GET", "/metrics", {})),
+    ("log", _log),
+    ("log_batch", _log_batch),
+    ("bulk_import", _bulk_import),
+    ("update_goal", _update_goal),
+    ("set_goal", _set_goal),
+    ("set_drink_amount", _set_drink_amount),
+    ("create_challenge", lambda ctx, rng: ("POST", "/challenges", {"json": {
+        "user_id": _user(ctx, rng)["id"], "name": "Benchmark challenge", "goal_ml": 2500, "duration_days": 7}})),
+    ("join_challenge", lambda ctx, rng: ("POST", f"/challenges/{_challenge(ctx, rng)[1]}/join", {"json": {"user_id": _user(ctx, rng)["id"]}})),
+    ("claim_guest_data", lambda ctx, rng: ("POST", "/claim-guest-data", {"json": {"user_id": _new_user_id(ctx, "claim"), "goal": 2500}})),
+    ("fix_dates", lambda ctx, rng: ("POST", "/fix-dates", {"params": _date_fix(ctx, rng)})),
+    ("fix_dates_batch", lambda ctx, rng: ("POST", "/fix-dates/batch", {"json": {"fixes": [_date_fix(ctx, rng) for _ in range(5)]}})),
+    ("delete_log", _delete_log),
+]
+
+# --- LOAD DRIVER ---
+def percentile(sorted_values, pct: float):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)]
+
+async def run_scenario(client, build, ctx, rng, requests: int, concurrency: int, warmup: int = 0):
+    """Send `requests` requests from `concurrency` concurrent workers; returns the scenario's stats."""
+    import metrics
+
+    for _ in range(warmup):
+        method, url, kwargs = build(ctx, rng)
+        await client.request(method, url, **kwargs)
+    metrics.reset()
+
+    latencies, statuses = [], {}
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            method, url, kwargs = build(ctx, rng)
+            started = time.perf_counter()
+            try:
+                status = (await client.request(method, url, **kwargs)).status_code
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    wall = time.perf_counter() - started
+
+    routes = metrics.route_summary()
+    served = sum(route["requests"] for route in routes.values()) or 1
+    latencies.sort()
+    ms = lambda seconds: round(seconds * 1000, 2) if seconds is not None else None
+    return {
+        "routes": sorted(routes),
+        "requests": len(latencies),
+        "errors": sum(count for status, count in statuses.items() if not isinstance(status, int) or status >= 400),
+        "status_counts": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "max_ms": ms(latencies[-1]) if latencies else None,
+        "throughput_rps": round(len(latencies) / wall, 1) if wall > 0 else None,
+        "queries_per_request": round(sum(route["statements"] for route in routes.values()) / served, 2),
+        "db_ms_per_request": round(sum(route["db_seconds"] for route in routes.values()) * 1000 / served, 2)
+    }
+
+async def run_benchmark(ctx, scenarios=None, requests: int = 200, concurrency: int = 8, seed: int = 42, warmup: int = 5):
+    """Run each scenario in order against the in-process app; returns {name: stats}."""
+    import httpx
+    from backend import app
+
+    rng = random.Random(seed)
+    results = {}
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    # The /debug and /metrics scenarios need the ops token when one is configured
+    headers = {"Authorization": f"Bearer {os.environ['OPS_TOKEN']}"} if os.getenv("OPS_TOKEN") else {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", headers=headers, timeout=60) as client:
+        for name, build in scenarios or SCENARIOS:
+            results[name] = await run_scenario(client, build, ctx, rng, requests, concurrency, warmup)
+            stats = results[name]
+            print(f"  {name:<24} p50 {stats['p50_ms']:>8} ms  p95 {stats['p95_ms']:>8} ms  "
+                  f"p99 {stats['p99_ms']:>8} ms  {stats['throughput_rps']:>8} req/s  "
+                  f"{stats['queries_per_request']:>6} q/req  errors {stats['errors']}")
+    return results
+
+def uncovered_routes(results):
+    """API routes that no scenario reached (besides the excluded streams)."""
+    from fastapi.routing import APIRoute
+    from backend import app
+
+    covered = {route for stats in results.values() for route in stats["routes"]}
+    declared = {f"{method} {route.path}" for route in app.routes if isinstance(route, APIRoute) for method in route.methods}
+    return sorted(declared - covered - EXCLUDED_ROUTES)
+
+# --- REPORTS ---
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_reports(baseline: dict, current: dict, threshold_pct: float = 10.0):
+    """Print per-scenario changes; returns the scenarios whose p95 or statement count regressed."""
+    regressions = []
+    for key in ("database", "users", "days", "seed", "requests_per_scenario", "concurrency"):
+        if baseline.get("meta", {}).get(key) != current["meta"].get(key):
+            print(f"[Benchmark] Warning: {key} differs from the baseline "
+                  f"({baseline.get('meta', {}).get(key)} vs {current['meta'].get(key)}) - numbers are not comparable")
+    print(f"\n{'scenario':<24} {'p95 ms (base -> now)':>26} {'req/s (base -> now)':>24} {'q/req (base -> now)':>22}")
+    for name, now in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base or not base.get("p95_ms") or not now.get("p95_ms"):
+            continue
+        p95_change = (now["p95_ms"] - base["p95_ms"]) / base["p95_ms"] * 100
+        regressed = p95_change > threshold_pct or now["queries_per_request"] - base["queries_per_request"] > 0.5
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<24} {base['p95_ms']:>9} -> {now['p95_ms']:>8} ({p95_change:+5.0f}%)"
+              f" {base['throughput_rps']:>10} -> {now['throughput_rps']:>9}"
+              f" {base['queries_per_request']:>9} -> {now['queries_per_request']:>8}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seed synthetic data and load-test every SmartSip route in-process.")
+    parser.add_argument("--database-url", default="sqlite:///./benchmark.db")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--challenges", type=int, default=None, help="default: users / 20")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests per scenario")
+    parser.add_argument("--routes", default=None, help="comma-separated scenario name filters")
+    parser.add_argument("--reuse", action="store_true", help="keep existing benchmark data instead of reseeding")
+    parser.add_argument("--seed-only", action="store_true")
+    parser.add_argument("--output", default="benchmark-report.json")
+    parser.add_argument("--compare", default=None, help="baseline report to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="p95 regression threshold (%%)")
+    args = parser.parse_args(argv)
+
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("LLM_FAKE", "1")  # The AI coach is measured without the network
+    os.environ.setdefault("LLM_FAKE_DELAY", "0")
+    os.environ.setdefault("SLOW_REQUEST_MS", "60000")  # Keep the slow-request log quiet under load
+    from database import SessionLocal, SQLALCHEMY_DATABASE_URL
+
+    db = SessionLocal()
+    try:
+        if not args.reuse:
+            started = time.perf_counter()
+            logs = seed(db, args.users, args.days, args.challenges, args.seed)
+            print(f"[Benchmark] Seeded {args.users} users x {args.days} days ({logs} logs) in {time.perf_counter() - started:.1f}s")
+        if args.seed_only:
+            return 0
+        ctx = load_context(db, args.days, args.seed)
+    finally:
+        db.close()
+
+    scenarios = SCENARIOS
+    if args.routes:
+        filters = [f.strip() for f in args.routes.split(",") if f.strip()]
+        scenarios = [(name, build) for name, build in SCENARIOS if any(f in name for f in filters)]
+    print(f"[Benchmark] {len(scenarios)} scenarios x {args.requests} requests at concurrency {args.concurrency}")
+    results = asyncio.run(run_benchmark(ctx, scenarios, args.requests, args.concurrency, args.seed, args.warmup))
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "database": SQLALCHEMY_DATABASE_URL.split("://")[0],
+            "python": platform.python_version(),
+            "users": len(ctx["users"]), "days": args.days, "seed": args.seed,
+            "requests_per_scenario": args.requests, "concurrency": args.concurrency
+        },
+        "scenarios": results,
+        "routes_not_covered": uncovered_routes(results) if not args.routes else None
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[Benchmark] Report written to {args.output}")
+    if report["routes_not_covered"]:
+        print(f"[Benchmark] Routes without a scenario: {', '.join(report['routes_not_covered'])}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_reports(json.load(f), report, args.threshold)
+        if regressions:
+            print(f"[Benchmark] Regressions: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
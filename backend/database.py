@@ -1,7 +1,12 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 import os
+import threading
+import time
 
 # Get DATABASE_URL from environment variable, fallback to local SQLite for dev
 # This is key for the "Smart MVP" strategy: One code, two environments.
@@ -11,12 +16,122 @@ SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./water_tracker.d
 if SQLALCHEMY_DATABASE_URL.startswith("postgres://"):
     SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+IS_SQLITE_MEMORY = IS_SQLITE and (":memory:" in SQLALCHEMY_DATABASE_URL or SQLALCHEMY_DATABASE_URL.rstrip("/") == "sqlite:")
+
+def _env_flag(name: str, default: str):
+    return os.getenv(name, default).lower() not in ("0", "false", "no")
+
+# Pool settings (Postgres). Defaults suit a single small web instance; with
+# Supabase's PgBouncer in transaction mode set DB_PGBOUNCER=1 so no server-side
+# prepared statements are kept on a connection that PgBouncer may hand to another client.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = _env_flag("DB_POOL_PRE_PING", "1")
+DB_PGBOUNCER = _env_flag("DB_PGBOUNCER", "0")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# --- POOL METRICS ---
+class PoolMetrics:
+    """Checkout wait times and timeouts for one pool (cumulative buckets, seconds)."""
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float("inf"))
+
+    def __init__(self):
+        self.counts = [0] * len(self.BUCKETS)
+        self.checkouts = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.wait_sum += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    self.counts[i] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds": {
+                    "buckets": {("+Inf" if b == float("inf") else str(b)): c for b, c in zip(self.BUCKETS, self.counts)},
+                    "sum": round(self.wait_sum, 6),
+                    "max": round(self.wait_max, 6)
+                }
+            }
+
+class _TimedPoolMixin:
+    """Times how long a checkout waits for a free connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.observe(time.perf_counter() - start, timed_out=True)
+            raise
+        self.metrics.observe(time.perf_counter() - start)
+        return conn
+
+    def recreate(self):
+        new_pool = super().recreate()
+        new_pool.metrics = self.metrics
+        return new_pool
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    metrics = None
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    metrics = None
+
+def _pool_kwargs(poolclass):
+    """Engine kwargs for the pool; in-memory SQLite keeps SQLAlchemy's single-connection pool."""
+    if IS_SQLITE_MEMORY:
+        return {}
+    kwargs = {"poolclass": poolclass, "pool_pre_ping": DB_POOL_PRE_PING}
+    if not IS_SQLITE:
+        kwargs.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE
+        )
+    return kwargs
+
+def _attach_pool_metrics(engine):
+    if isinstance(engine.pool, _TimedPoolMixin):
+        engine.pool.metrics = PoolMetrics()
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the single writer; busy_timeout makes a second
+    # writer wait instead of failing with "database is locked".
+    cursor = dbapi_connection.cursor()
+    if not IS_SQLITE_MEMORY:
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
 # Connection arguments (check_same_thread is needed only for SQLite)
-connect_args = {"check_same_thread": False} if "sqlite" in SQLALCHEMY_DATABASE_URL else {}
+connect_args = {"check_same_thread": False} if IS_SQLITE else {}
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args=connect_args
+    SQLALCHEMY_DATABASE_URL, connect_args=connect_args, **_pool_kwargs(TimedQueuePool)
 )
+_attach_pool_metrics(engine)
+if IS_SQLITE:
+    event.listen(engine, "connect", _set_sqlite_pragmas)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -29,3 +144,91 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# --- ASYNC ENGINE (optional) ---
+# With an async driver installed (asyncpg for Postgres, aiosqlite for local SQLite)
+# the hot endpoints run their ORM work on the event loop instead of holding one of
+# the threadpool's limited slots. Set DB_ASYNC=0 to force the sync path.
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+async_engine = None
+AsyncSessionLocal = None
+
+def _create_async_engine():
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    url = make_url(SQLALCHEMY_DATABASE_URL)
+    drivername = ASYNC_DRIVERS.get(url.get_backend_name())
+    if not drivername:
+        return None, None
+
+    async_connect_args = dict(connect_args)
+    url = url.set(drivername=drivername)
+    if "sslmode" in url.query:
+        # asyncpg takes 'ssl' instead of libpq's 'sslmode'
+        async_connect_args["ssl"] = url.query["sslmode"]
+        url = url.difference_update_query(["sslmode"])
+
+    if DB_PGBOUNCER and drivername == "postgresql+asyncpg":
+        # Transaction-mode PgBouncer: no asyncpg statement cache, no SQLAlchemy prepared statement cache
+        async_connect_args["statement_cache_size"] = 0
+        url = url.update_query_dict({"prepared_statement_cache_size": "0"})
+
+    async_engine = create_async_engine(url, connect_args=async_connect_args, **_pool_kwargs(TimedAsyncQueuePool))
+    _attach_pool_metrics(async_engine)
+    if IS_SQLITE:
+        event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    return async_engine, async_sessionmaker(async_engine, autocommit=False, autoflush=False)
+
+if os.getenv("DB_ASYNC", "1").lower() not in ("0", "false", "no"):
+    try:
+        async_engine, AsyncSessionLocal = _create_async_engine()
+    except ImportError:
+        # Driver not installed - endpoints fall back to the threadpool
+        async_engine, AsyncSessionLocal = None, None
+
+async def run_db(fn, *args, **kwargs):
+    """Run sync ORM code `fn(db, *args, **kwargs)` from an async endpoint.
+
+    With the async engine, `fn` runs inside AsyncSession.run_sync: the same ORM
+    code, but every round trip is awaited on the async driver. Without it, `fn`
+    gets a regular session in the threadpool (what sync endpoints do).
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as session:
+            return await session.run_sync(fn, *args, **kwargs)
+
+    from starlette.concurrency import run_in_threadpool
+
+    def call():
+        db = SessionLocal()
+        try:
+            return fn(db, *args, **kwargs)
+        finally:
+            db.close()
+
+    return await run_in_threadpool(call)
+
+def pool_stats():
+    """Size, usage and checkout wait metrics for the sync and async pools."""
+    stats = {}
+    for name, eng in (("sync", engine), ("async", async_engine)):
+        if eng is None:
+            continue
+        pool = eng.pool
+        entry = {"pool_class": type(pool).__name__}
+        if isinstance(pool, QueuePool):
+            capacity = pool.size() + max(pool._max_overflow, 0)
+            entry.update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                checked_in=pool.checkedin(),
+                overflow=pool.overflow(),
+                capacity=capacity,
+                saturation=round(pool.checkedout() / capacity, 4) if capacity else None
+            )
+        if getattr(pool, "metrics", None) is not None:
+            entry.update(pool.metrics.snapshot())
+        stats[name] = entry
+    return stats
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+
+# Pub/sub for leaderboard change notifications.
+# Writers publish small messages ({"user_id": ...} or {"challenge_id": ...}) from any
+# thread; every subscribed worker gets them as callbacks on its event loop.
+# - InProcessBroker: a single worker process (default).
+# - RedisBroker (LEADERBOARD_BROKER_URL=redis://...): relays through Redis pub/sub so
+#   every worker sees every write. Needs the optional `redis` package. publish() only
+#   queues the message; a redis.asyncio task on the serving loop sends it, so a slow or
+#   unreachable Redis never stalls the request (or the event loop) that wrote.
+BROKER_TIMEOUT = float(os.getenv("LEADERBOARD_BROKER_TIMEOUT", "1"))  # Redis socket timeouts (seconds)
+BROKER_OUTBOX_SIZE = 1000  # Unsent messages kept while Redis is slow; the oldest are dropped
+
+class InProcessBroker:
+    def __init__(self):
+        self._handlers = []  # (loop, callback)
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, callback, loop=None):
+        """Call `callback(message)` on `loop` (default: the running loop) for every message.
+
+        Returns an unsubscribe function.
+        """
+        loop = loop or asyncio.get_running_loop()
+        handler = (loop, callback)
+        with self._lock:
+            self._handlers.append(handler)
+
+        def unsubscribe():
+            with self._lock:
+                if handler in self._handlers:
+                    self._handlers.remove(handler)
+        return unsubscribe
+
+    def publish(self, message: dict):
+        """Thread-safe; a no-op while nobody is subscribed."""
+        self._deliver(message)
+
+    def _deliver(self, message: dict):
+        with self._lock:
+            self.published += 1
+            handlers = list(self._handlers)
+        for loop, callback in handlers:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(callback, message)
+
+class RedisBroker(InProcessBroker):
+    CHANNEL = "smartsip:leaderboard"
+
+    def __init__(self, url: str):
+        import redis  # Optional dependency, only needed for multi-worker deployments
+
+        super().__init__()
+        self.url = url
+        self._redis = None  # Sync client, only for publishers without an event loop (scripts)
+        self._listeners = {}  # loop -> listener task
+        self._outbox = deque(maxlen=BROKER_OUTBOX_SIZE)  # JSON messages not yet sent
+        self._publisher_loop = None
+        self._wakeup = None  # Set to make the publisher task drain the outbox
+        self.publish_failures = 0
+
+    def subscribe(self, callback, loop=None):
+        loop = loop or asyncio.get_running_loop()
+        unsubscribe = super().subscribe(callback, loop)
+        if loop not in self._listeners:
+            self._listeners[loop] = loop.create_task(self._listen())
+        if self._publisher_loop is None or self._publisher_loop.is_closed():
+            self._start_publisher(loop)
+        return unsubscribe
+
+    def publish(self, message: dict):
+        """Thread-safe; queues the message for the publisher task on the serving loop.
+
+        Only a process that has no event loop yet (maintenance scripts) sends inline.
+        """
+        self._outbox.append(json.dumps(message))
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        loop = self._publisher_loop
+        if loop is None or loop.is_closed():
+            if running is None:
+                self._publish_pending()
+                return
+            loop = self._start_publisher(running)
+        if loop is running:
+            self._wakeup.set()
+        else:
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _start_publisher(self, loop):
+        self._publisher_loop = loop
+        self._wakeup = asyncio.Event()
+        loop.create_task(self._publisher())
+        return loop
+
+    async def _publisher(self):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(
+            self.url, socket_timeout=BROKER_TIMEOUT, socket_connect_timeout=BROKER_TIMEOUT
+        )
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._outbox:
+                try:
+                    data = self._outbox.popleft()
+                except IndexError:
+                    break  # Drained by another publisher
+                try:
+                    await client.publish(self.CHANNEL, data)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # A broker outage must not fail writes; viewers fall back to the cache TTL
+                    self.publish_failures += 1
+                    print(f"[Leaderboard] Redis publish failed: {e}")
+
+    def _publish_pending(self):
+        """No event loop in this process (maintenance scripts): send synchronously, with timeouts."""
+        import redis
+
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(
+                self.url, socket_timeout=BROKER_TIMEOUT, socket_connect_timeout=BROKER_TIMEOUT
+            )
+        while self._outbox:
+            try:
+                data = self._outbox.popleft()
+            except IndexError:
+                break
+            try:
+                self._redis.publish(self.CHANNEL, data)
+            except Exception as e:
+                self.publish_failures += 1
+                print(f"[Leaderboard] Redis publish failed: {e}")
+
+    async def _listen(self):
+        import redis.asyncio
+
+        while True:
+            try:
+                client = redis.asyncio.Redis.from_url(self.url, socket_connect_timeout=BROKER_TIMEOUT)
+                pubsub = client.pubsub()
+                await pubsub.subscribe(self.CHANNEL)
+                async for item in pubsub.listen():
+                    if item["type"] == "message":
+                        self._deliver(json.loads(item["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[Leaderboard] Redis subscription lost, retrying: {e}")
+                await asyncio.sleep(1)
+
+def create_broker():
+    url = os.getenv("LEADERBOARD_BROKER_URL")
+    if url:
+        try:
+            return RedisBroker(url)
+        except ImportError:
+            print("[Leaderboard] LEADERBOARD_BROKER_URL is set but `redis` is not installed - using the in-process broker")
+    return InProcessBroker()
@@ -0,0 +1,248 @@
+import asyncio
+import os
+import threading
+import time
+
+import httpx
+from groq import AsyncGroq
+
+# Process-wide Groq client for the AI coach.
+# - One AsyncGroq/httpx client per process, so connections (and TLS) are kept alive between requests.
+# - Timeouts, retries and a concurrency cap bound how much a slow upstream can pile up.
+# - A circuit breaker fails fast while Groq is down so callers can serve a fallback instantly.
+# - Call latency is recorded in a histogram.
+LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.1-8b-instant")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "10"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "3"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "2"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+# LLM_FAKE=1 swaps Groq for a local token generator (no network), e.g. to measure
+# time-to-first-token in tests. LLM_FAKE_DELAY is the pause before each token and
+# LLM_FAKE_FAIL=1 makes every call fail (to exercise the breaker).
+FAKE_AI_MESSAGE = "💧 Nice steady progress! Keep a glass nearby and sip every hour to reach your goal. 🚰"
+
+class LLMUnavailableError(Exception):
+    """Raised without calling upstream: breaker open or concurrency limit saturated."""
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; after `cooldown` seconds lets one trial call through."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_abandoned(self):
+        """The caller gave up before an outcome: free the trial slot without changing the counts."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self.failures >= self.threshold:
+                if self.state != "open":
+                    self.trips += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def snapshot(self):
+        return {"state": self.state, "consecutive_failures": self.failures, "trips": self.trips}
+
+class LatencyHistogram:
+    """Cumulative latency buckets (seconds), Prometheus-style."""
+
+    BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+    def __init__(self):
+        self.counts = [0] * len(self.BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.count += 1
+            self.sum += seconds
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    self.counts[i] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "buckets": {("+Inf" if b == float("inf") else str(b)): c for b, c in zip(self.BUCKETS, self.counts)},
+                "count": self.count,
+                "sum": round(self.sum, 6)
+            }
+
+class LLMClient:
+    def __init__(self):
+        self.breaker = CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN)
+        self.latency = LatencyHistogram()
+        self.in_flight = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        self._client = None
+        self._client_key = None
+        self._client_calls = {}  # client -> calls in flight on it
+        self._retired = set()  # Clients for a previous key, closed once their calls finish
+
+    async def _get_client(self, api_key: str):
+        """Pooled client for `api_key`, counted as in use until _done_with(client)."""
+        retired = None
+        if self._client is None or self._client_key != api_key:
+            retired = self._client
+            self._client = AsyncGroq(
+                api_key=api_key,
+                max_retries=LLM_MAX_RETRIES,
+                http_client=httpx.AsyncClient(
+                    timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+                    limits=httpx.Limits(
+                        max_connections=LLM_MAX_CONCURRENCY,
+                        max_keepalive_connections=LLM_MAX_CONCURRENCY,
+                        keepalive_expiry=60
+                    )
+                )
+            )
+            self._client_key = api_key
+        client = self._client
+        self._client_calls[client] = self._client_calls.get(client, 0) + 1
+        if retired is not None:
+            # Key changed: close the previous client now, or once its in-flight calls finish
+            if self._client_calls.get(retired):
+                self._retired.add(retired)
+            else:
+                await retired.close()
+        return client
+
+    async def _done_with(self, client):
+        self._client_calls[client] -= 1
+        if not self._client_calls[client]:
+            del self._client_calls[client]
+            if client in self._retired:
+                self._retired.discard(client)
+                await client.close()
+
+    async def _acquire(self):
+        if not self.breaker.allow():
+            raise LLMUnavailableError("circuit open")
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), LLM_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            # Not an upstream failure, but a trial slot must not stay claimed
+            self.breaker.record_abandoned()
+            raise LLMUnavailableError("too many concurrent AI requests")
+        self.in_flight += 1
+
+    def _release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    async def complete(self, prompt: str, api_key: str):
+        """Full completion text. Raises LLMUnavailableError without calling upstream when failing fast."""
+        tokens = [token async for token in self.stream(prompt, api_key)]
+        return "".join(tokens).strip()
+
+    async def stream(self, prompt: str, api_key: str):
+        """Yield completion tokens. Closing the generator closes the upstream response.
+
+        A caller that goes away mid-call (cancellation or aclose) records neither a
+        success nor a failure, so impatient clients cannot hold the breaker closed.
+        """
+        await self._acquire()
+        start = time.perf_counter()
+        outcome = "failure"
+        client = None
+        try:
+            if os.getenv("LLM_FAKE") == "1":
+                async for token in self._fake_stream():
+                    yield token
+            else:
+                client = await self._get_client(api_key)
+                stream = await client.chat.completions.create(
+                    model=LLM_MODEL,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.7,
+                    max_tokens=150,
+                    stream=True
+                )
+                try:
+                    async for chunk in stream:
+                        token = chunk.choices[0].delta.content if chunk.choices else None
+                        if token:
+                            yield token
+                finally:
+                    # Stream ended or the caller went away - stop the upstream generation
+                    await stream.response.aclose()
+            outcome = "success"
+        except (asyncio.CancelledError, GeneratorExit):
+            outcome = "abandoned"  # Caller went away; says nothing about the upstream
+            raise
+        finally:
+            if outcome == "abandoned":
+                self.breaker.record_abandoned()
+            else:
+                self.latency.observe(time.perf_counter() - start)
+                if outcome == "success":
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+            self._release()
+            if client is not None:
+                await self._done_with(client)
+
+    async def _fake_stream(self):
+        delay = float(os.getenv("LLM_FAKE_DELAY", "0.02"))
+        if os.getenv("LLM_FAKE_FAIL") == "1":
+            await asyncio.sleep(delay)
+            raise RuntimeError("fake LLM failure")
+        for word in FAKE_AI_MESSAGE.split(" "):
+            await asyncio.sleep(delay)
+            yield word + " "
+
+    def stats(self):
+        return {
+            "breaker": self.breaker.snapshot(),
+            "latency_seconds": self.latency.snapshot(),
+            "in_flight": self.in_flight,
+            "max_concurrency": LLM_MAX_CONCURRENCY,
+            "rejected": self.rejected
+        }
+
+    async def aclose(self):
+        for client in [self._client, *self._retired]:
+            if client is not None:
+                await client.close()
+        self._client = None
+        self._retired.clear()
+
+llm_client = LLMClient()
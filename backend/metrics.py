@@ -0,0 +1,221 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event
+
+# Per-route request metrics with SQL statement accounting.
+# - MetricsMiddleware (pure ASGI, so streaming responses are untouched) times each
+#   request and labels it with the route template, not the raw path.
+# - SQLAlchemy cursor hooks add every statement's duration to the request that issued it
+#   (a context variable, which follows the request into the threadpool and run_sync).
+# - Requests slower than SLOW_REQUEST_MS are logged with their statement list.
+# - render_prometheus() produces the text exposition served at /metrics.
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+SLOW_REQUEST_LOG_SIZE = 50
+MAX_STATEMENTS_KEPT = 200  # Per request, for the slow log; counting continues past it
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float("inf"))
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, float("inf"))
+
+_current = contextvars.ContextVar("smartsip_request_stats", default=None)
+
+class RequestStats:
+    __slots__ = ("statements", "statement_count", "db_seconds")
+
+    def __init__(self):
+        self.statements = []
+        self.statement_count = 0
+        self.db_seconds = 0.0
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+class _RouteMetrics:
+    def __init__(self):
+        self.status = {}  # status code -> count
+        self.latency = _Histogram(LATENCY_BUCKETS)
+        self.statements = _Histogram(STATEMENT_BUCKETS)
+        self.db_seconds = 0.0
+
+_lock = threading.Lock()
+_routes = {}  # (method, route) -> _RouteMetrics
+slow_requests = deque(maxlen=SLOW_REQUEST_LOG_SIZE)
+
+# --- SQL HOOKS ---
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("smartsip_query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["smartsip_query_start"].pop()
+    stats = _current.get()
+    if stats is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats.statement_count += 1
+    stats.db_seconds += elapsed
+    if len(stats.statements) < MAX_STATEMENTS_KEPT:
+        stats.statements.append((statement, elapsed))
+
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute
+    if context.connection is not None:
+        stack = context.connection.info.get("smartsip_query_start")
+        if stack:
+            stack.pop()
+
+def install_sql_hooks(*engines):
+    """Attach statement timing to sync engines (pass AsyncEngine.sync_engine for async ones)."""
+    for engine in engines:
+        if engine is None or event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+            continue
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+# --- MIDDLEWARE ---
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self._route_paths = None
+
+    def _route_label(self, scope):
+        if self._route_paths is None:
+            # Built lazily: every route is registered by the time requests arrive
+            self._route_paths = {
+                getattr(route, "endpoint", None): route.path
+                for route in scope["app"].routes if hasattr(route, "path")
+            }
+        return self._route_paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        response = {"status": 500, "streaming": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                content_type = dict(message.get("headers", [])).get(b"content-type", b"")
+                response["streaming"] = content_type.startswith(b"text/event-stream")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            self._record(scope, response, stats, time.perf_counter() - started)
+
+    def _record(self, scope, response, stats, elapsed):
+        method, route = scope["method"], self._route_label(scope)
+        with _lock:
+            metrics = _routes.setdefault((method, route), _RouteMetrics())
+            metrics.status[response["status"]] = metrics.status.get(response["status"], 0) + 1
+            metrics.statements.observe(stats.statement_count)
+            metrics.db_seconds += stats.db_seconds
+            if response["streaming"]:
+                return  # A stream's lifetime is not request latency
+            metrics.latency.observe(elapsed)
+
+        if elapsed * 1000 >= SLOW_REQUEST_MS:
+            entry = {
+                "method": method,
+                "route": route,  # The template only: raw paths carry user ids
+                "status": response["status"],
+                "duration_ms": round(elapsed * 1000, 1),
+                "db_ms": round(stats.db_seconds * 1000, 1),
+                "statement_count": stats.statement_count,
+                "statements": [
+                    {"sql": " ".join(sql.split())[:300], "ms": round(seconds * 1000, 2)}
+                    for sql, seconds in stats.statements
+                ]
+            }
+            slow_requests.append(entry)
+            print(f"[SlowRequest] {json.dumps(entry)}")
+
+# --- PROMETHEUS TEXT ---
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(**labels):
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+def _bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+def _histogram_lines(name, histogram, **labels):
+    lines = []
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        lines.append(f"{name}_bucket{_labels(**labels, le=_bound(bound))} {count}")
+    lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum}")
+    lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+    return lines
+
+def render_prometheus(gauges=None, counters=None):
+    """Prometheus text format.
+
+    `gauges` and `counters` map metric name -> value or {labels tuple: value};
+    counters are cumulative since process start (names should end in _total).
+    """
+    with _lock:
+        routes = sorted(_routes.items())
+        requests, latency, statements, db_time = [], [], [], []
+        for (method, route), metrics in routes:
+            for status, count in sorted(metrics.status.items()):
+                requests.append(f"smartsip_http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+            latency += _histogram_lines("smartsip_http_request_duration_seconds", metrics.latency, method=method, route=route)
+            statements += _histogram_lines("smartsip_db_statements_per_request", metrics.statements, method=method, route=route)
+            db_time.append(f"smartsip_db_time_seconds_total{_labels(method=method, route=route)} {metrics.db_seconds}")
+
+    # Each metric family is one contiguous block
+    lines = ["# TYPE smartsip_http_requests_total counter", *requests,
+             "# TYPE smartsip_http_request_duration_seconds histogram", *latency,
+             "# TYPE smartsip_db_statements_per_request histogram", *statements,
+             "# TYPE smartsip_db_time_seconds_total counter", *db_time]
+    families = [(name, "gauge", value) for name, value in (gauges or {}).items()]
+    families += [(name, "counter", value) for name, value in (counters or {}).items()]
+    for name, kind, value in families:
+        lines.append(f"# TYPE {name} {kind}")
+        if isinstance(value, dict):
+            for labels, labelled_value in value.items():
+                lines.append(f"{name}{_labels(**dict(labels))} {labelled_value}")
+        else:
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+def route_summary():
+    """{"METHOD /route": {"requests", "statements", "db_seconds"}} totals since the last reset()."""
+    with _lock:
+        return {
+            f"{method} {route}": {
+                "requests": sum(metrics.status.values()),
+                "statements": int(metrics.statements.sum),
+                "db_seconds": metrics.db_seconds
+            }
+            for (method, route), metrics in _routes.items()
+        }
+
+def reset():
+    """Clear all recorded metrics (tests)."""
+    with _lock:
+        _routes.clear()
+    slow_requests.clear()
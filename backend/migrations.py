@@ -0,0 +1,132 @@
+import time
+import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+
+from database import engine
+import models
+
+# Versioned schema migrations.
+# Startup reads MAX(version) from schema_version once and applies only the pending
+# steps, each recorded in its own transaction. Steps must be idempotent: an existing
+# deployment without schema_version starts at 0 and replays them against tables
+# that may already be partly migrated.
+#
+# To change the schema: update models.py, then append a step. New tables are
+# created with `models.X.__table__.create(conn, checkfirst=True)`.
+
+def _baseline(conn):
+    """Create every table that does not exist yet."""
+    models.Base.metadata.create_all(bind=conn)
+
+def _legacy_columns(conn):
+    """Columns added after the first release (were ALTERed on every boot)."""
+    existing = {
+        table: {column["name"] for column in inspect(conn).get_columns(table)}
+        for table in ("users", "water_intake")
+    }
+    columns = [
+        ("users", "default_goal", "INTEGER DEFAULT 2500"),
+        ("water_intake", "local_date", "VARCHAR(10)"),
+        ("users", "default_drink_amount", "INTEGER DEFAULT 200"),
+    ]
+    for table, column, ddl in columns:
+        if column not in existing[table]:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+            print(f"[Migration] Added {column} column to {table} table")
+
+def _composite_indexes(conn):
+    """Composite indexes for per-user date lookups; one snapshot per (user, date)."""
+    # Older deployments could race into duplicate snapshots - keep the newest
+    removed = conn.execute(text(
+        "DELETE FROM daily_snapshots WHERE id NOT IN "
+        "(SELECT MAX(id) FROM daily_snapshots GROUP BY user_id, date)"
+    )).rowcount
+    if removed:
+        print(f"[Migration] Removed {removed} duplicate daily snapshots")
+    # (user_id, local_date) is the prefix of the covering index
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_water_intake_user_local_date ON water_intake (user_id, local_date, intake_ml)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_water_intake_user_timestamp ON water_intake (user_id, timestamp)"))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_daily_snapshots_user_date ON daily_snapshots (user_id, date)"))
+
+def _user_data_version(conn):
+    """users.data_version for ETags on /history and /stats."""
+    columns = {column["name"] for column in inspect(conn).get_columns("users")}
+    if "data_version" not in columns:
+        conn.execute(text("ALTER TABLE users ADD COLUMN data_version INTEGER DEFAULT 0"))
+
+def _idempotency_keys(conn):
+    """water_intake.idempotency_key for /log/batch replays."""
+    columns = {column["name"] for column in inspect(conn).get_columns("water_intake")}
+    if "idempotency_key" not in columns:
+        conn.execute(text("ALTER TABLE water_intake ADD COLUMN idempotency_key VARCHAR"))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_water_intake_user_idempotency ON water_intake (user_id, idempotency_key)"))
+
+def _history_keyset_index(conn):
+    """Index for the keyset-paginated /users/{id}/logs history."""
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_water_intake_user_id_id ON water_intake (user_id, id)"))
+
+def _goal_timeline(conn):
+    """goal_changes, filled with every user's change points from their snapshots."""
+    models.GoalChange.__table__.create(conn, checkfirst=True)
+    conn.execute(text("DELETE FROM goal_changes"))
+    inserted = conn.execute(text(
+        "INSERT INTO goal_changes (user_id, effective_date, goal) "
+        "SELECT user_id, date, goal_for_day FROM ("
+        "  SELECT user_id, date, goal_for_day,"
+        "         LAG(goal_for_day) OVER (PARTITION BY user_id ORDER BY date) AS previous_goal"
+        "  FROM daily_snapshots WHERE goal_for_day IS NOT NULL"
+        ") snapshots WHERE previous_goal IS NULL OR previous_goal <> goal_for_day"
+    )).rowcount
+    if inserted:
+        print(f"[Migration] Derived {inserted} goal change points from daily snapshots")
+
+def _user_tz_offset(conn):
+    """users.tz_offset_minutes: timezone buckets for the day rollover job."""
+    columns = {column["name"] for column in inspect(conn).get_columns("users")}
+    if "tz_offset_minutes" not in columns:
+        conn.execute(text("ALTER TABLE users ADD COLUMN tz_offset_minutes INTEGER"))
+
+MIGRATIONS = [
+    (1, "baseline schema", _baseline),
+    (2, "legacy columns", _legacy_columns),
+    (3, "composite indexes", _composite_indexes),
+    (4, "users.data_version", _user_data_version),
+    (5, "water_intake.idempotency_key", _idempotency_keys),
+    (6, "water_intake history index", _history_keyset_index),
+    (7, "goal_changes timeline", _goal_timeline),
+    (8, "users.tz_offset_minutes", _user_tz_offset),
+]
+
+def current_version(conn):
+    try:
+        return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    except DBAPIError:
+        # First run on this database
+        conn.rollback()
+        models.SchemaVersion.__table__.create(bind=conn, checkfirst=True)
+        conn.commit()
+        return 0
+
+def run_migrations(bind=None):
+    """Apply pending migration steps. Returns the schema version afterwards."""
+    started = time.perf_counter()
+    with (bind or engine).connect() as conn:
+        version = current_version(conn)
+        conn.commit()
+        for step_version, name, step in MIGRATIONS:
+            if step_version <= version:
+                continue
+            step(conn)
+            conn.execute(models.SchemaVersion.__table__.insert().values(
+                version=step_version, name=name, applied_at=datetime.datetime.utcnow()
+            ))
+            conn.commit()
+            version = step_version
+            print(f"[Migration] Applied {step_version}: {name}")
+    print(f"[Migration] Schema at version {version} ({(time.perf_counter() - started) * 1000:.1f} ms)")
+    return version
+
+if __name__ == "__main__":
+    run_migrations()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Date
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Date, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
@@ -15,6 +15,8 @@ class User(Base):
     is_guest = Column(Boolean, default=True)
     default_goal = Column(Integer, default=2500)  # Cloud-synced daily goal
     default_drink_amount = Column(Integer, default=200)  # Cloud-synced glass size
+    data_version = Column(Integer, default=0)  # Bumped on every data write; feeds the ETag of read endpoints
+    tz_offset_minutes = Column(Integer, nullable=True)  # Client's UTC offset (minutes east) from /log; the rollover bucket
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
     # Relationships
@@ -23,6 +25,16 @@ class User(Base):
 
 class WaterIntake(Base):
     __tablename__ = "water_intake"
+    __table_args__ = (
+        # Covering index for per-day grouping: (user, day) lookups never touch the table
+        Index("ix_water_intake_user_local_date", "user_id", "local_date", "intake_ml"),
+        # Legacy rows (no local_date) and range scans by time
+        Index("ix_water_intake_user_timestamp", "user_id", "timestamp"),
+        # Keyset pagination of a user's full history (newest id first)
+        Index("ix_water_intake_user_id_id", "user_id", "id"),
+        # Client-generated key per queued entry: replays of the same entry are no-ops
+        Index("uq_water_intake_user_idempotency", "user_id", "idempotency_key", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(String, ForeignKey("users.id")) # FK to User UUID
@@ -30,11 +42,13 @@ class WaterIntake(Base):
     drink_type = Column(String, default="Water")
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
     local_date = Column(String, index=True)  # Store user's local date for timezone-safe grouping
+    idempotency_key = Column(String, nullable=True)  # Set by /log/batch replays (NULLs never conflict)
 
     user = relationship("User", back_populates="logs")
 
 class DailySnapshot(Base):
     __tablename__ = "daily_snapshots"
+    __table_args__ = (Index("uq_daily_snapshots_user_date", "user_id", "date", unique=True),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(String, ForeignKey("users.id")) # FK to User UUID
@@ -46,6 +60,59 @@ class DailySnapshot(Base):
 
     user = relationship("User", back_populates="snapshots")
 
+class DailyTotal(Base):
+    """Running per-(user, local date) intake aggregate.
+
+    Maintained in the same transaction as every WaterIntake insert/delete so the
+    /log write path reads one row instead of re-summing the day.
+    """
+    __tablename__ = "daily_totals"
+    __table_args__ = (UniqueConstraint("user_id", "date", name="uq_daily_totals_user_date"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(String, ForeignKey("users.id"))
+    date = Column(String)  # YYYY-MM-DD (local_date, or timestamp date for legacy rows)
+    total_intake = Column(Integer, default=0)
+    log_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class StreakState(Base):
+    """Incrementally maintained streak for a user.
+
+    Tracks the latest run of consecutive goal_met days so streak reads are a
+    single-row lookup instead of a scan over a year of snapshots.
+    """
+    __tablename__ = "streak_states"
+
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    current_length = Column(Integer, default=0)  # Length of the latest run
+    start_date = Column(String, nullable=True)  # First day of the latest run (YYYY-MM-DD)
+    end_date = Column(String, nullable=True)  # Last goal_met day overall (end of the latest run)
+    best_streak = Column(Integer, default=0)
+    best_start_date = Column(String, nullable=True)
+    last_evaluated_date = Column(String, nullable=True)  # Latest snapshot date folded into the state
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class GoalChange(Base):
+    """Goal timeline: the dates on which a user's carried-forward snapshot goal changes.
+
+    Derived from daily_snapshots (a day's goal is that of the latest change point on
+    or before it), so goal lookups are a bisect over a few rows instead of a query.
+    """
+    __tablename__ = "goal_changes"
+
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    effective_date = Column(String, primary_key=True)  # YYYY-MM-DD
+    goal = Column(Integer)
+
+class BackfillWatermark(Base):
+    """Per-user progress marker for the snapshot backfill job."""
+    __tablename__ = "backfill_watermarks"
+
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    backfilled_through = Column(String)  # YYYY-MM-DD, last day already covered by the backfill
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
 # --- SOCIAL CHALLENGES ---
 
 class Challenge(Base):
@@ -77,3 +144,11 @@ class ChallengeParticipant(Base):
     # Relationships
     challenge = relationship("Challenge", back_populates="participants")
     user = relationship("User", backref="challenge_memberships")
+
+class SchemaVersion(Base):
+    """One row per applied migration step (see migrations.py)."""
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True)
+    name = Column(String)
+    applied_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -1,5 +1,7 @@
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from database import SessionLocal
+from backend import db_rebuild_streak_state, db_sync_goal_timeline
 import models
 import sys
 
@@ -12,6 +14,7 @@ def cleanup_corrupted_goals(db: Session, dry_run: bool = True):
     
     corrupted_count = 0
     fixed_count = 0
+    fixed_users = set()
     
     for snap in snapshots:
         original_goal = snap.goal_for_day
@@ -52,8 +55,22 @@ def cleanup_corrupted_goals(db: Session, dry_run: bool = True):
                 # Re-evaluate goal_met
                 snap.goal_met = snap.total_intake >= new_goal
                 fixed_count += 1
+                fixed_users.add(snap.user_id)
 
     if not dry_run:
+        # goal_met may have flipped - rebuild the affected streak states
+        if fixed_users:
+            db.flush()
+            for user_id in fixed_users:
+                db_rebuild_streak_state(db, user_id)
+            # Snapshot goals changed - rederive the goal timelines and invalidate the
+            # users' cached /stats and /history (ETags)
+            for user_id in fixed_users:
+                db_sync_goal_timeline(db, user_id)
+            db.query(models.User).filter(models.User.id.in_(fixed_users)).update(
+                {models.User.data_version: func.coalesce(models.User.data_version, 0) + 1},
+                synchronize_session=False
+            )
         db.commit()
         print(f"Successfully fixed {fixed_count} corrupted records.")
     else:
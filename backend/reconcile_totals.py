@@ -0,0 +1,30 @@
+from database import SessionLocal
+from backend import db_reconcile_daily_totals
+import sys
+
+def reconcile(dry_run: bool = True, user_id: str = None):
+    print(f"--- Daily Total Reconciliation ({'DRY RUN' if dry_run else 'LIVE'}) ---")
+    
+    db = SessionLocal()
+    try:
+        mismatches = db_reconcile_daily_totals(db, user_id=user_id, fix=not dry_run)
+    finally:
+        db.close()
+    
+    for m in mismatches:
+        print(f"  [DRIFT] User {m['user_id']} on {m['date']}: "
+              f"{m['aggregate_total']}ml/{m['aggregate_count']} logs -> {m['actual_total']}ml/{m['actual_count']} logs")
+    
+    if not mismatches:
+        print("All daily totals match the raw logs.")
+    elif dry_run:
+        print(f"Found {len(mismatches)} drifted aggregates. Run with --live to fix.")
+    else:
+        print(f"Successfully fixed {len(mismatches)} drifted aggregates.")
+    return mismatches
+
+if __name__ == "__main__":
+    # Usage: python reconcile_totals.py [--live] [--user USER_ID]
+    args = sys.argv[1:]
+    user = args[args.index("--user") + 1] if "--user" in args else None
+    reconcile(dry_run="--live" not in args, user_id=user)
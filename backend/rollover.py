@@ -0,0 +1,34 @@
+from database import SessionLocal
+from backend import db_rollover, ROLLOVER_CATCH_UP_DAYS
+import sys
+import time
+
+def run_rollover(catch_up_days: int = ROLLOVER_CATCH_UP_DAYS):
+    """Lock the previous local day(s) for every active user, one timezone bucket at a time."""
+    db = SessionLocal()
+    try:
+        results = db_rollover(db, catch_up_days=catch_up_days)
+    finally:
+        db.close()
+    
+    for tz_offset, result in sorted(results.items(), key=lambda item: (item[0] is not None, item[0] or 0)):
+        if result["locked"]:
+            bucket = "server time" if tz_offset is None else f"UTC{tz_offset / 60:+g}h"
+            print(f"  [{bucket}] {result['locked']} snapshots locked through {result['through']}")
+    locked = sum(result["locked"] for result in results.values())
+    print(f"[Rollover] {len(results)} timezone buckets checked, {locked} snapshots locked")
+    return locked
+
+if __name__ == "__main__":
+    # Usage: python rollover.py [--catch-up DAYS] [--loop SECONDS]
+    # Run it every 15-30 minutes (cron or --loop) so each timezone bucket is locked
+    # shortly after its own midnight; runs that find nothing to lock are no-ops.
+    # --catch-up covers several previous days, e.g. after the job was down.
+    args = sys.argv[1:]
+    catch_up = int(args[args.index("--catch-up") + 1]) if "--catch-up" in args else ROLLOVER_CATCH_UP_DAYS
+    interval = int(args[args.index("--loop") + 1]) if "--loop" in args else None
+    
+    run_rollover(catch_up)
+    while interval:
+        time.sleep(interval)
+        run_rollover(catch_up)
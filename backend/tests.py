@@ -1,27 +1,59 @@
 import unittest
+import asyncio
+import importlib.util
+import json
+import random
+import tempfile
+import time
 import os
 import sys
 from datetime import datetime, timedelta
+from sqlalchemy import event
 
 # Add parent dir to path to import backend modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database import SessionLocal, engine
+import database
+from database import SessionLocal, engine, pool_stats, run_db
 import models
-from backend import db_get_snapshot_goal, db_create_or_update_snapshot, db_log_intake
+from ai_cache import FeedbackCache
+from migrations import run_migrations, MIGRATIONS
+from llm_client import LLMClient, CircuitBreaker, LLMUnavailableError
+import metrics
+import benchmark
+import backend
+from backend import (
+    db_get_snapshot_goal, db_create_or_update_snapshot, db_log_intake,
+    db_delete_log, db_get_daily_total, db_get_date_total, db_reconcile_daily_totals,
+    db_backfill_snapshots, db_get_current_streak, db_get_streak_from_snapshots, db_rebuild_streak_state,
+    get_challenge_standings, invalidate_user_standings, invalidate_challenge_standings, ai_feedback_events, app,
+    get_ai_feedback, llm_client, leaderboard_hub, ensure_user, known_users,
+    goal_timelines, db_resolve_goals, db_rollover, db_get_stats, db_get_daily_totals
+)
 
 # Use in-memory SQLite for testing if possible, or a test file
 # database.py uses 'smartsip.db' by default. 
 # We'll use a specific test user ID to avoid messing with real data.
 TEST_USER_ID = "unit-test-user-v1"
 
+# Tables holding per-user rows, dependents first
+USER_TABLES = (models.WaterIntake, models.DailySnapshot, models.DailyTotal, models.StreakState,
+               models.GoalChange, models.BackfillWatermark)
+
+def purge_users(db, *user_ids):
+    """Delete the users and every per-user row, and drop them from the in-process caches. Commits."""
+    for model in USER_TABLES:
+        db.query(model).filter(model.user_id.in_(user_ids)).delete(synchronize_session=False)
+    db.query(models.User).filter(models.User.id.in_(user_ids)).delete(synchronize_session=False)
+    db.commit()
+    for user_id in user_ids:
+        known_users.discard(user_id)
+        goal_timelines.invalidate(user_id)
+
 class TestGoalLogic(unittest.TestCase):
     def setUp(self):
         self.db = SessionLocal()
-        # Clean up test user data
-        self.db.query(models.DailySnapshot).filter(models.DailySnapshot.user_id == TEST_USER_ID).delete()
-        self.db.query(models.WaterIntake).filter(models.WaterIntake.user_id == TEST_USER_ID).delete()
-        self.db.commit()
+        purge_users(self.db, TEST_USER_ID)
 
     def tearDown(self):
         self.db.close()
@@ -99,5 +131,1085 @@ class TestGoalLogic(unittest.TestCase):
         # Check Day 2 (Implicit 3500 now, because it looks back to Day 1)
         self.assertEqual(db_get_snapshot_goal(self.db, TEST_USER_ID, day2), 3500)
 
+class TestEnsureUser(unittest.TestCase):
+    USER_ID = "unit-test-user-ensure"
+
+    def setUp(self):
+        self.db = SessionLocal()
+        purge_users(self.db, self.USER_ID)
+        self.statements = []
+        self._listener = lambda *args: self.statements.append(args[2])
+        event.listen(engine, "before_cursor_execute", self._listener)
+
+    def tearDown(self):
+        event.remove(engine, "before_cursor_execute", self._listener)
+        self.db.close()
+
+    def test_known_users_skip_the_user_table(self):
+        """One insert per new user; once committed, later requests issue no statement for it"""
+        self.assertTrue(ensure_user(self.db, self.USER_ID))
+        self.assertFalse(ensure_user(self.db, self.USER_ID))
+        self.assertEqual(len(self.statements), 1)
+        self.assertNotIn(self.USER_ID, known_users)  # Not before the commit
+        self.db.commit()
+        self.assertIn(self.USER_ID, known_users)
+
+        other = SessionLocal()
+        try:
+            self.statements.clear()
+            self.assertFalse(ensure_user(other, self.USER_ID))
+            self.assertEqual(self.statements, [])
+        finally:
+            other.close()
+
+    def test_rolled_back_insert_is_not_cached(self):
+        """A user created in a rolled-back transaction is inserted again next time"""
+        ensure_user(self.db, self.USER_ID)
+        self.db.rollback()
+        self.assertNotIn(self.USER_ID, known_users)
+        self.assertTrue(ensure_user(self.db, self.USER_ID))
+        self.db.commit()
+        self.assertEqual(self.db.query(models.User).filter(models.User.id == self.USER_ID).count(), 1)
+
+class TestGoalTimeline(unittest.TestCase):
+    USER_ID = "unit-test-user-goal-timeline"
+
+    def setUp(self):
+        self.db = SessionLocal()
+        purge_users(self.db, self.USER_ID)
+
+    def tearDown(self):
+        self.db.close()
+
+    def change_points(self):
+        return self.db.query(models.GoalChange.effective_date, models.GoalChange.goal).filter(
+            models.GoalChange.user_id == self.USER_ID).order_by(models.GoalChange.effective_date).all()
+
+    def test_change_points_follow_snapshot_goals(self):
+        """Only goal changes are stored; lookups carry them forward and see later edits"""
+        for date_str, goal in (("2025-09-01", 2000), ("2025-09-03", 3000), ("2025-09-05", 3000)):
+            db_create_or_update_snapshot(self.db, self.USER_ID, date_str, goal)
+        self.assertEqual(self.change_points(), [("2025-09-01", 2000), ("2025-09-03", 3000)])
+
+        dates = ["2025-08-31", "2025-09-01", "2025-09-02", "2025-09-04", "2025-09-30"]
+        expected = {"2025-08-31": 2500, "2025-09-01": 2000, "2025-09-02": 2000, "2025-09-04": 3000, "2025-09-30": 3000}
+        self.assertEqual(db_resolve_goals(self.db, self.USER_ID, dates), expected)
+        self.assertEqual({d: db_get_snapshot_goal(self.db, self.USER_ID, d) for d in dates}, expected)
+
+        # Cached: no query per lookup
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            db_get_snapshot_goal(self.db, self.USER_ID, "2025-09-04")
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+        self.assertEqual(statements, [])
+
+        # /update-goal style edit back to 2000 merges the change points
+        db_create_or_update_snapshot(self.db, self.USER_ID, "2025-09-03", 2000)
+        self.assertEqual(self.change_points(), [("2025-09-01", 2000), ("2025-09-05", 3000)])
+        self.assertEqual(db_get_snapshot_goal(self.db, self.USER_ID, "2025-09-04"), 2000)
+
+    def test_read_racing_a_commit_is_not_cached(self):
+        """A reader that queried before a writer's commit must not cache the rows it read"""
+        db_create_or_update_snapshot(self.db, self.USER_ID, "2025-09-01", 2000)
+        goal_timelines.clear()
+        fired = []
+
+        def commit_during_read(conn, cursor, statement, *args):
+            if "FROM goal_changes" in statement and not fired:
+                fired.append(1)
+                writer = SessionLocal()
+                try:
+                    db_create_or_update_snapshot(writer, self.USER_ID, "2025-09-01", 3000)
+                finally:
+                    writer.close()
+
+        reader = SessionLocal()
+        event.listen(engine, "after_cursor_execute", commit_during_read)
+        try:
+            db_get_snapshot_goal(reader, self.USER_ID, "2025-09-05")
+        finally:
+            event.remove(engine, "after_cursor_execute", commit_during_read)
+            reader.close()
+        self.assertEqual(fired, [1])
+        self.assertEqual(db_get_snapshot_goal(self.db, self.USER_ID, "2025-09-05"), 3000)
+
+    def test_migration_derives_the_same_points(self):
+        """The backfilling migration step rebuilds what the write path maintains"""
+        for date_str, goal in (("2025-09-01", 2000), ("2025-09-02", 2000), ("2025-09-04", 2750)):
+            db_create_or_update_snapshot(self.db, self.USER_ID, date_str, goal)
+        maintained = self.change_points()
+
+        step = {version: fn for version, _, fn in MIGRATIONS}[7]
+        with engine.begin() as conn:
+            step(conn)
+        self.db.expire_all()
+        self.assertEqual(self.change_points(), maintained)
+
+class TestRollover(unittest.TestCase):
+    IST, EST, IDLE = "unit-test-user-rollover-ist", "unit-test-user-rollover-est", "unit-test-user-rollover-idle"
+    USERS = [IST, EST, IDLE]
+
+    def setUp(self):
+        self.db = SessionLocal()
+        purge_users(self.db, *self.USERS)
+
+    def tearDown(self):
+        self.db.close()
+
+    def snapshot(self, user_id, date_str):
+        return self.db.query(models.DailySnapshot).filter(
+            models.DailySnapshot.user_id == user_id, models.DailySnapshot.date == date_str).first()
+
+    def test_each_bucket_locks_its_own_previous_day(self):
+        """Active users get yesterday (in their timezone) locked once, with the carried goal and the day's total"""
+        db_log_intake(self.db, self.IST, 500, "2025-10-08", tz_offset_minutes=330)
+        db_create_or_update_snapshot(self.db, self.IST, "2025-10-08", 3000)
+        db_log_intake(self.db, self.EST, 500, "2025-10-07", tz_offset_minutes=-300)
+        db_create_or_update_snapshot(self.db, self.EST, "2025-10-07", 2000)
+        db_log_intake(self.db, self.EST, 2100, "2025-10-09", tz_offset_minutes=-300)  # No snapshot yet
+        db_log_intake(self.db, self.IDLE, 500, "2025-08-01", tz_offset_minutes=330)
+        db_create_or_update_snapshot(self.db, self.IDLE, "2025-08-01", 2500)
+
+        # 20:00 UTC: already the 11th in India, still the 10th in New York
+        results = db_rollover(self.db, now_utc=datetime(2025, 10, 10, 20, 0), user_ids=self.USERS)
+        self.assertEqual(results[330]["through"], "2025-10-10")
+        self.assertEqual(results[-300]["through"], "2025-10-09")
+
+        ist = self.snapshot(self.IST, "2025-10-10")
+        self.assertEqual((ist.goal_for_day, ist.total_intake, bool(ist.goal_met)), (3000, 0, False))
+        est = self.snapshot(self.EST, "2025-10-09")
+        self.assertEqual((est.goal_for_day, est.total_intake, bool(est.goal_met)), (2000, 2100, True))
+        self.assertIsNone(self.snapshot(self.EST, "2025-10-10"))
+        self.assertIsNone(self.snapshot(self.IDLE, "2025-10-10"))  # Inactive for over 30 days
+
+        again = db_rollover(self.db, now_utc=datetime(2025, 10, 10, 20, 5), user_ids=self.USERS)
+        self.assertEqual((again[330]["locked"], again[-300]["locked"]), (0, 0))
+
+    def test_day_without_aggregate_uses_raw_logs(self):
+        """A legacy day (logs but no daily_totals row) is locked with its real total, not 0"""
+        db_log_intake(self.db, self.EST, 500, "2025-10-05", tz_offset_minutes=-300)
+        db_create_or_update_snapshot(self.db, self.EST, "2025-10-05", 2000)
+        self.db.add(models.WaterIntake(user_id=self.EST, intake_ml=1200, timestamp=datetime(2025, 10, 8, 9, 0)))
+        self.db.add(models.WaterIntake(user_id=self.EST, intake_ml=900, timestamp=datetime(2025, 10, 8, 15, 0)))
+        self.db.commit()
+
+        db_rollover(self.db, now_utc=datetime(2025, 10, 10, 20, 0), catch_up_days=2, user_ids=self.USERS)
+        legacy = self.snapshot(self.EST, "2025-10-08")
+        self.assertEqual((legacy.total_intake, bool(legacy.goal_met)), (2100, True))
+        self.assertEqual(self.snapshot(self.EST, "2025-10-09").total_intake, 0)
+
+class TestDailyTotals(unittest.TestCase):
+    USER_ID = "unit-test-user-totals"
+
+    def setUp(self):
+        self.db = SessionLocal()
+        purge_users(self.db, self.USER_ID)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_log_and_delete_maintain_aggregate(self):
+        """Running total tracks inserts and deletes without re-summing"""
+        day = "2025-02-01"
+        first_id, _ = db_log_intake(self.db, self.USER_ID, 300, day)
+        db_log_intake(self.db, self.USER_ID, 450, day)
+        self.assertEqual(db_get_daily_total(self.db, self.USER_ID, day), 750)
+
+        amount, _, log_date, result = db_delete_log(self.db, first_id, self.USER_ID)
+        self.assertEqual((amount, log_date, result), (300, day, "success"))
+        self.assertEqual(db_get_daily_total(self.db, self.USER_ID, day), 450)
+        self.assertEqual(db_get_date_total(self.db, self.USER_ID, day), 450)
+
+    def test_reconcile_detects_and_fixes_drift(self):
+        """Reconciliation compares aggregates with raw rows"""
+        day = "2025-02-02"
+        db_log_intake(self.db, self.USER_ID, 500, day)
+        self.assertEqual(db_reconcile_daily_totals(self.db, self.USER_ID), [])
+
+        row = self.db.query(models.DailyTotal).filter(models.DailyTotal.user_id == self.USER_ID).one()
+        row.total_intake = 9999
+        self.db.commit()
+
+        mismatches = db_reconcile_daily_totals(self.db, self.USER_ID, fix=True)
+        self.assertEqual(len(mismatches), 1)
+        self.assertEqual(mismatches[0]["actual_total"], 500)
+        self.assertEqual(db_get_daily_total(self.db, self.USER_ID, day), 500)
+
+class TestStatsAggregation(unittest.TestCase):
+    USER_ID = "unit-test-user-stats"
+
+    def setUp(self):
+        self.db = SessionLocal()
+        purge_users(self.db, self.USER_ID)
+
+    def tearDown(self):
+        self.db.close()
+
+    def _add_legacy_log(self, timestamp, amount):
+        """A pre-local_date row: its day comes from the timestamp."""
+        self.db.add(models.WaterIntake(user_id=self.USER_ID, intake_ml=amount, timestamp=timestamp))
+        self.db.commit()
+
+    def test_grouping_covers_local_and_legacy_rows(self):
+        """SQL grouping sums local_date rows and legacy timestamp rows into the same days"""
+        db_log_intake(self.db, self.USER_ID, 400, "2025-03-02", "2025-03-02T23:30:00")
+        db_log_intake(self.db, self.USER_ID, 600, "2025-03-03", "2025-03-03T08:00:00")
+        self._add_legacy_log(datetime(2025, 3, 2, 10, 0), 250)
+        self._add_legacy_log(datetime(2025, 3, 1, 23, 59), 100)
+        self._add_legacy_log(datetime(2025, 3, 4, 0, 0), 999)  # Past the range
+
+        self.assertEqual(db_get_daily_totals(self.db, self.USER_ID, "2025-03-01", "2025-03-03"),
+                         {"2025-03-01": 100, "2025-03-02": 650, "2025-03-03": 600})
+
+        rows = db_get_stats(self.db, self.USER_ID, 4, client_date="2025-03-03")
+        self.assertEqual(rows, [{"date": "2025-03-03", "total": 600}, {"date": "2025-03-02", "total": 650},
+                                {"date": "2025-03-01", "total": 100}, {"date": "2025-02-28", "total": 0}])
+
+    def test_columnar_matches_rows(self):
+        """format=columnar carries the same days and totals as aligned arrays"""
+        from fastapi.testclient import TestClient
+        db_log_intake(self.db, self.USER_ID, 700, "2025-03-10")
+        self._add_legacy_log(datetime(2025, 3, 8, 12, 0), 300)
+
+        client = TestClient(app)
+        params = {"days": 365, "client_date": "2025-03-10"}
+        rows = client.get(f"/stats/{self.USER_ID}", params=params).json()
+        columnar = client.get(f"/stats/{self.USER_ID}", params={**params, "format": "columnar"}).json()
+
+        self.assertNotIn("daily", columnar)
+        self.assertEqual(len(columnar["dates"]), 365)
+        self.assertEqual(len(columnar["totals"]), 365)
+        self.assertEqual((columnar["dates"][0], columnar["totals"][0]), ("2025-03-10", 700))
+        self.assertEqual(columnar["totals"][columnar["dates"].index("2025-03-08")], 300)
+        self.assertEqual([{"date": d, "total": t} for d, t in zip(columnar["dates"], columnar["totals"])], rows["daily"])
+        for key in ("streak", "week_avg", "week_total", "month_total"):
+            self.assertEqual(columnar[key], rows[key])
+
+class TestSnapshotBackfill(unittest.TestCase):
+    USER_ID = "unit-test-user-backfill"
+
+    def setUp(self):
+        self.db = SessionLocal()
+        purge_users(self.db, self.USER_ID)
+
+    def tearDown(self):
+        self.db.close()
+
+    def _add_legacy_log(self, date_str, amount):
+        """Simulate pre-snapshot data: a raw log with no snapshot or aggregate."""
+        self.db.add(models.WaterIntake(
+            user_id=self.USER_ID, intake_ml=amount,
+            timestamp=datetime.strptime(f"{date_str} 09:00:00", "%Y-%m-%d %H:%M:%S")
+        ))
+        self.db.commit()
+
+    def test_backfill_carries_goal_and_advances_watermark(self):
+        """Missing days get the carried-forward goal; reruns only look past the watermark"""
+        db_create_or_update_snapshot(self.db, self.USER_ID, "2025-04-01", 2000)
+        self._add_legacy_log("2025-04-02", 2100)
+        self._add_legacy_log("2025-04-03", 1500)
+
+        self.assertEqual(db_backfill_snapshots(self.db, self.USER_ID, "2025-04-03"), 2)
+        snaps = {s.date: s for s in self.db.query(models.DailySnapshot).filter(
+            models.DailySnapshot.user_id == self.USER_ID)}
+        self.assertEqual(snaps["2025-04-02"].goal_for_day, 2000)
+        self.assertTrue(snaps["2025-04-02"].goal_met)
+        self.assertFalse(snaps["2025-04-03"].goal_met)
+
+        # Nothing new before the watermark, so a second run is a no-op
+        self._add_legacy_log("2025-04-04", 800)
+        self.assertEqual(db_backfill_snapshots(self.db, self.USER_ID, "2025-04-03"), 0)
+        self.assertEqual(db_backfill_snapshots(self.db, self.USER_ID, "2025-04-04"), 1)
+
+class TestBulkImport(unittest.TestCase):
+    USER_ID = "unit-test-user-bulk"
+
+    def setUp(self):
+        self.db = SessionLocal()
+        purge_users(self.db, self.USER_ID)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_import_dedups_and_recomputes_snapshots(self):
+        """Duplicates (in the batch and in the DB) are skipped; every touched day gets a snapshot"""
+        from fastapi.testclient import TestClient
+        logs = [{"amount": 1000, "timestamp": f"2025-04-0{d}T08:00:00Z"} for d in (1, 2, 3)]
+        logs.append({"amount": 1500, "timestamp": "2025-04-01T12:00:00Z"})
+        logs.append(dict(logs[0]))
+
+        client = TestClient(app)
+        body = client.post("/bulk-import", json={"user_id": self.USER_ID, "logs": logs, "goal": 2000}).json()
+        self.assertEqual((body["imported"], body["skipped_duplicates"]), (4, 1))
+        self.assertIn("logs_per_second", body)
+
+        body = client.post("/bulk-import", json={"user_id": self.USER_ID, "logs": logs, "goal": 2000}).json()
+        self.assertEqual((body["imported"], body["skipped_duplicates"]), (0, 5))
+
+        snaps = {s.date: s for s in self.db.query(models.DailySnapshot).filter(models.DailySnapshot.user_id == self.USER_ID)}
+        self.assertEqual(sorted(snaps), ["2025-04-01", "2025-04-02", "2025-04-03"])
+        self.assertEqual((snaps["2025-04-01"].total_intake, snaps["2025-04-01"].goal_met), (2500, True))
+        self.assertFalse(snaps["2025-04-02"].goal_met)
+        self.assertEqual(db_get_daily_total(self.db, self.USER_ID, "2025-04-01"), 2500)
+        self.assertEqual(db_reconcile_daily_totals(self.db, self.USER_ID), [])
+
+class TestClaimGuestData(unittest.TestCase):
+    USER_ID = "unit-test-user-claim"
+    GUEST_ID = "guest-local-user"
+
+    def setUp(self):
+        self.db = SessionLocal()
+        purge_users(self.db, self.USER_ID, self.GUEST_ID)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_claim_merges_overlapping_days(self):
+        """Guest logs move over; overlapping days keep the user's goal and get merged totals"""
+        from fastapi.testclient import TestClient
+        db_log_intake(self.db, self.USER_ID, 1000, "2025-05-01")
+        db_create_or_update_snapshot(self.db, self.USER_ID, "2025-05-01", 1500)
+        for day, amount in (("2025-05-01", 800), ("2025-05-02", 3000)):
+            db_log_intake(self.db, self.GUEST_ID, amount, day)
+            db_create_or_update_snapshot(self.db, self.GUEST_ID, day, 4000)
+
+        rebuilds = []
+        rebuild = backend.db_rebuild_streak_state
+        backend.db_rebuild_streak_state = lambda db, user_id: rebuilds.append(user_id) or rebuild(db, user_id)
+        try:
+            body = TestClient(app).post("/claim-guest-data", json={"user_id": self.USER_ID, "goal": 2000}).json()
+        finally:
+            backend.db_rebuild_streak_state = rebuild
+        self.assertEqual(rebuilds, [self.USER_ID])  # goal_met flipped, still one rebuild
+        self.assertEqual(body["logs_transferred"], 2)
+        self.assertEqual(body["snapshots_transferred"], 1)
+        self.assertEqual(body["dates_affected"], ["2025-05-01", "2025-05-02"])
+
+        snaps = {s.date: s for s in self.db.query(models.DailySnapshot).filter(models.DailySnapshot.user_id == self.USER_ID)}
+        self.assertEqual((snaps["2025-05-01"].goal_for_day, snaps["2025-05-01"].total_intake, snaps["2025-05-01"].goal_met), (1500, 1800, True))
+        self.assertEqual((snaps["2025-05-02"].goal_for_day, snaps["2025-05-02"].goal_met), (4000, False))
+        self.assertEqual(self.db.query(models.WaterIntake).filter(models.WaterIntake.user_id == self.GUEST_ID).count(), 0)
+        self.assertEqual(self.db.query(models.DailySnapshot).filter(models.DailySnapshot.user_id == self.GUEST_ID).count(), 0)
+        self.assertEqual(db_reconcile_daily_totals(self.db, self.USER_ID), [])
+
+class TestFixDates(unittest.TestCase):
+    USER_ID = "unit-test-user-fixdates"
+
+    def setUp(self):
+        self.db = SessionLocal()
+        purge_users(self.db, self.USER_ID)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_batch_moves_logs_and_snapshots(self):
+        """Logs move with their local_date; emptied days lose their snapshot, target days are recomputed"""
+        from fastapi.testclient import TestClient
+        for day in ("2025-06-01", "2025-06-03"):
+            db_log_intake(self.db, self.USER_ID, 2000, day, f"{day}T23:30:00")
+            db_create_or_update_snapshot(self.db, self.USER_ID, day, 2000)
+
+        fixes = [
+            {"user_id": self.USER_ID, "from_date": "2025-06-01", "to_date": "2025-06-02", "goal": 1800},
+            {"user_id": self.USER_ID, "from_date": "2025-06-03", "to_date": "2025-06-02", "goal": 1800}
+        ]
+        body = TestClient(app).post("/fix-dates/batch", json={"fixes": fixes}).json()
+        self.assertEqual(body["logs_moved"], 2)
+
+        logs = self.db.query(models.WaterIntake).filter(models.WaterIntake.user_id == self.USER_ID).all()
+        self.assertEqual({log.local_date for log in logs}, {"2025-06-02"})
+        self.assertEqual({log.timestamp.strftime("%Y-%m-%d %H:%M") for log in logs}, {"2025-06-02 23:30"})
+
+        snaps = {s.date: s for s in self.db.query(models.DailySnapshot).filter(models.DailySnapshot.user_id == self.USER_ID)}
+        self.assertEqual(list(snaps), ["2025-06-02"])
+        self.assertEqual((snaps["2025-06-02"].total_intake, snaps["2025-06-02"].goal_for_day), (4000, 1800))
+        self.assertEqual(db_reconcile_daily_totals(self.db, self.USER_ID), [])
+
+    def test_single_update_moves_legacy_rows_exactly(self):
+        """Legacy rows (no local_date) move by whole days in one UPDATE, keeping sub-second time"""
+        from backend import db_move_logs
+        stamp = datetime(2025, 6, 10, 7, 15, 30, 123456)
+        self.db.add(models.WaterIntake(user_id=self.USER_ID, intake_ml=300, timestamp=stamp))
+        db_log_intake(self.db, self.USER_ID, 200, "2025-06-10", "2025-06-10T21:00:00")
+        self.db.commit()
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            self.assertEqual(db_move_logs(self.db, self.USER_ID, "2025-06-10", "2025-06-08"), 2)
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+        self.assertEqual(len(statements), 1)
+        self.db.commit()
+        self.db.expire_all()
+
+        logs = sorted(self.db.query(models.WaterIntake).filter(models.WaterIntake.user_id == self.USER_ID),
+                      key=lambda log: log.timestamp)
+        self.assertEqual([log.timestamp for log in logs], [stamp - timedelta(days=2), datetime(2025, 6, 8, 21, 0)])
+        self.assertEqual({log.local_date for log in logs}, {"2025-06-08"})
+
+    def test_same_day_fix_applies_goal(self):
+        """from_date == to_date moves nothing but still recomputes the day with the given goal"""
+        from fastapi.testclient import TestClient
+        db_log_intake(self.db, self.USER_ID, 1900, "2025-06-05")
+        db_create_or_update_snapshot(self.db, self.USER_ID, "2025-06-05", 2500)
+
+        body = TestClient(app).post("/fix-dates", params={
+            "user_id": self.USER_ID, "from_date": "2025-06-05", "to_date": "2025-06-05", "goal": 1800
+        }).json()
+        self.assertEqual(body["logs_moved"], 1)
+
+        self.db.expire_all()
+        snap = self.db.query(models.DailySnapshot).filter(
+            models.DailySnapshot.user_id == self.USER_ID, models.DailySnapshot.date == "2025-06-05").one()
+        self.assertEqual((snap.goal_for_day, snap.total_intake, bool(snap.goal_met)), (1800, 1900, True))
+
+class TestMigrations(unittest.TestCase):
+    def test_rerun_is_a_single_version_check(self):
+        """An up-to-date database applies nothing on the next boot"""
+        from sqlalchemy import event
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            self.assertEqual(run_migrations(), MIGRATIONS[-1][0])
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+        self.assertEqual(len(statements), 1)
+
+class TestConditionalGet(unittest.TestCase):
+    USER_ID = "unit-test-user-etag"
+
+    def test_etag_revalidation(self):
+        """Unchanged data revalidates with 304 (cache-busting params ignored); a write changes the ETag"""
+        from fastapi.testclient import TestClient
+        client = TestClient(app)
+        for path in (f"/stats/{self.USER_ID}?days=30", f"/history/{self.USER_ID}?date=2025-07-01"):
+            first = client.get(path + "&_t=1")
+            self.assertEqual(first.status_code, 200)
+            etag = first.headers["etag"]
+
+            again = client.get(path + "&_t=2", headers={"If-None-Match": etag})
+            self.assertEqual(again.status_code, 304)
+            self.assertEqual(again.headers["etag"], etag)
+
+            client.post("/log", json={"user_id": self.USER_ID, "amount": 250, "goal": 2000, "date": "2025-07-01"})
+            changed = client.get(path, headers={"If-None-Match": etag})
+            self.assertEqual(changed.status_code, 200)
+            self.assertNotEqual(changed.headers["etag"], etag)
+
+class TestDashboard(unittest.TestCase):
+    USER_ID = "unit-test-user-dashboard"
+
+    def test_dashboard_matches_separate_endpoints(self):
+        """/dashboard returns what goal, drink-amount, /history and /stats return separately"""
+        from fastapi.testclient import TestClient
+        client = TestClient(app)
+        today = datetime.now().strftime("%Y-%m-%d")
+        client.put(f"/user/{self.USER_ID}/drink-amount", json={"drink_amount": 330})
+        client.post("/log", json={"user_id": self.USER_ID, "amount": 330, "goal": 2000, "date": today})
+
+        dashboard = client.get(f"/dashboard/{self.USER_ID}", params={"date": today, "client_date": today}).json()
+        history = client.get(f"/history/{self.USER_ID}", params={"date": today}).json()
+        stats = client.get(f"/stats/{self.USER_ID}", params={"days": 30, "client_date": today}).json()
+
+        self.assertEqual(dashboard["settings"]["drink_amount"], 330)
+        self.assertEqual(dashboard["settings"]["goal"], client.get(f"/user/{self.USER_ID}/goal").json()["goal"])
+        self.assertEqual(dashboard["logs"], history["logs"])
+        self.assertEqual(dashboard["total_today"], history["total_today"])
+        self.assertEqual(dashboard["historical_goal"], history["historical_goal"])
+        self.assertEqual(dashboard["stats"], stats)
+
+class TestResponseEncoding(unittest.TestCase):
+    def test_large_json_is_gzipped_but_streams_are_not(self):
+        """Big payloads are compressed; SSE must reach the client unbuffered"""
+        from fastapi.testclient import TestClient
+        client = TestClient(app)
+        stats = client.get("/stats/unit-test-user-gzip", params={"days": 365}, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(stats.headers.get("content-encoding"), "gzip")
+        self.assertEqual(len(stats.json()["daily"]), 365)
+
+        os.environ["LLM_FAKE"] = "1"
+        try:
+            stream = client.get("/ai-feedback/stream", params={"user_id": "unit-test-user-gzip", "goal": 2000},
+                                headers={"Accept-Encoding": "gzip"})
+        finally:
+            os.environ.pop("LLM_FAKE", None)
+        self.assertIsNone(stream.headers.get("content-encoding"))
+        self.assertIn("event: done", stream.text)
+
+class TestAsyncRunDb(unittest.TestCase):
+    USER_ID = "unit-test-user-async"
+
+    def setUp(self):
+        self.db = SessionLocal()
+        purge_users(self.db, self.USER_ID)
+
+    def tearDown(self):
+        self.db.close()
+
+    @unittest.skipIf(database.AsyncSessionLocal is None, "async driver not installed or DB_ASYNC=0")
+    def test_sync_orm_code_runs_on_the_async_engine(self):
+        """run_db hands fn a session bound to the async engine; commits land, failures roll back"""
+        binds = []
+
+        def log(db, amount, fail=False):
+            binds.append(db.get_bind())
+            db_log_intake(db, self.USER_ID, amount, "2025-09-15")
+            if fail:
+                db.add(models.WaterIntake(user_id=self.USER_ID, intake_ml=amount, local_date="2025-09-15",
+                                          timestamp=datetime(2025, 9, 15, 12, 0)))
+                raise RuntimeError("request failed after a write")
+
+        async def scenario():
+            await asyncio.gather(run_db(log, 300), run_db(log, 200))
+            with self.assertRaises(RuntimeError):
+                await run_db(log, 999, fail=True)
+            await database.async_engine.dispose()
+
+        asyncio.run(scenario())
+        self.assertTrue(all(bind is database.async_engine.sync_engine for bind in binds))
+        self.assertEqual(db_get_date_total(self.db, self.USER_ID, "2025-09-15"), 1499)  # db_log_intake commits itself
+        self.assertEqual(db_get_daily_total(self.db, self.USER_ID, "2025-09-15"), 1499)
+
+class TestPoolStats(unittest.TestCase):
+    def test_checkouts_are_counted(self):
+        """Every session checkout is timed; a released connection returns to the pool"""
+        before = pool_stats()["sync"]
+        db = SessionLocal()
+        db.query(models.User).first()
+        self.assertEqual(pool_stats()["sync"]["checked_out"], before.get("checked_out", 0) + 1)
+        db.close()
+        after = pool_stats()["sync"]
+        self.assertEqual(after["checkouts"], before["checkouts"] + 1)
+        self.assertEqual(after["timeouts"], 0)
+
+class TestLogBatch(unittest.TestCase):
+    USER_ID = "unit-test-user-batch"
+
+    def setUp(self):
+        self.db = SessionLocal()
+        purge_users(self.db, self.USER_ID)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_replay_is_idempotent(self):
+        """A flush that is retried after a dropped response inserts nothing twice"""
+        from fastapi.testclient import TestClient
+        client = TestClient(app)
+        entries = [
+            {"amount": 500, "date": "2025-08-01", "client_timestamp": "2025-08-01T09:00:00", "idempotency_key": "a"},
+            {"amount": 700, "date": "2025-08-01", "client_timestamp": "2025-08-01T10:00:00", "idempotency_key": "b"},
+            {"amount": 300, "date": "2025-08-02", "client_timestamp": "2025-08-02T09:00:00", "idempotency_key": "c"},
+            {"amount": 200, "date": "2025-08-02"}
+        ]
+        body = client.post("/log/batch", json={"user_id": self.USER_ID, "goal": 1000, "entries": entries}).json()
+        self.assertEqual((body["created"], body["duplicates"]), (4, 0))
+        self.assertTrue(all(r["log_id"] for r in body["results"]))
+        self.assertEqual(body["days"]["2025-08-01"], {"goal": 1000, "total": 1200, "goal_met": True})
+
+        body = client.post("/log/batch", json={"user_id": self.USER_ID, "goal": 1000, "entries": entries[:3]}).json()
+        self.assertEqual((body["created"], body["duplicates"]), (0, 3))
+        self.assertEqual(db_get_daily_total(self.db, self.USER_ID, "2025-08-01"), 1200)
+        self.assertEqual(db_get_daily_total(self.db, self.USER_ID, "2025-08-02"), 500)
+        self.assertEqual(db_reconcile_daily_totals(self.db, self.USER_ID), [])
+
+class TestHistoryPagination(unittest.TestCase):
+    USER_ID = "unit-test-user-history"
+
+    def setUp(self):
+        self.db = SessionLocal()
+        purge_users(self.db, self.USER_ID)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_pages_cover_every_log_once(self):
+        """Keyset pages are disjoint, newest first, and respect the date filter"""
+        from fastapi.testclient import TestClient
+        client = TestClient(app)
+        for day in range(1, 8):
+            for _ in range(3):
+                db_log_intake(self.db, self.USER_ID, 100 * day, f"2025-10-0{day}")
+
+        seen, cursor = [], None
+        while True:
+            params = {"limit": 5, **({"cursor": cursor} if cursor else {})}
+            page = client.get(f"/users/{self.USER_ID}/logs", params=params).json()
+            seen.extend(log["id"] for log in page["logs"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), 21)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+        page = client.get(f"/users/{self.USER_ID}/logs",
+                          params={"start_date": "2025-10-02", "end_date": "2025-10-03", "limit": 100}).json()
+        self.assertEqual({log["date"] for log in page["logs"]}, {"2025-10-02", "2025-10-03"})
+        self.assertEqual((len(page["logs"]), page["next_cursor"]), (6, None))
+
+        self.assertEqual(client.get(f"/users/{self.USER_ID}/logs", params={"limit": 100000}).json()["limit"], 500)
+        self.assertEqual(client.get(f"/users/{self.USER_ID}/logs", params={"start_date": "10/02/2025"}).status_code, 400)
+
+class TestMetrics(unittest.TestCase):
+    USER_ID = "unit-test-user-metrics"
+
+    def setUp(self):
+        metrics.reset()
+        self.threshold = metrics.SLOW_REQUEST_MS
+
+    def tearDown(self):
+        metrics.SLOW_REQUEST_MS = self.threshold
+        metrics.reset()
+
+    def test_statements_are_counted_per_route(self):
+        """Requests are labelled by route template and their SQL statements are attributed to them"""
+        from fastapi.testclient import TestClient
+        client = TestClient(app)
+        metrics.SLOW_REQUEST_MS = 0
+        client.get(f"/history/{self.USER_ID}")
+
+        slow = list(metrics.slow_requests)
+        self.assertEqual(slow[-1]["route"], "/history/{user_id}")
+        self.assertGreater(slow[-1]["statement_count"], 0)
+        self.assertEqual(len(slow[-1]["statements"]), slow[-1]["statement_count"])
+
+        self.assertNotIn("path", slow[-1])  # Raw paths carry user ids
+
+        text = client.get("/metrics").text
+        self.assertIn('smartsip_http_requests_total{method="GET",route="/history/{user_id}",status="200"} 1', text)
+        self.assertIn('smartsip_db_statements_per_request_count{method="GET",route="/history/{user_id}"} 1', text)
+        self.assertIn("smartsip_db_pool_checked_out", text)
+        self.assertIn("# TYPE smartsip_llm_calls_total counter", text)
+        self.assertIn("# TYPE smartsip_ai_cache_hits_total counter", text)
+        self.assertIn("# TYPE smartsip_ai_cache_entries gauge", text)
+
+    def test_label_values_are_escaped(self):
+        text = metrics.render_prometheus({"smartsip_test": {(("name", 'a\\b "c"\nd'),): 1}})
+        self.assertIn('smartsip_test{name="a\\\\b \\"c\\"\\nd"} 1', text)
+
+    def test_ops_endpoints_require_the_token_when_set(self):
+        from fastapi.testclient import TestClient
+        client = TestClient(app)
+        backend.OPS_TOKEN = "unit-test-ops-token"
+        try:
+            for path in ("/metrics", "/debug/slow-requests", "/debug/pool", f"/debug/snapshots/{self.USER_ID}"):
+                self.assertEqual(client.get(path).status_code, 401)
+                self.assertEqual(client.get(path, headers={"Authorization": "Bearer wrong"}).status_code, 401)
+                self.assertEqual(client.get(path, headers={"Authorization": "Bearer unit-test-ops-token"}).status_code, 200)
+        finally:
+            backend.OPS_TOKEN = None
+
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.db = SessionLocal()
+
+    def tearDown(self):
+        benchmark.clear_benchmark_data(self.db)
+        self.db.close()
+        metrics.reset()
+
+    def test_seed_is_deterministic_and_consistent(self):
+        """The same seed yields the same history, with snapshots matching the logs"""
+        first = benchmark.seed(self.db, users=4, days=10, seed=7)
+        totals = sorted(self.db.query(models.DailySnapshot.user_id, models.DailySnapshot.date, models.DailySnapshot.total_intake)
+                        .filter(models.DailySnapshot.user_id.like("bench-%")).all())
+        self.assertEqual(benchmark.seed(self.db, users=4, days=10, seed=7), first)
+        self.assertEqual(sorted(self.db.query(models.DailySnapshot.user_id, models.DailySnapshot.date, models.DailySnapshot.total_intake)
+                                .filter(models.DailySnapshot.user_id.like("bench-%")).all()), totals)
+        self.assertGreater(first, 0)
+        for user_id, date_str, total in totals:
+            self.assertEqual(db_get_date_total(self.db, user_id, date_str), total)
+
+    def test_report_has_latency_and_query_counts(self):
+        """A short run reports percentiles, throughput and statements per request"""
+        benchmark.seed(self.db, users=3, days=5, seed=1)
+        ctx = benchmark.load_context(self.db, days=5, seed=1)
+        scenarios = [s for s in benchmark.SCENARIOS if s[0] in ("stats_30d", "log", "delete_log")]
+        results = asyncio.run(benchmark.run_benchmark(ctx, scenarios, requests=6, concurrency=2, warmup=0))
+        for name in ("stats_30d", "log", "delete_log"):
+            self.assertEqual((results[name]["requests"], results[name]["errors"]), (6, 0))
+            self.assertLessEqual(results[name]["p50_ms"], results[name]["p99_ms"])
+            self.assertGreater(results[name]["queries_per_request"], 0)
+        self.assertEqual(results["stats_30d"]["routes"], ["GET /stats/{user_id}"])
+
+class TestStreakState(unittest.TestCase):
+    USER_ID = "unit-test-user-streak"
+
+    def setUp(self):
+        self.db = SessionLocal()
+        purge_users(self.db, self.USER_ID)
+
+    def tearDown(self):
+        self.db.close()
+
+    def _set_day(self, offset, met):
+        date_str = (datetime.now() - timedelta(days=offset)).strftime("%Y-%m-%d")
+        db_create_or_update_snapshot(self.db, self.USER_ID, date_str, 2000, total=2500 if met else 500)
+
+    def _best_streak(self):
+        met = sorted({s.date for s in self.db.query(models.DailySnapshot).filter(
+            models.DailySnapshot.user_id == self.USER_ID, models.DailySnapshot.goal_met == True)})
+        best = run = 0
+        previous = None
+        for day in met:
+            d = datetime.strptime(day, "%Y-%m-%d")
+            run = run + 1 if previous and d - previous == timedelta(days=1) else 1
+            best = max(best, run)
+            previous = d
+        return best
+
+    def test_grace_rule(self):
+        """Today not met yet: the run ending yesterday still counts"""
+        self._set_day(1, True)
+        self._set_day(2, True)
+        self._set_day(0, False)
+        self.assertEqual(db_get_current_streak(self.db, self.USER_ID), 2)
+        self._set_day(0, True)
+        self.assertEqual(db_get_current_streak(self.db, self.USER_ID), 3)
+
+    def test_read_without_state_does_not_write(self):
+        """A user with no persisted state gets a computed streak; the row is only stored by a write"""
+        self._set_day(1, True)
+        self._set_day(0, True)
+        self.db.query(models.StreakState).filter(models.StreakState.user_id == self.USER_ID).delete()
+        self.db.commit()
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            self.assertEqual(db_get_current_streak(self.db, self.USER_ID), 2)
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+        self.assertFalse([sql for sql in statements if not sql.lstrip().upper().startswith("SELECT")])
+        self.db.rollback()
+        self.assertEqual(self.db.query(models.StreakState).filter(models.StreakState.user_id == self.USER_ID).count(), 0)
+
+        self._set_day(2, True)
+        self.assertEqual(self.db.query(models.StreakState).filter(models.StreakState.user_id == self.USER_ID).one().current_length, 3)
+
+    def test_incremental_matches_full_scan(self):
+        """Random backdated edits keep the O(1) state equal to the 365-day scan"""
+        rng = random.Random(42)
+        db_rebuild_streak_state(self.db, self.USER_ID)
+        self.db.commit()
+        for _ in range(150):
+            self._set_day(rng.randint(0, 25), rng.random() > 0.3)
+            self.assertEqual(
+                db_get_current_streak(self.db, self.USER_ID),
+                db_get_streak_from_snapshots(self.db, self.USER_ID)
+            )
+            state = self.db.query(models.StreakState).filter(models.StreakState.user_id == self.USER_ID).one()
+            self.assertEqual(state.best_streak, self._best_streak())
+
+class TestLeaderboardStandings(unittest.TestCase):
+    USERS = ["unit-test-lb-a", "unit-test-lb-b", "unit-test-lb-c"]
+
+    def setUp(self):
+        self.db = SessionLocal()
+        purge_users(self.db, *self.USERS)
+        self.challenge = models.Challenge(
+            creator_id=self.USERS[0], name="Unit Test Challenge", goal_ml=2000, duration_days=3,
+            start_date="2025-05-01", end_date="2025-05-04", invite_code=f"UT{random.randint(0, 999999):06d}"
+        )
+        self.db.add(self.challenge)
+        self.db.commit()
+        for user_id in self.USERS:
+            self.db.add(models.ChallengeParticipant(challenge_id=self.challenge.id, user_id=user_id))
+        self.db.commit()
+        invalidate_challenge_standings(self.challenge.id)  # SQLite may reuse a deleted challenge's id
+
+    def tearDown(self):
+        self.db.query(models.ChallengeParticipant).filter(
+            models.ChallengeParticipant.challenge_id == self.challenge.id).delete()
+        self.db.delete(self.challenge)
+        self.db.commit()
+        self.db.close()
+
+    def test_grouped_standings_match_per_day_totals(self):
+        """One grouped query ranks by days met, then total ml"""
+        a, b, c = self.USERS
+        db_log_intake(self.db, a, 2500, "2025-05-01")
+        db_log_intake(self.db, a, 2000, "2025-05-02")
+        db_log_intake(self.db, b, 3000, "2025-05-01")
+        db_log_intake(self.db, b, 1500, "2025-05-02")
+        db_log_intake(self.db, b, 2500, "2025-05-04")  # Inside the window, past the goal days
+        db_log_intake(self.db, c, 5000, "2025-04-30")  # Before the challenge
+
+        standings, rank_by_user = get_challenge_standings(self.db, self.challenge)
+        self.assertEqual([e["user_id"] for e in standings], [a, b, c])
+        self.assertEqual((rank_by_user[a]["days_goal_met"], rank_by_user[a]["total_ml"]), (2, 4500))
+        self.assertEqual((rank_by_user[b]["days_goal_met"], rank_by_user[b]["total_ml"]), (1, 7000))
+        self.assertEqual((rank_by_user[c]["days_goal_met"], rank_by_user[c]["total_ml"]), (0, 0))
+
+        # Cached until the participant writes again
+        db_log_intake(self.db, c, 9000, "2025-05-03")
+        self.assertEqual(get_challenge_standings(self.db, self.challenge)[1][c]["total_ml"], 0)
+        invalidate_user_standings(c)
+        self.assertEqual(get_challenge_standings(self.db, self.challenge)[0][1]["user_id"], c)
+
+    def test_live_stream_pushes_rank_deltas(self):
+        """A write from a worker thread reaches an open stream as a delta with the new ranks"""
+        a, b, c = self.USERS
+        db_log_intake(self.db, a, 1000, "2025-05-01")
+        leaderboard_hub.debounce = 0.01
+        challenge_id = self.challenge.id
+
+        async def scenario():
+            events = leaderboard_hub.stream(challenge_id)
+            snapshot = await events.__anext__()
+            self.assertTrue(snapshot.startswith("event: snapshot"))
+
+            def write():
+                db = SessionLocal()
+                try:
+                    db_log_intake(db, c, 2500, "2025-05-02")
+                    invalidate_user_standings(c)
+                finally:
+                    db.close()
+            await asyncio.to_thread(write)
+            delta = await asyncio.wait_for(events.__anext__(), 5)
+            await events.aclose()
+            return json.loads(delta.split("data: ", 1)[1])
+
+        delta = asyncio.run(scenario())
+        changes = {entry["user_id"]: entry for entry in delta["changes"]}
+        self.assertEqual((changes[c]["rank"], changes[c]["previous_rank"]), (1, 3))
+        self.assertEqual(changes[a]["rank"], 2)
+        self.assertEqual((changes[b]["rank"], changes[b]["previous_rank"]), (3, 2))
+
+class TestRedisBroker(unittest.TestCase):
+    @unittest.skipIf(importlib.util.find_spec("redis") is None, "optional redis package not installed")
+    def test_unresponsive_redis_does_not_block_the_loop(self):
+        """publish() only queues; the stalled send times out on the publisher task"""
+        import socket
+        import leaderboard_events
+        sink = socket.socket()  # Accepts connections, never answers
+        sink.bind(("127.0.0.1", 0))
+        sink.listen(8)
+        timeout, leaderboard_events.BROKER_TIMEOUT = leaderboard_events.BROKER_TIMEOUT, 0.2
+        broker = leaderboard_events.RedisBroker(f"redis://127.0.0.1:{sink.getsockname()[1]}")
+
+        async def scenario():
+            start = time.perf_counter()
+            broker.publish({"user_id": "unit-test-lb-a"})
+            publish_seconds = time.perf_counter() - start
+            ticks = []
+            while not broker.publish_failures and time.perf_counter() - start < 15:
+                tick = time.perf_counter()
+                await asyncio.sleep(0.01)
+                ticks.append(time.perf_counter() - tick)
+            return publish_seconds, max(ticks)
+
+        try:
+            publish_seconds, slowest_tick = asyncio.run(scenario())
+        finally:
+            leaderboard_events.BROKER_TIMEOUT = timeout
+            sink.close()
+        self.assertEqual(broker.publish_failures, 1)
+        self.assertLess(publish_seconds, 0.05)
+        self.assertLess(slowest_tick, 0.15)
+
+class TestFeedbackCache(unittest.TestCase):
+    def test_concurrent_misses_are_coalesced(self):
+        """Identical concurrent requests share one upstream call"""
+        cache = FeedbackCache(ttl=60)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "Keep sipping! 💧"
+
+        async def scenario():
+            results = await asyncio.gather(*[cache.get_or_compute("50:2500", compute) for _ in range(5)])
+            results.append(await cache.get_or_compute("50:2500", compute))
+            return results
+
+        results = asyncio.run(scenario())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(set(results), {"Keep sipping! 💧"})
+        stats = cache.stats()
+        self.assertEqual((stats["misses"], stats["coalesced"], stats["hits"]), (1, 4, 1))
+
+    def test_concurrent_streams_share_one_upstream(self):
+        """Identical concurrent streams (including a late joiner) replay one upstream stream"""
+        cache = FeedbackCache(ttl=60)
+        calls = []
+
+        async def produce():
+            calls.append(1)
+            for chunk in ("Keep ", "sipping", "! 💧"):
+                await asyncio.sleep(0.01)
+                yield chunk
+
+        async def consume(delay=0):
+            await asyncio.sleep(delay)
+            return [chunk async for chunk in cache.stream("50:2500", produce)]
+
+        async def scenario():
+            return await asyncio.gather(consume(), consume(), consume(delay=0.015))
+
+        results = asyncio.run(scenario())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [["Keep ", "sipping", "! 💧"]] * 3)
+        self.assertEqual(cache.get("50:2500"), "Keep sipping! 💧")
+        stats = cache.stats()
+        self.assertEqual((stats["misses"], stats["coalesced"], stats["inflight"]), (1, 2, 0))
+
+    def test_abandoned_stream_is_cancelled_and_not_cached(self):
+        cache = FeedbackCache(ttl=60)
+        closed = []
+
+        async def produce():
+            try:
+                while True:
+                    yield "sip "
+                    await asyncio.sleep(0.01)
+            finally:
+                closed.append(1)
+
+        async def scenario():
+            chunks = cache.stream("10:2500", produce)
+            self.assertEqual(await chunks.__anext__(), "sip ")
+            await chunks.aclose()
+            await asyncio.sleep(0.02)
+
+        asyncio.run(scenario())
+        self.assertEqual(closed, [1])
+        self.assertIsNone(cache.get("10:2500"))
+        self.assertEqual(cache.stats()["inflight"], 0)
+
+    def test_failures_are_not_cached_and_lru_evicts(self):
+        cache = FeedbackCache(ttl=60, max_entries=2)
+
+        async def fail():
+            raise RuntimeError("upstream down")
+
+        with self.assertRaises(RuntimeError):
+            asyncio.run(cache.get_or_compute("a", fail))
+        self.assertIsNone(cache.get("a"))
+
+        for key in ("a", "b", "c"):
+            cache.set(key, key.upper())
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("c"), "C")
+
+    def test_persistent_table_survives_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "ai_cache.db")
+            asyncio.run(FeedbackCache(ttl=60, persist_path=path).store("75:2000", "Almost there! 🚰"))
+            restarted = FeedbackCache(ttl=60, persist_path=path)
+            self.assertIsNone(restarted.get("75:2000"))  # The sync lookup is memory-only
+            self.assertEqual(asyncio.run(restarted.fetch("75:2000")), "Almost there! 🚰")
+            self.assertEqual(restarted.get("75:2000"), "Almost there! 🚰")
+            self.assertEqual(restarted.stats()["persisted_hits"], 1)
+
+class TestAIFeedbackStream(unittest.TestCase):
+    def setUp(self):
+        self._env = {k: os.environ.get(k) for k in ("LLM_FAKE", "LLM_FAKE_DELAY", "LLM_FAKE_FAIL")}
+        os.environ["LLM_FAKE"] = "1"
+        os.environ["LLM_FAKE_DELAY"] = "0.02"
+
+    def tearDown(self):
+        for key, value in self._env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+    def test_first_token_arrives_before_completion(self):
+        """Streaming: time-to-first-token is a fraction of full generation time"""
+        async def scenario():
+            start = time.perf_counter()
+            first_token_at = None
+            events = []
+            async for event in ai_feedback_events(1234, 9999):
+                if first_token_at is None and event.startswith("event: token"):
+                    first_token_at = time.perf_counter() - start
+                events.append(event)
+            return first_token_at, time.perf_counter() - start, events
+
+        ttft, total, events = asyncio.run(scenario())
+        self.assertTrue(events[-1].startswith("event: done"))
+        self.assertLess(ttft, total / 4)
+
+    def test_sse_endpoint(self):
+        from fastapi.testclient import TestClient
+        response = TestClient(app).get("/ai-feedback/stream", params={"user_id": TEST_USER_ID, "goal": 4321})
+        self.assertEqual(response.headers["content-type"].split(";")[0], "text/event-stream")
+        self.assertIn("event: token", response.text)
+        self.assertIn("event: done", response.text)
+
+    def test_breaker_opens_and_fails_fast(self):
+        """Consecutive upstream failures open the breaker; later calls never reach upstream"""
+        os.environ["LLM_FAKE_FAIL"] = "1"
+        client = LLMClient()
+        client.breaker = CircuitBreaker(threshold=2, cooldown=60)
+
+        async def scenario():
+            for _ in range(2):
+                with self.assertRaises(RuntimeError):
+                    await client.complete("prompt", "key")
+            start = time.perf_counter()
+            with self.assertRaises(LLMUnavailableError):
+                await client.complete("prompt", "key")
+            return time.perf_counter() - start
+
+        self.assertLess(asyncio.run(scenario()), 0.01)
+        self.assertEqual(client.breaker.state, "open")
+        self.assertEqual(client.stats()["latency_seconds"]["count"], 2)
+
+    def test_abandoned_call_is_neither_success_nor_failure(self):
+        """A caller that gives up keeps the failure count and frees the half-open trial slot"""
+        client = LLMClient()
+        client.breaker = CircuitBreaker(threshold=2, cooldown=0)
+
+        async def abandon():
+            tokens = client.stream("prompt", "key")
+            await tokens.__anext__()
+            await tokens.aclose()
+
+        client.breaker.record_failure()
+        asyncio.run(abandon())
+        self.assertEqual((client.breaker.state, client.breaker.failures), ("closed", 1))
+
+        client.breaker.record_failure()  # Opens; cooldown 0 lets the next call in as the trial
+        asyncio.run(abandon())
+        self.assertEqual(client.breaker.state, "half_open")
+        self.assertTrue(client.breaker.allow())
+        self.assertEqual((client.in_flight, client.stats()["latency_seconds"]["count"]), (0, 0))
+
+    def test_key_change_closes_previous_client(self):
+        client = LLMClient()
+
+        async def scenario():
+            first = await client._get_client("key-a")
+            await client._done_with(first)
+            second = await client._get_client("key-b")
+            self.assertTrue(first.is_closed())
+
+            await client._get_client("key-c")  # `second` still has a call in flight
+            self.assertFalse(second.is_closed())
+            await client._done_with(second)
+            self.assertTrue(second.is_closed())
+            await client.aclose()
+
+        asyncio.run(scenario())
+
+    def test_open_breaker_serves_templated_fallback(self):
+        llm_client.breaker.state, llm_client.breaker.opened_at = "open", time.monotonic()
+        try:
+            message = asyncio.run(get_ai_feedback(2450, 2500))
+        finally:
+            llm_client.breaker.record_success()
+        self.assertIn("Almost there", message)
+
 if __name__ == '__main__':
     unittest.main()
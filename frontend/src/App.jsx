@@ -227,20 +227,7 @@ export default function App() {
     }
   }, [globalDefaultGoal]);
 
-  // CLOUD SYNC: Fetch goal from cloud on app load (NOT in guest mode)
-  useEffect(() => {
-    if (!auth.isGuest && USER_ID) {
-      fetch(`${API_URL}/user/${USER_ID}/goal`)
-        .then(res => res.ok ? res.json() : null)
-        .then(data => {
-          if (data && data.goal && data.goal !== globalDefaultGoal) {
-            console.log(`[SmartSip] Cloud goal sync: ${data.goal}ml`);
-            setGlobalDefaultGoal(data.goal);
-          }
-        })
-        .catch(e => console.log('Goal cloud fetch failed:', e));
-    }
-  }, [USER_ID, auth.isGuest]);
+  // CLOUD SYNC: The cloud goal is applied from the /dashboard response (see UNIFIED DATA FETCH)
 
   const [drinkAmount, setDrinkAmount] = useState(() => {
     const saved = localStorage.getItem('drinkAmount');
@@ -261,20 +248,7 @@ export default function App() {
     }
   }, [drinkAmount]);
 
-  // CLOUD SYNC: Fetch drink amount from cloud on app load
-  useEffect(() => {
-    if (!auth.isGuest && USER_ID) {
-      fetch(`${API_URL}/user/${USER_ID}/drink-amount`)
-        .then(res => res.ok ? res.json() : null)
-        .then(data => {
-          if (data && data.drink_amount && data.drink_amount !== drinkAmount) {
-            console.log(`[SmartSip] Cloud drink amount sync: ${data.drink_amount}ml`);
-            setDrinkAmount(data.drink_amount);
-          }
-        })
-        .catch(e => console.log('Drink amount cloud fetch failed:', e));
-    }
-  }, [USER_ID, auth.isGuest]);
+  // CLOUD SYNC: The cloud drink amount is applied from the /dashboard response (see UNIFIED DATA FETCH)
 
   const [isBackendConnected, setIsBackendConnected] = useState(false);
   const [streak, setStreak] = useState(0);
@@ -567,6 +541,7 @@ export default function App() {
   // if the dependencies change (e.g. user ID updates from Guest -> User)
   // ============================================================================
   const lastFetchedUserId = useRef(null);
+  const cloudSettingsAppliedFor = useRef(null);
 
   useEffect(() => {
     // Wait for auth to finish loading
@@ -587,35 +562,44 @@ export default function App() {
       return;
     }
 
-    const cacheBust = `_t=${Date.now()}`;
+    // No cache-busting: the API sends ETags with Cache-Control: no-cache, so the
+    // browser revalidates and gets a cheap 304 when nothing changed.
     console.log(`[SmartSip v1.5.8] Auth ready! Fetching ALL data for user: ${currentUserId}`);
 
     const fetchAllData = async () => {
       try {
-        const [statsRes, historyRes] = await Promise.all([
-          fetch(`${API_URL}/stats/${currentUserId}?days=30&goal=${globalDefaultGoal}&client_date=${getLocalDateString()}&${cacheBust}`, {
-            signal: abortController.signal
-          }),
-          fetch(`${API_URL}/history/${currentUserId}?date=${selectedDate}&${cacheBust}`, {
-            signal: abortController.signal
-          })
-        ]);
-
-        // Process stats
-        if (statsRes.ok) {
-          const statsData = await statsRes.json();
-          console.log(`[SmartSip v1.5.8] Stats received: streak=${statsData.streak}`);
-          setStreak(statsData.streak || 0);
-          setStatsData(statsData);
-        }
+        // One round trip: settings, the selected day's logs/total/goal and 30-day stats
+        const dashboardRes = await fetch(
+          `${API_URL}/dashboard/${currentUserId}?date=${selectedDate}&client_date=${getLocalDateString()}&days=30`,
+          { signal: abortController.signal }
+        );
+        if (dashboardRes.ok) {
+          const data = await dashboardRes.json();
+
+          // CLOUD SYNC: Apply cloud goal/glass size once per signed-in user (NOT in guest mode),
+          // so later refetches (date changes) never override a local edit that is still syncing
+          if (!auth.isGuest && cloudSettingsAppliedFor.current !== currentUserId) {
+            cloudSettingsAppliedFor.current = currentUserId;
+            if (data.settings.goal && data.settings.goal !== globalDefaultGoal) {
+              console.log(`[SmartSip] Cloud goal sync: ${data.settings.goal}ml`);
+              setGlobalDefaultGoal(data.settings.goal);
+            }
+            if (data.settings.drink_amount && data.settings.drink_amount !== drinkAmount) {
+              console.log(`[SmartSip] Cloud drink amount sync: ${data.settings.drink_amount}ml`);
+              setDrinkAmount(data.settings.drink_amount);
+            }
+          }
+
+          // Process stats
+          console.log(`[SmartSip v1.5.8] Stats received: streak=${data.stats.streak}`);
+          setStreak(data.stats.streak || 0);
+          setStatsData(data.stats);
 
-        // Process history
-        if (historyRes.ok) {
-          const historyData = await historyRes.json();
-          console.log(`[SmartSip v1.5.8] History received: total=${historyData.total_today}, logs=${historyData.logs?.length || 0}`);
-          setTodayLogs(historyData.logs || []);
-          setTotalWater(historyData.total_today || 0);
-          if (historyData.historical_goal) setHistoricalGoal(historyData.historical_goal);
+          // Process history
+          console.log(`[SmartSip v1.5.8] History received: total=${data.total_today}, logs=${data.logs?.length || 0}`);
+          setTodayLogs(data.logs || []);
+          setTotalWater(data.total_today || 0);
+          if (data.historical_goal) setHistoricalGoal(data.historical_goal);
           else setHistoricalGoal(null);
         }
 
@@ -691,10 +675,9 @@ export default function App() {
             })
           });
           // Refetch stats to update streak immediately in UI
-          const cacheBust = `_t=${Date.now()}`;
           const currentUserId = auth.userId || 'guest-local-user';
 
-          const statsRes = await fetch(`${API_URL}/stats/${currentUserId}?days=30&goal=${globalDefaultGoal}&client_date=${todayStr}&${cacheBust}`);
+          const statsRes = await fetch(`${API_URL}/stats/${currentUserId}?days=30&goal=${globalDefaultGoal}&client_date=${todayStr}`);
           if (statsRes.ok) {
             const statsData = await statsRes.json();
             if (isMounted) {
@@ -828,7 +811,9 @@ export default function App() {
           // ALWAYS send client's local date to prevent server UTC mismatch
           date: isBackdating ? selectedDate : getLocalDateString(),
           // For today's logs, send exact client timestamp for correct timezone display
-          client_timestamp: isBackdating ? null : new Date().toISOString()
+          client_timestamp: isBackdating ? null : new Date().toISOString(),
+          // Minutes east of UTC, so the nightly rollover closes our day at local midnight
+          tz_offset_minutes: -new Date().getTimezoneOffset()
         }),
       });
 
@@ -11,6 +11,33 @@ const ChallengeDetail = ({ challengeId, userId, isDarkMode, onBack }) => {
         fetchLeaderboard();
     }, [challengeId]);
 
+    // Live updates: the server pushes rank changes, so there is no polling
+    useEffect(() => {
+        if (typeof EventSource === 'undefined') return;
+        const source = new EventSource(`${API_URL}/challenges/${challengeId}/leaderboard/stream`);
+
+        const applyLeaderboard = (leaderboard) => {
+            setChallenge(prev => prev ? { ...prev, leaderboard } : prev);
+        };
+
+        source.addEventListener('snapshot', (e) => {
+            applyLeaderboard(JSON.parse(e.data).leaderboard);
+        });
+
+        source.addEventListener('delta', (e) => {
+            const { changes } = JSON.parse(e.data);
+            setChallenge(prev => {
+                if (!prev) return prev;
+                const byUser = new Map((prev.leaderboard || []).map(entry => [entry.user_id, entry]));
+                changes.forEach(entry => byUser.set(entry.user_id, { ...byUser.get(entry.user_id), ...entry }));
+                const leaderboard = [...byUser.values()].sort((a, b) => a.rank - b.rank);
+                return { ...prev, leaderboard };
+            });
+        });
+
+        return () => source.close();
+    }, [challengeId]);
+
     const fetchLeaderboard = async () => {
         try {
             const res = await fetch(`${API_URL}/challenges/${challengeId}/leaderboard`);